@@ -15,6 +15,8 @@
 信号与控制：
 - SIGTERM/SIGINT：优雅停机（清理资源并退出）
 - SIGHUP：当启用配置时触发一次热重载（不重建日志 handler）
+- 控制套接字（Unix domain，一行命令一行 JSON）：status/ping/snapshot/pause/resume/reload/flush
+- status/stop/ctl 命令行动作走轻量路径，不导入 OpenCV/NumPy、不初始化日志
 
 可靠性策略（要点）：
 - 相机初始化：多次重试，超过阈值采用长退避
@@ -23,8 +25,6 @@
 - OpenCV/未知异常：捕获并释放设备，按既定退避等待后重试
 """
 
-import cv2
-import numpy as np
 import json
 import random
 import logging
@@ -35,8 +35,21 @@ import sys
 import argparse
 import signal
 import shutil
+import socket
+import threading
 import traceback
-from datetime import datetime, time as dt_time
+import bisect
+import math
+import concurrent.futures
+import itertools
+import atexit
+import queue
+import hashlib
+import zlib
+import heapq
+import subprocess
+import glob
+from datetime import datetime, timedelta, time as dt_time
 from threading import Event
 from collections import deque
 
@@ -56,6 +69,8 @@ SCRIPT_NAME = os.path.basename(__file__)
 BASE_APP_DIR = "/opt/camera/"
 LOG_DIR = os.path.join(BASE_APP_DIR, 'logs')
 PID_FILE_PATH = f"/var/run/{SCRIPT_NAME.replace('.py', '.pid')}"
+CONTROL_SOCKET_PATH = f"/var/run/{SCRIPT_NAME.replace('.py', '.sock')}"
+CONTROL_SOCKET_ENABLED = True  # 本地控制套接字（实时状态/立即抓拍/暂停/重载/刷盘）
 IMAGE_SAVE_BASE_DIR = "/opt/camera/captures"
 
 LOG_LEVEL_CONFIG = "INFO"
@@ -63,6 +78,11 @@ LOG_FILE_NAME = "image_capture"
 LOG_ROTATE_WHEN = "midnight"
 LOG_ROTATE_INTERVAL = 1
 LOG_ROTATE_BACKUP_COUNT = 30
+LOG_ASYNC_ENABLED = True              # 经 QueueHandler 入队，由监听线程格式化并写文件/stdout，采集线程不做 I/O
+LOG_QUEUE_MAX_RECORDS = 10000         # 队列上限，写出跟不上时丢弃新记录而不是阻塞采集
+LOG_RATE_LIMIT_BURST = 20             # 同一调用位置在一个窗口内最多输出的条数（0 表示不限流）
+LOG_RATE_LIMIT_WINDOW_SECONDS = 60.0
+LOG_RATE_LIMIT_EXEMPT_LEVEL = "WARNING"  # 该级别及以上的日志不限流（告警、错误总是完整保留）
 
 DEFAULT_CAMERA_INDEX = 3
 DEFAULT_CAMERA_DEVICE_PATH = "/dev/v4l/by-id/usb-Sonix_Technology_Co.__Ltd._UGREEN_Camera_2K_SN0001-video-index0"
@@ -78,12 +98,29 @@ CAPTURE_SCHEDULE_CONFIG = [
     {"end_time_exclusive": dt_time(22, 30),  "interval_seconds": 5},
 ]
 DEFAULT_INTERVAL_LATE_NIGHT = 10
+SCHEDULE_LATE_TOLERANCE_MS = 100.0  # 抓拍晚于网格截止时刻超过该值计为迟到
 
 PARAMETER_SET_RETRIES = 3
 PARAMETER_SET_DELAY_SECONDS = 0.5
 CAMERA_INIT_FAILURE_MAX_CONSECUTIVE = 5
 CAMERA_INIT_RETRY_DELAY_SECONDS = 15
 CAMERA_INIT_LONG_BACKOFF_SECONDS = 300
+CAMERA_REQUESTED_FPS = 10
+
+# 两级采集：低分辨率探测帧做变化检测，只有探测到变化时才取全分辨率帧（off | switch | device）
+# switch: 同一设备在探测分辨率与全分辨率之间切换（降低 USB 带宽与 CPU）；device: 单独的探测设备节点
+CAPTURE_PROBE_MODE = "off"
+CAPTURE_PROBE_DEVICE: str | None = None      # device 模式的探测设备（如同一摄像头的第二个视频节点）
+CAPTURE_PROBE_WIDTH = 640
+CAPTURE_PROBE_HEIGHT = 360
+CAPTURE_PROBE_FOURCC: str | None = None      # None 表示与 REQUESTED_FOURCC 相同
+CAPTURE_PROBE_SWITCH_FLUSH_FRAMES = 2        # 切换分辨率后丢弃的帧数（传感器/曝光稳定）
+CAPTURE_PROBE_MAX_HOLD_TICKS = 50            # switch 模式：切到全分辨率后，回到探测前最多等待的连续相似 tick 数
+
+# 相机能力缓存：记录上次协商成功的参数，重启/重连时先走一次“设置+校验”的快速路径
+CAMERA_CAPS_CACHE_ENABLED = True
+CAMERA_CAPS_CACHE_FILE: str | None = None  # None 表示使用 LOG_DIR/camera_caps.json
+CAMERA_CAPS_SETTLE_SECONDS = 0.05  # 快速路径中一次性设置后的稳定等待
 
 # 读帧失败退避控制（短退避 + 长退避）
 MAX_CONSECUTIVE_READ_FAILURES = 10 # Max consecutive cap.read() failures before longer pause
@@ -97,21 +134,93 @@ IMWRITE_FAILURE_BACKOFF_SECONDS = 60  # Backoff instead of stopping the service
 
 ENABLE_TIMESTAMP = True
 TIMESTAMP_FORMAT = "%Y/%m/%d %H:%M:%S"
+# 内容检测（基于相似度路径的缩小灰度帧）：黑帧/静止帧，命中时跳过保存，连续命中时重建相机
+ENABLE_BLACK_FRAME_DETECTION = False
+BLACK_FRAME_THRESHOLD = 10.0             # 平均亮度低于该值视为黑帧
+BLACK_FRAME_CONSECUTIVE_THRESHOLD = 3
+ENABLE_STATIC_FRAME_DETECTION = False
+STATIC_FRAME_DIFF_THRESHOLD = 0.5        # 与上一帧的平均绝对差低于该值视为静止（传感器冻结时为 0）
+STATIC_FRAME_CONSECUTIVE_THRESHOLD = 5
+STATIC_FRAME_RESIZE_WIDTH: int | None = 160  # 静止检测前再缩小到该宽度；None 表示直接使用缩小灰度帧
+# 帧质量门限（同样基于缩小灰度帧）：残帧/撕裂/失焦/过曝帧跳过保存；各项阈值为 0 表示关闭该项
+ENABLE_QUALITY_GATE = False
+QUALITY_BAND_ROW_VARIANCE = 1.0          # 行内方差低于该值视为填充行（残帧底部的绿/灰色带）
+QUALITY_BAND_MIN_FRACTION = 0.04         # 底部连续填充行占比达到该值判为残帧
+QUALITY_TEAR_MIN_DIFF = 30.0             # 相邻行平均差比上一张合格帧同位置高出该值判为撕裂
+QUALITY_BLUR_RELATIVE = 0.35             # 清晰度低于近期合格帧基线的该比例判为失焦
+QUALITY_BLUR_MIN_SHARPNESS = 0.0         # 清晰度绝对下限（拉普拉斯方差 / 灰度方差）
+QUALITY_SATURATED_MAX_FRACTION = 0.5     # 过曝（>=250）像素占比超过该值判为过曝帧
+QUALITY_REINIT_CONSECUTIVE = 0           # 连续拒绝达到该值的整数倍时重建相机；0 表示不重建
+# 叠加层列表（timestamp/text/file）；为空时仅按 ENABLE_TIMESTAMP 在右下角叠加时间戳
+OVERLAY_CONFIG: list[dict] = []
+# 变化检测区域（include/exclude 矩形或多边形，坐标为采集帧像素）；为空时整帧参与比较
+DETECTION_REGIONS_CONFIG: list[dict] = []
 
 IMAGE_STORAGE_MONITOR_PATH = IMAGE_SAVE_BASE_DIR
 IMAGE_STORAGE_MAX_USAGE_PERCENT = 85
 IMAGE_STORAGE_CLEANUP_BATCH_DAYS = 1
 DISK_CHECK_INTERVAL_SECONDS = 14400
 HEARTBEAT_INTERVAL_SECONDS = 300
+# 存储预算规划：按目标保留天数计算每日字节预算，调节 JPEG 质量与相似度阈值
+STORAGE_PLANNER_ENABLED = False
+STORAGE_RETENTION_TARGET_DAYS = 30
+PLANNER_MIN_JPEG_QUALITY = 60
+PLANNER_MAX_JPEG_QUALITY: int | None = None  # None 表示使用 JPEG_SAVE_QUALITY
+PLANNER_MAX_SIMILARITY_THRESHOLD_INT = 300   # 超预算且质量已到下限时，相似度阈值最多提高到该值（3.00%）
+PLANNER_ADJUST_INTERVAL_SECONDS = 600
+PLANNER_STATE_FILE: str | None = None  # None 表示使用 LOG_DIR/storage_planner.json
 
 # 额外的可选配置（通过 YAML 启用）
-MIN_JPEG_SAVE_SIZE_BYTES = 0  # 若>0，则保存后检查文件尺寸，小于阈值视为失败
+MIN_JPEG_SAVE_SIZE_BYTES = 0  # 若>0，则保存后检查文件尺寸，小于阈值视为失败（对所有输出格式生效）
+# 输出格式：jpeg | webp | avif（AVIF 需 OpenCV 编译支持，不支持的格式启动时回退为 JPEG）
+OUTPUT_FORMAT = "jpeg"
+OUTPUT_FORMAT_OPTIONS: dict = {
+    "jpeg": {"quality": None, "optimize": False, "progressive": False},  # quality=None 表示使用 JPEG_SAVE_QUALITY
+    "webp": {"quality": 80},
+    "avif": {"quality": 60, "speed": 8},  # speed 0-9（OpenCV IMWRITE_AVIF_SPEED 的范围）：越小越慢、压缩率越高
+}
 IMAGE_SAVE_FALLBACK_DIR: str | None = None  # 备选保存目录（创建主目录失败或磁盘满时尝试）
+# 日期目录下的分片子目录（strftime，只允许 %H/%M，如 "%H" 或 "%H/%M"）；空字符串表示文件直接存放在日期目录
+CAPTURE_SHARD_FORMAT = ""
+# 多目标存储路由：按优先级写入，主目标写入延迟超过 SLO 或出错时改写备选目标，后台迁回主目标
+STORAGE_ROUTING_ENABLED = False
+STORAGE_TARGETS_CONFIG: list = []      # [{path, priority, name}]；为空时使用 IMAGE_SAVE_BASE_DIR + IMAGE_SAVE_FALLBACK_DIR
+STORAGE_WRITE_LATENCY_SLO_MS = 500.0   # 滑动窗口平均写入延迟超过该值即判定目标降级
+STORAGE_LATENCY_WINDOW = 20            # 延迟滑动窗口（写入次数）
+STORAGE_RECOVERY_PROBES = 3            # 降级目标连续多少次探测写入达标后恢复
+STORAGE_PROBE_INTERVAL_SECONDS = 30.0  # 降级目标探测 / 迁回检查间隔
+STORAGE_MIGRATE_BATCH_FILES = 200      # 每批迁回的文件数（每批一次 syncfs）
+# 变更日志（changefeed）：追加式 JSON Lines，记录落盘/删除的文件与日切标记，供下游增量同步
+CHANGEFEED_ENABLED = False
+CHANGEFEED_FILE: str | None = None      # None 表示使用 LOG_DIR/changefeed.jsonl
+CHANGEFEED_CHECKSUM = "crc32"           # crc32 | sha256 | none
+CHANGEFEED_ROTATE_BYTES = 64 * 1024 * 1024  # 日切时超过该大小则轮转为 .1（保留一个旧段）
+# 冷数据归档：超过 N 天的日期目录转为短 GOP 视频段 + 时间戳索引，校验通过后删除原始 JPEG
+COLD_ARCHIVE_ENABLED = False
+COLD_ARCHIVE_AFTER_DAYS = 7              # 早于该天数的日期目录才归档
+COLD_ARCHIVE_ENCODER = "auto"            # auto（有 ffmpeg 用 libx264，否则 OpenCV mp4v）| ffmpeg | opencv
+COLD_ARCHIVE_FFMPEG_PATH = "ffmpeg"
+COLD_ARCHIVE_GOP = 12                    # 关键帧间隔：随机读取一帧最多解码 GOP 帧
+COLD_ARCHIVE_CRF = 23                    # libx264 质量（越小越好）；OpenCV 编码器不支持设置质量
+COLD_ARCHIVE_FPS = 10.0                  # 视频段名义帧率（真实拍摄时间记录在索引中）
+COLD_ARCHIVE_VERIFY_STRIDE = 10          # 校验时每隔多少帧与原始 JPEG 比较一次 PSNR（帧数始终全量核对）
+COLD_ARCHIVE_MIN_PSNR = 30.0             # 抽检帧 PSNR 低于该值（dB）视为校验失败，保留原始文件
+COLD_ARCHIVE_CHECK_INTERVAL_SECONDS = 3600.0
+# 写回缓冲（write-behind spool）：编码结果先落在 tmpfs/内存，批量搬运到 IMAGE_SAVE_BASE_DIR，每批一次 syncfs
+SPOOL_ENABLED = False
+SPOOL_DIR: str | None = f"/dev/shm/{SCRIPT_NAME.replace('.py', '')}-spool"  # None 表示仅内存（崩溃后不可恢复）
+SPOOL_FLUSH_FILES = 50                 # 待写文件数达到该值立即批量刷写
+SPOOL_FLUSH_BYTES = 32 * 1024 * 1024   # 待写字节数达到该值立即批量刷写
+SPOOL_FLUSH_INTERVAL_SECONDS = 60.0    # 最长滞留时间
+SPOOL_MAX_BYTES = 128 * 1024 * 1024    # 超过该容量时新帧直接同步写盘，避免占满内存
 
 # --- Global Variables ---
 logger = None
 shutdown_event = Event()
 reload_event = Event()
+pause_event = Event()        # 控制命令 pause/resume：暂停期间不抓拍
+capture_now_event = Event()  # 控制命令 snapshot：立即抓拍并强制保存一帧
+wake_event = Event()         # 唤醒主循环的间隔等待（停机/控制命令）
 CONFIG_PATH = '/opt/camera/config.yaml'
 CONFIG_ENABLED = False
 consecutive_imwrite_failures = 0 # MODIFICATION v2.0.1
@@ -126,21 +235,562 @@ DEFAULT_CONTOUR_MIN_AREA_FILTER = 50.0 # 过滤掉小于此面积的差异轮廓
 last_significant_frame = None
 SIMILARITY_THRESHOLD_PERCENT_INT = 100 # 例如0.5%
 SIMILARITY_MAX_WIDTH = 640  # 相似度计算时的最大宽度（降低分辨率以节省CPU）
+FRAME_BUFFER_POOL_ENABLED = True  # 按分辨率预分配中间缓冲区（dst=），避免逐帧分配造成的内存碎片
+KEYFRAME_CACHE_SIZE = 4                 # 参考关键帧缓存容量（1 = 仅与上一显著帧比较）
+KEYFRAME_CACHE_EXPIRY_SECONDS = 1800    # 关键帧超过该时长未被命中即淘汰（光照随时间变化）
+KEYFRAME_HASH_MAX_DISTANCE = 16         # 最近关键帧的哈希汉明距离超过该值（满分 64）时直接判定为变化，跳过完整比较
+# 活动热力图与逐分钟变化强度时间线（复用关键帧比较的差异图）
+ACTIVITY_MAP_ENABLED = False
+ACTIVITY_MAP_DIR: str | None = None           # None 表示写入当天的抓拍目录（随保留策略一起清理）
+ACTIVITY_MAP_FLUSH_INTERVAL_SECONDS = 300.0   # 周期性写出间隔；日切与停机时总会写出
+# 亮度统计与去闪烁：每个保存帧的亮度统计写入当天目录的 luma_stats.jsonl；去闪烁在编码前按滚动目标亮度做 gamma 映射
+LUMA_STATS_ENABLED = False
+DEFLICKER_ENABLED = False
+DEFLICKER_TIME_CONSTANT_SECONDS = 300.0  # 目标亮度曲线（按时间加权的指数滑动平均）的时间常数
+DEFLICKER_MAX_GAMMA = 1.5                # gamma 限制在 [1/该值, 该值]，避免过度提亮/压暗
+DEFLICKER_MIN_MEAN = 8.0                 # 平均亮度低于该值（夜间近黑）时不做映射
+# 温度/负载降级：按 sysfs 温度、CPU 频率上限与平均负载逐级降低处理成本，恢复后带滞回逐级回升
+GOVERNOR_ENABLED = False
+GOVERNOR_SAMPLE_INTERVAL_SECONDS = 10.0
+GOVERNOR_THERMAL_ZONE_GLOB = "/sys/class/thermal/thermal_zone*/temp"       # 毫摄氏度，取各区最大值
+GOVERNOR_CPUFREQ_POLICY_GLOB = "/sys/devices/system/cpu/cpufreq/policy*"   # scaling_max_freq / cpuinfo_max_freq
+GOVERNOR_LOADAVG_PATH = "/proc/loadavg"
+GOVERNOR_TEMP_HIGH_C = 75.0              # 达到即视为过热
+GOVERNOR_TEMP_LOW_C = 65.0               # 低于该值才视为恢复（两者之间保持当前级别）
+GOVERNOR_FREQ_RATIO_LOW = 0.8            # 频率上限被压到最大频率的该比例以下视为降频
+GOVERNOR_FREQ_RATIO_RECOVER = 0.95
+GOVERNOR_LOAD_HIGH = 1.5                 # 每 CPU 的 1 分钟平均负载
+GOVERNOR_LOAD_LOW = 0.8
+GOVERNOR_STEP_DOWN_SAMPLES = 2           # 连续过热/过载的采样次数达到后降一级
+GOVERNOR_STEP_UP_SAMPLES = 6             # 连续恢复的采样次数达到后升一级（比降级慢，避免来回振荡）
+GOVERNOR_MAX_LEVEL = 5                   # 允许降到的最深级别（如 4 表示永不延长拍摄间隔）
+GOVERNOR_REDUCED_WIDTH = 320             # 级别 >=1：相似度比较宽度上限
+GOVERNOR_HASH_SIMILAR_DISTANCE = 4       # 级别 >=2：只用感知哈希判定，汉明距离不超过该值视为相似
+GOVERNOR_QUALITY_DROP = 15               # 级别 >=3：输出质量降低量
+GOVERNOR_MIN_QUALITY = 50
+GOVERNOR_INTERVAL_FACTOR = 2.0           # 级别 >=5：拍摄间隔倍数
 LOG_EVERY_N_READ_FAILURES = 5  # 读帧失败的日志节流
 
+# --- Lightweight CLI & Control Client ---
+# status/stop/ctl 只需要 PID 文件与控制套接字，不应为此导入 OpenCV/NumPy 或初始化日志。
+# 这一段必须位于 cv2/numpy 导入之前，脚本入口会在此处直接处理这些动作。
+LIGHTWEIGHT_ACTIONS = ('status', 'stop', 'ctl', 'changes')
+OFFLINE_ACTIONS = ('rethin', 'sweep', 'bench', 'highlights', 'archive', 'extract', 'reshard', 'soak')  # 需要 OpenCV 的离线工具，不启动服务
+SOAK_FAULTS = ('read_failure', 'imwrite_failure', 'disk_cleanup', 'reload', 'day_rollover')
+CONTROL_COMMANDS = ('status', 'ping', 'snapshot', 'pause', 'resume', 'reload', 'flush')
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    """构建命令行解析器（服务入口与轻量客户端共用）。"""
+    parser = argparse.ArgumentParser(description=f"{SCRIPT_NAME} - Image Capture Service (v{SCRIPT_VERSION})")
+    parser.add_argument('action', nargs='?', choices=['start', 'foreground'] + list(LIGHTWEIGHT_ACTIONS) + list(OFFLINE_ACTIONS),
+                        default='foreground', 
+                        help="Action: start (daemonize - for traditional init), stop, status, ctl (send a control "
+                             "command to the running service), foreground (default, for systemd/debug), "
+                             "changes (print changefeed entries after a cursor), "
+                             "rethin (re-apply similarity detection to the existing archive), "
+                             "sweep (evaluate a grid of detection parameters on a recorded sequence), "
+                             "highlights (select a time-balanced subset of frames for a condensed reel), "
+                             "archive (convert old days to video segments), extract (one frame by timestamp), "
+                             "reshard (move an existing archive to the configured shard layout), "
+                             "soak (long accelerated run with fault injection and leak/latency-drift detection), "
+                             "or bench (per-frame processing time and allocations).")
+    parser.add_argument('command', nargs='?', choices=CONTROL_COMMANDS,
+                        help="Control command for 'ctl': " + ", ".join(CONTROL_COMMANDS))
+    parser.add_argument('--pidfile', default=PID_FILE_PATH, 
+                        help=f"Path to PID file (default: {PID_FILE_PATH})")
+    parser.add_argument('--socket', default=CONTROL_SOCKET_PATH,
+                        help=f"Path to control socket (default: {CONTROL_SOCKET_PATH})")
+    parser.add_argument('--logdir', default=LOG_DIR, help=f"Path to log directory (default: {LOG_DIR})")
+    parser.add_argument('--loglevel', default=LOG_LEVEL_CONFIG, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help=f"Logging level (default: {LOG_LEVEL_CONFIG})")
+    parser.add_argument('--config', default=CONFIG_PATH, help="Path to YAML config file (optional)")
+    parser.add_argument('--use-config', action='store_true', help="Enable loading YAML config (default: disabled)")
+    feed = parser.add_argument_group("changefeed reader (changes)")
+    feed.add_argument('--changefeed', default=None,
+                      help="Changefeed journal (default: <logdir>/changefeed.jsonl); archive and reshard record the "
+                           "files they delete or move here, but only while the service is stopped - otherwise "
+                           "downstream cursors need a full resync of the affected days")
+    feed.add_argument('--cursor', type=int, default=None, help="Print entries with a sequence number above this (default: 0)")
+    feed.add_argument('--cursor-file', default=None,
+                      help="Read the cursor from this file and store the last printed sequence number back into it")
+    feed.add_argument('--files-from', action='store_true',
+                      help="Print only relative paths of added files that have not been deleted since and still "
+                           "exist under --base-dir (for rsync --files-from)")
+    feed.add_argument('--limit', type=int, default=None, help="Print at most this many entries")
+    offline = parser.add_argument_group("offline archive tools (rethin, sweep, bench, highlights, archive, extract, reshard)")
+    offline.add_argument('--base-dir', default=None,
+                         help="Archive root (default: image_save_base_dir); changes --files-from checks files here")
+    offline.add_argument('--from-day', default=None, help="First day to process, YYYY-MM/DD (inclusive)")
+    offline.add_argument('--to-day', default=None, help="Last day to process, YYYY-MM/DD (inclusive)")
+    offline.add_argument('--include-today', action='store_true', help="Also process today's (still growing) directory")
+    offline.add_argument('--workers', type=int, default=None,
+                         help="Worker processes; reshard: worker threads (default: CPU count)")
+    offline.add_argument('--threshold', type=int, default=None, help="Override similarity threshold (percent x100)")
+    offline.add_argument('--pixel-threshold', type=int, default=None, help="Override contour pixel threshold")
+    offline.add_argument('--max-width', type=int, default=None, help="Override similarity comparison width")
+    offline.add_argument('--keep-overlays', action='store_true',
+                         help="Do not mask the burned-in overlay boxes (timestamp) when comparing archived images")
+    offline.add_argument('--trash-dir', default=None, help="rethin: move rejected frames here (YYYY-MM/DD preserved)")
+    offline.add_argument('--keep-list', default=None, help="rethin: write kept file paths to this file instead")
+    offline.add_argument('--dry-run', action='store_true',
+                         help="rethin: only report reclaimable bytes (default); reshard: only count files that would move")
+    offline.add_argument('--input', default=None, help="sweep: directory of recorded frames (JPEG/PNG) or a .npy raw frame stack")
+    offline.add_argument('--grid', action='append', default=None, metavar="NAME=V1,V2,...",
+                         help="sweep: parameter values to combine; NAME is threshold, pixel_threshold, max_width, "
+                              "dilation or min_area (repeatable; unspecified names use the current config)")
+    offline.add_argument('--baseline', default=None, help="sweep: decision set written earlier with --write-baseline")
+    offline.add_argument('--write-baseline', default=None, help="sweep: save the current config's decisions here")
+    offline.add_argument('--output', default=None,
+                         help="rethin, archive, reshard: write the JSON report here (default: stdout); "
+                              "sweep: write the result table to .json or .csv; highlights: write the frame list here "
+                              "(default: stdout); extract: image file to write (required); soak: report with all samples (.json)")
+    offline.add_argument('--frames', type=int, default=200, help="bench: frames to process per variant")
+    offline.add_argument('--formats', action='store_true',
+                         help="bench: compare output formats (bytes and encode ms per frame) instead of pipeline variants; "
+                              "--input may be a recorded day directory (sampled evenly, up to --frames images)")
+    offline.add_argument('--quality-gate', action='store_true',
+                         help="bench: self-check the frame-quality gate on synthetic band/tear/blur/saturated frames "
+                              "with the configured thresholds, and time it (exit 1 on a wrong verdict)")
+    offline.add_argument('--fourcc', default=None, help="bench: synthetic frame format, MJPG (BGR) or YUYV")
+    offline.add_argument('--min-agreement', type=float, default=None,
+                         help="sweep: exit 1 if the current config agrees with the baseline less than this (0-1)")
+    offline.add_argument('--count', type=int, default=None, help="highlights: number of frames to select (default: 240)")
+    offline.add_argument('--duration', type=float, default=None,
+                         help="highlights: target reel length in seconds (frames = duration x --fps; overrides --count)")
+    offline.add_argument('--fps', type=float, default=24.0, help="highlights: reel frame rate for --duration/concat (default: 24)")
+    offline.add_argument('--buckets', type=int, default=None,
+                         help="highlights: time buckets over the selected days (default: one per hour)")
+    offline.add_argument('--min-spread', type=float, default=None,
+                         help="highlights: minimum seconds between selected frames (default: a quarter of the even spacing)")
+    offline.add_argument('--format', choices=['list', 'concat'], default='list',
+                         help="highlights: plain path list or an ffmpeg concat demuxer script")
+    offline.add_argument('--after-days', type=int, default=None,
+                         help="archive: only days older than this many days (default: disk_management.cold_archive.after_days)")
+    offline.add_argument('--keep-originals', action='store_true', help="archive: verify the segment but keep the JPEGs")
+    offline.add_argument('--at', default=None,
+                         help="extract: capture time, 'YYYY-MM-DD HH:MM:SS', epoch seconds or a capture file name")
+    soak = parser.add_argument_group("soak test harness (soak)")
+    soak.add_argument('--soak-dir', default=None,
+                      help="Scratch directory for captures and the changefeed; logs and health.json stay in --logdir (default: a new temp dir, removed on "
+                           "success). Point it at a small tmpfs/loopback mount to exercise a genuinely full disk. "
+                           "Must be empty or a previous soak directory")
+    soak.add_argument('--soak-frames', type=int, default=50000, help="Frames to capture (default: 50000)")
+    soak.add_argument('--soak-seconds', type=float, default=None, help="Stop after this many seconds even if frames remain")
+    soak.add_argument('--soak-interval', type=float, default=0.005, help="Capture interval in seconds (default: 0.005)")
+    soak.add_argument('--soak-size', default="640x360", help="Synthetic frame size WxH (default: 640x360)")
+    soak.add_argument('--fault-every', type=int, default=1000, help="Inject the next fault every N frames (0 = none)")
+    soak.add_argument('--faults', default=",".join(SOAK_FAULTS),
+                      help="Comma-separated faults to cycle through: " + ", ".join(SOAK_FAULTS))
+    soak.add_argument('--sample-seconds', type=float, default=1.0, help="RSS/FD/thread/latency sampling period")
+    soak.add_argument('--warmup', type=float, default=0.2, help="Fraction of samples ignored by the drift test")
+    offline.add_argument('--shard-format', default=None,
+                         help="reshard: target layout below each day directory, e.g. '%%H' or '%%H/%%M'; "
+                              "'' flattens (default: paths.capture_shard_format)")
+    # For true daemonization with python-daemon, more args like --user, --group, --working-directory would be needed.
+    # For now, 'start' is conceptual if not using systemd or a proper daemon library.
+    return parser
+
+def _runtime_path_candidates(path: str) -> list[str]:
+    """服务在目标目录不可写时会回退到 /tmp，客户端按同样顺序查找。"""
+    candidates = [os.path.abspath(path)]
+    fallback = os.path.join('/tmp', os.path.basename(path))
+    if fallback not in candidates:
+        candidates.append(fallback)
+    return candidates
+
+def send_control_command(socket_path: str, command: str, timeout: float = 3.0) -> dict:
+    """向运行中的服务发送一行控制命令并返回解析后的 JSON 应答。
+
+    连接失败抛出 OSError；应答不是合法 JSON 时抛出 ValueError。
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall((command.strip() + "\n").encode("utf-8"))
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            if chunk.endswith(b"\n"):
+                break
+    return json.loads(b"".join(chunks).decode("utf-8"))
+
+def _query_control_socket(socket_path: str, command: str) -> dict | None:
+    """依次尝试候选套接字路径，全部不可用时返回 None。"""
+    for candidate in _runtime_path_candidates(socket_path):
+        if not os.path.exists(candidate):
+            continue
+        try:
+            return send_control_command(candidate, command)
+        except (OSError, ValueError):
+            continue
+    return None
+
+def _read_pid(pidfile: str) -> tuple[str | None, int | None]:
+    """返回 (实际PID文件路径, PID)；文件不存在时为 (None, None)，内容非法时 PID 为 None。"""
+    for candidate in _runtime_path_candidates(pidfile):
+        if os.path.exists(candidate):
+            try:
+                with open(candidate, 'r') as f:
+                    return candidate, int(f.read().strip())
+            except (IOError, ValueError):
+                return candidate, None
+    return None, None
+
+def _cli_status(args) -> int:
+    """status：优先通过控制套接字获取实时状态，失败时回退到 PID 检查。
+
+    退出码沿用 LSB 约定：0 运行中，3 未运行，4 状态未知。
+    """
+    live = _query_control_socket(args.socket, 'status')
+    if live and live.get("ok"):
+        status = live.get("status", {})
+        print(f"{SCRIPT_NAME} is running with PID {status.get('pid')}.")
+        print(json.dumps(status, ensure_ascii=False, indent=2))
+        return 0
+
+    pid_path, pid = _read_pid(args.pidfile)
+    if pid_path is None:
+        print(f"{SCRIPT_NAME} is not running (no PID file).")
+        return 3
+    if pid is None:
+        print(f"{SCRIPT_NAME} status unknown (invalid PID file: {pid_path}).")
+        return 4
+    try:
+        os.kill(pid, 0) 
+        print(f"{SCRIPT_NAME} is running with PID {pid} (control socket unavailable).")
+        return 0
+    except ProcessLookupError:
+        print(f"{SCRIPT_NAME} is not running (PID {pid} from stale PID file {pid_path} not found). Removing PID file.")
+        try:
+            os.remove(pid_path)
+        except OSError as e:
+            print(f"Unable to remove PID file {pid_path}: {e}", file=sys.stderr)
+        return 3
+    except PermissionError:
+        print(f"{SCRIPT_NAME} with PID {pid} seems to be running, but no permission to check fully.")
+        return 4
+    except Exception as e:
+        print(f"Error checking status for PID {pid}: {e}")
+        return 4
+
+def _cli_stop(args) -> int:
+    """stop：向 PID 文件中的进程发送 SIGTERM 并最多等待 10 秒。"""
+    pid_path, pid = _read_pid(args.pidfile)
+    if pid_path is None:
+        print(f"PID file {args.pidfile} not found. Service may not be running.")
+        return 1
+    if pid is None:
+        print(f"Invalid PID file {pid_path}. Remove it manually if service is stuck.")
+        return 1
+    try:
+        print(f"Sending SIGTERM to process {pid}...")
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        print(f"Process {pid} was already terminated or PID was invalid when SIGTERM was attempted.")
+        return 0
+    except PermissionError:
+        print(f"No permission to send signal to process {pid}. Are you root?")
+        return 1
+
+    for i in range(100):  # 最多等待 10 秒
+        time.sleep(0.1)
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            print(f"Process {pid} terminated successfully within {(i + 1) / 10.0:.1f} second(s).")
+            if os.path.exists(pid_path):
+                # 进程已退出但未能自行清理 PID 文件，视为陈旧文件移除
+                print(f"Removing stale PID file {pid_path}.")
+                try:
+                    os.remove(pid_path)
+                except OSError as e:
+                    print(f"Unable to remove PID file {pid_path}: {e}", file=sys.stderr)
+            return 0
+        except Exception as e:
+            print(f"Error checking status for PID {pid}: {e}")
+            return 1
+    # 未确认终止时保留 PID 文件，它可能仍代表一个卡住的进程
+    print(f"Process {pid} did not terminate after 10 seconds. Consider manual check or SIGKILL. "
+          f"PID file {pid_path} is left in place.")
+    return 1
+
+def _cli_ctl(args) -> int:
+    """ctl <command>：发送控制命令，将 JSON 应答原样输出（供脚本/Web UI 使用）。"""
+    if not args.command:
+        print(f"Missing control command. Choose from: {', '.join(CONTROL_COMMANDS)}", file=sys.stderr)
+        return 2
+    reply = _query_control_socket(args.socket, args.command)
+    if reply is None:
+        print(json.dumps({"ok": False, "error": "control socket unavailable"}))
+        return 3
+    print(json.dumps(reply, ensure_ascii=False))
+    return 0 if reply.get("ok") else 1
+
+def _seek_changefeed(f, cursor: int) -> None:
+    """在按序号递增的日志段中二分定位到第一条 seq > cursor 的行附近（以二进制模式打开）。"""
+    f.seek(0, os.SEEK_END)
+    lo, hi = 0, f.tell()
+    while lo < hi:
+        mid = (lo + hi) // 2
+        f.seek(mid)
+        if mid:
+            f.readline()  # 跳过被截断的行
+        line = f.readline()
+        try:
+            seq = json.loads(line)["seq"] if line.strip() else None
+        except (ValueError, KeyError, TypeError):
+            seq = None
+        if seq is not None and seq <= cursor:
+            lo = mid + 1
+        else:
+            hi = mid
+    f.seek(max(0, lo - 1))
+    if lo:
+        f.readline()
+
+def read_changefeed(path: str, cursor: int) -> tuple[list[dict], int | None]:
+    """读取 seq > cursor 的记录（含轮转出的 .1 段），返回 (记录列表, 可用的最小序号)。
+
+    只读取新记录：每个日志段先按序号二分定位，代价与新增条目数成正比而非日志总长度。
+    """
+    entries: list[dict] = []
+    first_seq = None
+    for segment in (f"{path}.1", path):
+        try:
+            f = open(segment, "rb")
+        except OSError:
+            continue
+        with f:
+            head = f.readline()
+            try:
+                if first_seq is None and head.strip():
+                    first_seq = json.loads(head)["seq"]
+            except (ValueError, KeyError, TypeError):
+                pass
+            _seek_changefeed(f, cursor)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # 服务正在写入的最后一行
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("seq", 0) > cursor:
+                    entries.append(entry)
+    return entries, first_seq
+
+def _cli_changes(args) -> int:
+    """changes：按游标输出变更日志新条目（JSON Lines 或 rsync --files-from 列表）。
+
+    退出码：0 正常，1 日志不可读，2 游标早于日志保留范围（下游需要一次全量同步）。
+    """
+    path = args.changefeed or os.path.join(args.logdir, "changefeed.jsonl")
+    cursor = args.cursor
+    if cursor is None and args.cursor_file:
+        try:
+            with open(args.cursor_file, "r") as f:
+                cursor = int(f.read().strip() or 0)
+        except FileNotFoundError:
+            cursor = 0
+        except (OSError, ValueError) as e:
+            print(f"Unable to read cursor file {args.cursor_file}: {e}", file=sys.stderr)
+            return 1
+    cursor = cursor or 0
+    if not os.path.exists(path) and not os.path.exists(f"{path}.1"):
+        print(f"Changefeed {path} not found.", file=sys.stderr)
+        return 1
+    entries, first_seq = read_changefeed(path, cursor)
+    if first_seq is not None and cursor < first_seq - 1:
+        print(f"Cursor {cursor} is older than the changefeed (first seq {first_seq}); a full resync is required.",
+              file=sys.stderr)
+        return 2
+    if args.limit is not None:
+        entries = entries[:max(0, args.limit)]
+    if args.files_from:
+        base_dir = args.base_dir or IMAGE_SAVE_BASE_DIR
+        check_exists = os.path.isdir(base_dir)
+        if not check_exists:
+            print(f"Base dir {base_dir} not found; listing files without checking that they exist.", file=sys.stderr)
+        # 删除记录可以是整天目录（以 / 结尾）或单个文件，只覆盖序号更早的新增记录
+        deleted = [(e["seq"], e["path"]) for e in entries if e.get("event") == "deleted"]
+        for entry in entries:
+            if entry.get("event") != "added":
+                continue
+            path = entry["path"]
+            if any(seq > entry["seq"] and (path == gone or (gone.endswith("/") and path.startswith(gone)))
+                   for seq, gone in deleted):
+                continue
+            # 未记入日志的删除/移动（窗口之外的清理、人工操作等）以磁盘为准，避免 rsync 因文件缺失报错
+            if check_exists and not os.path.exists(os.path.join(base_dir, path)):
+                continue
+            print(path)
+    else:
+        for entry in entries:
+            print(json.dumps(entry, ensure_ascii=False))
+    last_seq = entries[-1]["seq"] if entries else cursor
+    if args.cursor_file:
+        tmp_path = f"{args.cursor_file}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(f"{last_seq}\n")
+            os.replace(tmp_path, args.cursor_file)
+        except OSError as e:
+            print(f"Unable to write cursor file {args.cursor_file}: {e}", file=sys.stderr)
+            return 1
+    print(f"# cursor={last_seq} entries={len(entries)}", file=sys.stderr)
+    return 0
+
+def run_lightweight_action(args) -> int:
+    """执行无需 OpenCV 的动作，返回退出码。"""
+    if args.action == 'status':
+        return _cli_status(args)
+    if args.action == 'stop':
+        return _cli_stop(args)
+    if args.action == 'changes':
+        return _cli_changes(args)
+    return _cli_ctl(args)
+
+# 轻量动作在导入 OpenCV/NumPy 之前处理；动作前可以有选项（如 --socket X status），
+# 先做廉价的字符串筛查，再用解析器确认该词确实是动作而不是某个选项的值
+if __name__ == "__main__" and any(arg in LIGHTWEIGHT_ACTIONS for arg in sys.argv[1:]):
+    _early_args = build_arg_parser().parse_args()
+    if _early_args.action in LIGHTWEIGHT_ACTIONS:
+        sys.exit(run_lightweight_action(_early_args))
+
+import cv2
+import numpy as np
+
 # 复用的形态学内核，避免频繁分配
 CONTOUR_KERNEL = np.ones(DEFAULT_CONTOUR_KERNEL_SIZE, np.uint8)
 
 # --- Logging Setup ---
-# (setup_logging_system function from v2.0.0 is unchanged)
-def setup_logging_system(log_dir, log_file_prefix, level_str, when, interval, backup_count):
+_log_handlers: list[logging.Handler] = []  # 实际输出 handler（文件 + stdout），异步模式下由监听线程持有
+_log_listener: logging.handlers.QueueListener | None = None
+_log_rate_limiter: 'LogRateLimiter | None' = None
+_log_records_dropped: int = 0  # 异步队列已满时丢弃的记录数
+
+def rate_limit_exempt_levelno() -> int:
+    """LOG_RATE_LIMIT_EXEMPT_LEVEL 对应的数值级别；无法识别时退回 WARNING。"""
+    level = logging.getLevelName(str(LOG_RATE_LIMIT_EXEMPT_LEVEL).upper())
+    return level if isinstance(level, int) else logging.WARNING
+
+
+class LogRateLimiter(logging.Filter):
+    """按调用位置（文件 + 行号）限流：每个窗口内最多 LOG_RATE_LIMIT_BURST 条，
+    LOG_RATE_LIMIT_EXEMPT_LEVEL（默认 WARNING）及以上级别不受限。
+
+    以调用位置而非消息文本为键，f-string 生成的不同文本也归为同一来源；窗口结束后输出的
+    第一条记录附带被抑制的条数。判断只涉及一次字典查找，不格式化消息。
+    """
+    def __init__(self) -> None:
+        super().__init__()
+        self._sites: dict[tuple, list] = {}  # 调用位置 -> [窗口起点, 已输出条数, 已抑制条数]
+        self.suppressed_total: int = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if LOG_RATE_LIMIT_BURST <= 0 or record.levelno >= rate_limit_exempt_levelno():
+            return True
+        key = (record.pathname, record.lineno)
+        site = self._sites.get(key)
+        if site is None or record.created - site[0] >= LOG_RATE_LIMIT_WINDOW_SECONDS:
+            suppressed = site[2] if site else 0
+            self._sites[key] = [record.created, 1, 0]
+            if suppressed:
+                record.msg = (f"{record.getMessage()} (前 {LOG_RATE_LIMIT_WINDOW_SECONDS:.0f}s 内同一位置另有 "
+                              f"{suppressed} 条日志被限流)")
+                record.args = None
+            return True
+        if site[1] < LOG_RATE_LIMIT_BURST:
+            site[1] += 1
+            return True
+        site[2] += 1
+        self.suppressed_total += 1
+        return False
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """只入队不格式化：消息模板与参数原样交给监听线程（异常堆栈提前展开，避免持有帧对象）。
+
+    队列已满时直接丢弃并计数（不走 handleError，避免在采集线程向 stderr 打印堆栈）。
+    """
+    def enqueue(self, record: logging.LogRecord) -> None:
+        global _log_records_dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _log_records_dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def stop_log_listener() -> None:
+    """停止监听线程（先写完队列中的记录）；未启用异步日志时无操作。"""
+    global _log_listener
+    if _log_listener is not None:
+        try:
+            _log_listener.stop()
+        except Exception:
+            pass
+        _log_listener = None
+
+atexit.register(stop_log_listener)  # 晚于 logging 注册，先于 logging.shutdown 执行
+
+def attach_log_handlers(target_logger: logging.Logger, use_queue: bool) -> None:
+    """把输出 handler 挂到 logger：直接挂载（同步写出），或经 QueueHandler 交给监听线程写出。"""
+    global _log_listener
+    stop_log_listener()
+    target_logger.handlers.clear()
+    if not use_queue:
+        for handler in _log_handlers:
+            target_logger.addHandler(handler)
+        return
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_MAX_RECORDS)
+    _log_listener = logging.handlers.QueueListener(log_queue, *_log_handlers, respect_handler_level=True)
+    _log_listener.start()
+    target_logger.addHandler(_DeferredQueueHandler(log_queue))
+
+def flush_log_queue(timeout: float = 5.0) -> bool:
+    """等待监听线程写完已入队的记录（最多 timeout 秒），并刷新输出 handler；超时返回 False。"""
+    drained = True
+    if _log_listener is not None:
+        log_queue = _log_listener.queue
+        deadline = time.monotonic() + timeout
+        with log_queue.all_tasks_done:  # Queue.join() 没有超时参数，监听线程卡住时不能无限等待
+            while log_queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    drained = False
+                    break
+                log_queue.all_tasks_done.wait(remaining)
+    for handler in _log_handlers:
+        try:
+            handler.flush()
+        except Exception:
+            pass
+    return drained
+
+def log_stats() -> dict:
+    return {
+        "async": _log_listener is not None,
+        "queue_depth": _log_listener.queue.qsize() if _log_listener is not None else 0,
+        "dropped": _log_records_dropped,
+        "rate_limited": _log_rate_limiter.suppressed_total if _log_rate_limiter else 0,
+    }
+
+def setup_logging_system(log_dir, log_file_prefix, level_str, when, interval, backup_count, console_stream=None):
     """初始化日志系统。
 
     - 创建/复用日志记录器，设置统一的格式与轮转策略
-    - 控制台与文件双通道输出
+    - 控制台与文件双通道输出（控制台默认 stdout；离线工具传入 stderr，stdout 只留给报告/列表）
     - 保守处理，避免日志异常影响主流程
     """
-    global logger
+    global logger, _log_handlers, _log_rate_limiter
     numeric_level = getattr(logging, level_str.upper(), logging.INFO)
 
     if not os.path.exists(log_dir):
@@ -161,8 +811,13 @@ def setup_logging_system(log_dir, log_file_prefix, level_str, when, interval, ba
     log_file_basename = f"{log_file_prefix}.log" # 例如 "image_capture.log"
     log_filepath = os.path.join(log_dir, log_file_basename) # 使用这个路径
 
+    stop_log_listener()
     if logger.hasHandlers():
         logger.handlers.clear()
+    _log_handlers = []
+    if _log_rate_limiter is None:
+        _log_rate_limiter = LogRateLimiter()
+        logger.addFilter(_log_rate_limiter)
 
     formatter = logging.Formatter('%(asctime)s [%(levelname)-7s] [%(process)d] [%(threadName)s] [%(name)s:%(funcName)s:%(lineno)d] %(message)s')
     
@@ -173,16 +828,17 @@ def setup_logging_system(log_dir, log_file_prefix, level_str, when, interval, ba
         )
         fh.setLevel(numeric_level)
         fh.setFormatter(formatter)
-        logger.addHandler(fh)
+        _log_handlers.append(fh)
     except Exception as e:
         print(f"WARNING: Failed to initialize file logger at {log_filepath}: {e}", file=sys.stderr)
 
-    ch = logging.StreamHandler(sys.stdout) 
+    ch = logging.StreamHandler(console_stream or sys.stdout)
     ch.setLevel(numeric_level) 
     ch.setFormatter(formatter)
-    logger.addHandler(ch)
+    _log_handlers.append(ch)
+    attach_log_handlers(logger, LOG_ASYNC_ENABLED)
     
-    logger.info(f"[LOG] 初始化完成，级别: {level_str}，文件: {log_filepath}")
+    logger.info(f"[LOG] 初始化完成，级别: {level_str}，文件: {log_filepath}，异步写出: {'是' if LOG_ASYNC_ENABLED else '否'}")
     return logger
 
 
@@ -194,7 +850,9 @@ class ServiceState:
     def __init__(self) -> None:
         self.consecutive_imwrite_failures: int = 0
         self.consecutive_read_failures: int = 0
-        self.last_significant_frame: np.ndarray | None = None
+        self.keyframes: KeyframeCache = KeyframeCache()  # 近期显著帧（缩小灰度帧 + 感知哈希）
+        self.buffers: FramePool | None = FramePool() if FRAME_BUFFER_POOL_ENABLED else None
+        self.static_probe_slot: int = 0  # 池化时静止检测探针在两个缓冲区间交替
         self.total_disk_cleanup_batches: int = 0
         self.last_heartbeat_monotonic: float = 0.0
         self.last_saved_filepath: str | None = None
@@ -207,6 +865,38 @@ class ServiceState:
         self.applied_width: int | None = None
         self.applied_height: int | None = None
         self.applied_requested_fourcc: str | None = None
+        # 相机初始化耗时与路径（cached=命中能力缓存，full=完整重试流程）
+        self.last_camera_init_ms: float = 0.0
+        self.last_camera_init_mode: str = ""
+        self.camera_init_count: int = 0
+        # 运行计数（供控制套接字实时查询）
+        self.start_monotonic: float = time.monotonic()
+        self.current_interval: float = 0.0
+        self.frames_captured: int = 0
+        self.frames_saved: int = 0
+        self.frames_similar: int = 0
+        self.scheduler: CaptureScheduler | None = None
+        self.overlays: OverlayCompositor | None = None  # 惰性构建，热重载后置空以重建
+        self.region_mask: RegionMask | None = None  # 按分辨率惰性光栅化，热重载后置空以重建
+        self.last_roi_scores: dict[str, float] = {}
+        # 内容检测（黑帧/静止帧）
+        self.static_probe: np.ndarray | None = None
+        self.consecutive_black_frames: int = 0
+        self.consecutive_static_frames: int = 0
+        self.frames_black: int = 0
+        self.frames_static: int = 0
+        self.content_reinits: int = 0
+        self.quality_gate: FrameQualityGate | None = None  # 惰性构建（启用帧质量门限时）
+        self.camera_reinit_requested: bool = False
+        self.planner: StoragePlanner | None = None  # 未启用存储预算规划时为 None
+        self.spool: WriteBehindSpool | None = None  # 未启用写回缓冲时为 None（直接写盘）
+        self.changefeed: Changefeed | None = None  # 未启用变更日志时为 None
+        self.router: StorageRouter | None = None  # 未启用多目标存储路由时为 None（主目录 + 创建失败时的回退目录）
+        self.cold_archiver: ColdArchiver | None = None  # 未启用冷数据归档时为 None
+        self.two_tier: TwoTierCapture | None = None  # 两级采集（绑定到当前 cap，相机重建时随之重建）
+        self.activity: ActivityMap | None = None  # 未启用活动热力图时为 None
+        self.luma: LumaTracker | None = None  # 惰性构建（启用亮度统计或去闪烁时）
+        self.governor: LoadGovernor | None = None  # 未启用温度/负载降级时为 None
 
 
 def log_heartbeat(state: 'ServiceState', current_interval_seconds: float) -> None:
@@ -220,6 +910,11 @@ def log_heartbeat(state: 'ServiceState', current_interval_seconds: float) -> Non
     - 最近一次保存的文件路径（如有）
     - 当前有效 FOURCC
     - 监控路径磁盘使用率
+    - 最近一次相机初始化耗时及路径（cached/full）
+    - 调度统计：tick 数、迟到/错过数、迟到时长分位数
+    - 存储预算（启用规划器时）：每日预算 vs 预计日写入量、当前 JPEG 质量与相似度阈值
+    - 写回缓冲（启用时）：待写文件数/字节数、批量刷写耗时 p95
+    - 存储路由（启用时）：当前写入目标、待迁回主目标的文件数
     """
     try:
         # 采样平均处理耗时
@@ -233,12 +928,15 @@ def log_heartbeat(state: 'ServiceState', current_interval_seconds: float) -> Non
             percent_used = (usage.used / usage.total) * 100.0
         except Exception:
             percent_used = -1.0
+        sched = state.scheduler.stats() if state.scheduler else {}
 
-        logger.info(
-            (
-                "Heartbeat | boot_id=%s, read_failures=%d, imwrite_failures=%d, disk_cleanup_batches=%d, "
-                "interval=%.3fs, avg_processing=%.2fms, last_saved='%s', fourcc='%s', disk_used=%.1f%%"
-            ),
+        fmt = (
+            "Heartbeat | boot_id=%s, read_failures=%d, imwrite_failures=%d, disk_cleanup_batches=%d, "
+            "interval=%.3fs, avg_processing=%.2fms, last_saved='%s', fourcc='%s', disk_used=%.1f%%, "
+            "camera_init=%.1fms(%s, count=%d), ticks=%d, late=%d, missed=%d, "
+            "lateness_p50=%.1fms, lateness_p95=%.1fms, lateness_max=%.1fms"
+        )
+        args = [
             state.boot_id,
             state.consecutive_read_failures,
             state.consecutive_imwrite_failures,
@@ -248,26 +946,141 @@ def log_heartbeat(state: 'ServiceState', current_interval_seconds: float) -> Non
             state.last_saved_filepath or "",
             state.effective_fourcc,
             percent_used,
-        )
+            state.last_camera_init_ms,
+            state.last_camera_init_mode or "n/a",
+            state.camera_init_count,
+            sched.get("ticks", 0),
+            sched.get("late", 0),
+            sched.get("missed", 0),
+            sched.get("lateness_p50_ms", 0.0),
+            sched.get("lateness_p95_ms", 0.0),
+            sched.get("lateness_max_ms", 0.0),
+        ]
+        if state.planner is not None:
+            plan = state.planner.stats()
+            fmt += ", budget=%.1fMB/d, projected=%.1fMB/d, today=%.1fMB, jpeg_quality=%d, similarity_thr=%d"
+            args += [
+                plan["daily_budget_mb"],
+                plan["projected_daily_mb"],
+                plan["today_mb"],
+                plan["jpeg_quality"],
+                plan["similarity_threshold_int"],
+            ]
+        if state.spool is not None:
+            spool = state.spool.stats()
+            fmt += ", spool_depth=%d(%.1fMB), spool_flush_p95=%.1fms"
+            args += [spool["depth_files"], spool["depth_bytes"] / 1024**2, spool["flush_ms_p95"]]
+        if state.two_tier is not None:
+            tier = state.two_tier.stats()
+            fmt += ", probe=%s(full_grabs=%d/%d, switch=%.0fms)"
+            args += ["on" if tier["probing"] else ("full" if tier["active"] else "fallback"),
+                     tier["full_grabs"], tier["probe_ticks"], tier["switch_ms_p50"]]
+        if state.router is not None:
+            route = state.router.stats()
+            fmt += ", storage_target=%s, pending_migration=%d"
+            args += [route["active"], route["pending_migration"]]
+        if state.quality_gate is not None and ENABLE_QUALITY_GATE:
+            fmt += ", quality_rejects=%d(%s)"
+            qg = state.quality_gate.stats()
+            args += [qg["rejected"], ",".join(f"{k}={v}" for k, v in qg["rejects"].items() if v) or "-"]
+        if _log_records_dropped:
+            fmt += ", log_dropped=%d"
+            args.append(_log_records_dropped)
+        if state.governor is not None:
+            gov = state.governor.stats()
+            fmt += ", governor=L%d(%s), temp=%sC, freq_ratio=%s, load=%s"
+            args += [gov["level"], gov["level_name"], gov["temp_c"], gov["freq_ratio"], gov["load_per_cpu"]]
+        logger.info(fmt, *args)
     except Exception:
         # 保守处理，心跳日志不能影响主流程
         pass
 
+def build_health_snapshot(state: 'ServiceState') -> dict:
+    """汇总运行指标为可 JSON 序列化的字典（health.json 与控制套接字 status 共用）。"""
+    try:
+        recent_ms = list(state.processing_times_ms)
+    except RuntimeError:  # 主线程并发追加时可能触发，退化为空窗口
+        recent_ms = []
+    return {
+        "boot_id": state.boot_id,
+        "pid": os.getpid(),
+        "ts": time.time(),
+        "uptime_s": round(time.monotonic() - state.start_monotonic, 1),
+        "paused": pause_event.is_set(),
+        "interval": state.current_interval,
+        "frames_captured": state.frames_captured,
+        "frames_saved": state.frames_saved,
+        "frames_similar": state.frames_similar,
+        "frames_black": state.frames_black,
+        "frames_static": state.frames_static,
+        "content_reinits": state.content_reinits,
+        "quality_gate": state.quality_gate.stats() if state.quality_gate else {},
+        "avg_processing_ms": round(sum(recent_ms) / len(recent_ms), 2) if recent_ms else 0.0,
+        "read_failures": state.consecutive_read_failures,
+        "imwrite_failures": state.consecutive_imwrite_failures,
+        "disk_cleanup_batches": state.total_disk_cleanup_batches,
+        "last_saved": state.last_saved_filepath,
+        "fourcc": state.effective_fourcc,
+        "camera_init_ms": round(state.last_camera_init_ms, 1),
+        "camera_init_mode": state.last_camera_init_mode,
+        "camera_init_count": state.camera_init_count,
+        "schedule": state.scheduler.stats() if state.scheduler else {},
+        "overlay_cost_ms": state.overlays.stats() if state.overlays else {},
+        "roi_change_percent": dict(state.last_roi_scores),
+        "keyframes": state.keyframes.stats(),
+        "buffer_pool": state.buffers.stats() if state.buffers else {},
+        "storage_plan": state.planner.stats() if state.planner else {},
+        "spool": state.spool.stats() if state.spool else {},
+        "two_tier_capture": state.two_tier.stats() if state.two_tier else {},
+        "logging": log_stats(),
+        "changefeed": state.changefeed.stats() if state.changefeed else {},
+        "storage_targets": state.router.stats() if state.router else {},
+        "activity_map": state.activity.stats() if state.activity else {},
+        "luma": state.luma.stats() if state.luma else {},
+        "cold_archive": state.cold_archiver.stats() if state.cold_archiver else {},
+        "governor": state.governor.stats() if state.governor else {},
+    }
+
 def load_and_apply_yaml_config(config_path: str, runtime_reload: bool = False):
     """可选：加载 YAML 配置并覆盖内置参数（未启用时跳过）。
 
     - runtime_reload=True 表示热重载（不改变日志目录，避免切换 handler）
     - 出错只记录，不影响主流程
     """
+    global CAPTURE_PROBE_MODE, CAPTURE_PROBE_DEVICE, CAPTURE_PROBE_WIDTH, CAPTURE_PROBE_HEIGHT, CAPTURE_PROBE_FOURCC
+    global CAPTURE_PROBE_SWITCH_FLUSH_FRAMES, CAPTURE_PROBE_MAX_HOLD_TICKS
     global DEFAULT_CAMERA_DEVICE_PATH, DEFAULT_WIDTH, DEFAULT_HEIGHT, REQUESTED_FOURCC
-    global JPEG_SAVE_QUALITY, IMAGE_SAVE_BASE_DIR, LOG_DIR, PID_FILE_PATH
-    global CAPTURE_SCHEDULE_CONFIG, DEFAULT_INTERVAL_LATE_NIGHT
+    global JPEG_SAVE_QUALITY, IMAGE_SAVE_BASE_DIR, LOG_DIR, PID_FILE_PATH, CAPTURE_SHARD_FORMAT
+    global OUTPUT_FORMAT
+    global CAPTURE_SCHEDULE_CONFIG, DEFAULT_INTERVAL_LATE_NIGHT, SCHEDULE_LATE_TOLERANCE_MS
     global IMAGE_STORAGE_MONITOR_PATH, IMAGE_STORAGE_MAX_USAGE_PERCENT
     global DISK_CHECK_INTERVAL_SECONDS, IMAGE_STORAGE_CLEANUP_BATCH_DAYS
     global SIMILARITY_THRESHOLD_PERCENT_INT, MIN_JPEG_SAVE_SIZE_BYTES
+    global LOG_ASYNC_ENABLED, LOG_RATE_LIMIT_BURST, LOG_RATE_LIMIT_WINDOW_SECONDS, LOG_RATE_LIMIT_EXEMPT_LEVEL
     global IMAGE_SAVE_FALLBACK_DIR, LOG_LEVEL_CONFIG, LOG_ROTATE_WHEN, LOG_ROTATE_INTERVAL, LOG_ROTATE_BACKUP_COUNT
     global BASE_APP_DIR, LOG_FILE_NAME, MAX_CONSECUTIVE_IMWRITE_FAILURES
-    global ENABLE_TIMESTAMP, TIMESTAMP_FORMAT
+    global ENABLE_TIMESTAMP, TIMESTAMP_FORMAT, OVERLAY_CONFIG, DETECTION_REGIONS_CONFIG
+    global KEYFRAME_CACHE_SIZE, KEYFRAME_CACHE_EXPIRY_SECONDS, KEYFRAME_HASH_MAX_DISTANCE, FRAME_BUFFER_POOL_ENABLED
+    global ACTIVITY_MAP_ENABLED, ACTIVITY_MAP_DIR, ACTIVITY_MAP_FLUSH_INTERVAL_SECONDS
+    global LUMA_STATS_ENABLED, DEFLICKER_ENABLED, DEFLICKER_TIME_CONSTANT_SECONDS, DEFLICKER_MAX_GAMMA, DEFLICKER_MIN_MEAN
+    global ENABLE_BLACK_FRAME_DETECTION, BLACK_FRAME_THRESHOLD, BLACK_FRAME_CONSECUTIVE_THRESHOLD
+    global ENABLE_STATIC_FRAME_DETECTION, STATIC_FRAME_DIFF_THRESHOLD, STATIC_FRAME_CONSECUTIVE_THRESHOLD
+    global STATIC_FRAME_RESIZE_WIDTH, ENABLE_QUALITY_GATE, QUALITY_BAND_ROW_VARIANCE, QUALITY_BAND_MIN_FRACTION
+    global QUALITY_TEAR_MIN_DIFF, QUALITY_BLUR_RELATIVE, QUALITY_BLUR_MIN_SHARPNESS, QUALITY_SATURATED_MAX_FRACTION
+    global QUALITY_REINIT_CONSECUTIVE
+    global CAMERA_CAPS_CACHE_ENABLED, CAMERA_CAPS_CACHE_FILE, CONTROL_SOCKET_ENABLED
+    global STORAGE_PLANNER_ENABLED, STORAGE_RETENTION_TARGET_DAYS, PLANNER_MIN_JPEG_QUALITY, PLANNER_MAX_JPEG_QUALITY
+    global PLANNER_MAX_SIMILARITY_THRESHOLD_INT, PLANNER_ADJUST_INTERVAL_SECONDS, PLANNER_STATE_FILE
+    global STORAGE_ROUTING_ENABLED, STORAGE_TARGETS_CONFIG, STORAGE_WRITE_LATENCY_SLO_MS, STORAGE_LATENCY_WINDOW
+    global STORAGE_RECOVERY_PROBES, STORAGE_PROBE_INTERVAL_SECONDS, STORAGE_MIGRATE_BATCH_FILES
+    global CHANGEFEED_ENABLED, CHANGEFEED_FILE, CHANGEFEED_CHECKSUM, CHANGEFEED_ROTATE_BYTES
+    global SPOOL_ENABLED, SPOOL_DIR, SPOOL_FLUSH_FILES, SPOOL_FLUSH_BYTES, SPOOL_FLUSH_INTERVAL_SECONDS, SPOOL_MAX_BYTES
+    global COLD_ARCHIVE_ENABLED, COLD_ARCHIVE_AFTER_DAYS, COLD_ARCHIVE_ENCODER, COLD_ARCHIVE_FFMPEG_PATH, COLD_ARCHIVE_GOP
+    global COLD_ARCHIVE_CRF, COLD_ARCHIVE_FPS, COLD_ARCHIVE_VERIFY_STRIDE, COLD_ARCHIVE_MIN_PSNR, COLD_ARCHIVE_CHECK_INTERVAL_SECONDS
+    global GOVERNOR_ENABLED, GOVERNOR_SAMPLE_INTERVAL_SECONDS, GOVERNOR_THERMAL_ZONE_GLOB, GOVERNOR_CPUFREQ_POLICY_GLOB
+    global GOVERNOR_LOADAVG_PATH, GOVERNOR_TEMP_HIGH_C, GOVERNOR_TEMP_LOW_C, GOVERNOR_FREQ_RATIO_LOW, GOVERNOR_FREQ_RATIO_RECOVER
+    global GOVERNOR_LOAD_HIGH, GOVERNOR_LOAD_LOW, GOVERNOR_STEP_DOWN_SAMPLES, GOVERNOR_STEP_UP_SAMPLES, GOVERNOR_MAX_LEVEL
+    global GOVERNOR_REDUCED_WIDTH, GOVERNOR_HASH_SIMILAR_DISTANCE, GOVERNOR_QUALITY_DROP, GOVERNOR_MIN_QUALITY, GOVERNOR_INTERVAL_FACTOR
 
     if yaml is None:
         if logger:
@@ -327,6 +1140,10 @@ def load_and_apply_yaml_config(config_path: str, runtime_reload: bool = False):
         except Exception:
             pass
         IMAGE_STORAGE_MONITOR_PATH = IMAGE_SAVE_BASE_DIR
+        try:
+            CAPTURE_SHARD_FORMAT = validate_shard_format(str(paths_cfg.get("capture_shard_format", CAPTURE_SHARD_FORMAT) or ""))
+        except ValueError as e:
+            logger.warning(f"paths.capture_shard_format 无效: {e}，保持 '{CAPTURE_SHARD_FORMAT}'。")
         if image_save_fallback_dir_val:
             try:
                 IMAGE_SAVE_FALLBACK_DIR = str(image_save_fallback_dir_val)
@@ -348,6 +1165,11 @@ def load_and_apply_yaml_config(config_path: str, runtime_reload: bool = False):
         LOG_ROTATE_WHEN = str(logging_cfg.get("rotate_when", LOG_ROTATE_WHEN))
         LOG_ROTATE_INTERVAL = int(logging_cfg.get("rotate_interval", LOG_ROTATE_INTERVAL))
         LOG_ROTATE_BACKUP_COUNT = int(logging_cfg.get("rotate_backup_count", LOG_ROTATE_BACKUP_COUNT))
+        if not runtime_reload:  # 输出方式在启动时确定（main 在加载配置后重新挂载 handler）
+            LOG_ASYNC_ENABLED = bool(logging_cfg.get("async", LOG_ASYNC_ENABLED))
+        LOG_RATE_LIMIT_BURST = int(logging_cfg.get("rate_limit_burst", LOG_RATE_LIMIT_BURST))
+        LOG_RATE_LIMIT_WINDOW_SECONDS = float(logging_cfg.get("rate_limit_window_seconds", LOG_RATE_LIMIT_WINDOW_SECONDS))
+        LOG_RATE_LIMIT_EXEMPT_LEVEL = str(logging_cfg.get("rate_limit_exempt_level", LOG_RATE_LIMIT_EXEMPT_LEVEL)).upper()
 
         # --- camera ---
         cam_cfg = nested.get("camera", {}) if isinstance(nested.get("camera", {}), dict) else {}
@@ -356,6 +1178,30 @@ def load_and_apply_yaml_config(config_path: str, runtime_reload: bool = False):
         DEFAULT_HEIGHT = int(cam_cfg.get("height", flat.get("height", DEFAULT_HEIGHT)))
         REQUESTED_FOURCC = str(cam_cfg.get("requested_fourcc", flat.get("fourcc", REQUESTED_FOURCC)))
         JPEG_SAVE_QUALITY = int(cam_cfg.get("jpeg_quality", flat.get("jpeg_quality", JPEG_SAVE_QUALITY)))
+        format_val = str(cam_cfg.get("output_format", OUTPUT_FORMAT) or "jpeg").lower()
+        if format_val in OUTPUT_FORMAT_EXTENSIONS:
+            OUTPUT_FORMAT = format_val
+        else:
+            logger.warning(f"未知的 camera.output_format '{format_val}'，保持 {OUTPUT_FORMAT}。")
+        format_opts_cfg = cam_cfg.get("output_options", {}) if isinstance(cam_cfg.get("output_options", {}), dict) else {}
+        for fmt_name, fmt_opts in format_opts_cfg.items():
+            if fmt_name in OUTPUT_FORMAT_OPTIONS and isinstance(fmt_opts, dict):
+                OUTPUT_FORMAT_OPTIONS[fmt_name] = {**OUTPUT_FORMAT_OPTIONS[fmt_name], **fmt_opts}
+        CAMERA_CAPS_CACHE_ENABLED = bool(cam_cfg.get("capability_cache_enabled", CAMERA_CAPS_CACHE_ENABLED))
+        caps_file_val = _resolve_placeholders(cam_cfg.get("capability_cache_file", CAMERA_CAPS_CACHE_FILE or ""))
+        CAMERA_CAPS_CACHE_FILE = str(caps_file_val) if caps_file_val else None
+        probe_cfg = cam_cfg.get("two_tier_capture", {}) if isinstance(cam_cfg.get("two_tier_capture", {}), dict) else {}
+        probe_mode_val = str(probe_cfg.get("mode", CAPTURE_PROBE_MODE) or "off").lower()
+        if probe_mode_val in ("off", "switch", "device"):
+            CAPTURE_PROBE_MODE = probe_mode_val
+        else:
+            logger.warning(f"未知的 two_tier_capture.mode '{probe_mode_val}'，保持 {CAPTURE_PROBE_MODE}。")
+        CAPTURE_PROBE_DEVICE = probe_cfg.get("probe_device", CAPTURE_PROBE_DEVICE) or None
+        CAPTURE_PROBE_WIDTH = int(probe_cfg.get("probe_width", CAPTURE_PROBE_WIDTH))
+        CAPTURE_PROBE_HEIGHT = int(probe_cfg.get("probe_height", CAPTURE_PROBE_HEIGHT))
+        CAPTURE_PROBE_FOURCC = probe_cfg.get("probe_fourcc", CAPTURE_PROBE_FOURCC) or None
+        CAPTURE_PROBE_SWITCH_FLUSH_FRAMES = max(0, int(probe_cfg.get("switch_flush_frames", CAPTURE_PROBE_SWITCH_FLUSH_FRAMES)))
+        CAPTURE_PROBE_MAX_HOLD_TICKS = max(1, int(probe_cfg.get("max_hold_ticks", CAPTURE_PROBE_MAX_HOLD_TICKS)))
 
         # --- schedule ---
         schedule_new = []
@@ -385,6 +1231,7 @@ def load_and_apply_yaml_config(config_path: str, runtime_reload: bool = False):
         if schedule_new:
             CAPTURE_SCHEDULE_CONFIG = schedule_new
         DEFAULT_INTERVAL_LATE_NIGHT = float(sched_cfg.get("default_interval_late_night", flat.get("default_interval_late_night", DEFAULT_INTERVAL_LATE_NIGHT)))
+        SCHEDULE_LATE_TOLERANCE_MS = float(sched_cfg.get("late_tolerance_ms", SCHEDULE_LATE_TOLERANCE_MS))
 
         # --- image processing ---
         img_cfg = nested.get("image_processing", {}) if isinstance(nested.get("image_processing", {}), dict) else {}
@@ -396,6 +1243,46 @@ def load_and_apply_yaml_config(config_path: str, runtime_reload: bool = False):
             TIMESTAMP_FORMAT = str(img_cfg.get("timestamp_format", TIMESTAMP_FORMAT))
         except Exception:
             pass
+        ENABLE_BLACK_FRAME_DETECTION = bool(img_cfg.get("enable_black_frame_detection", ENABLE_BLACK_FRAME_DETECTION))
+        BLACK_FRAME_THRESHOLD = float(img_cfg.get("black_frame_threshold", BLACK_FRAME_THRESHOLD))
+        BLACK_FRAME_CONSECUTIVE_THRESHOLD = int(img_cfg.get("black_frame_consecutive_threshold", BLACK_FRAME_CONSECUTIVE_THRESHOLD))
+        ENABLE_STATIC_FRAME_DETECTION = bool(img_cfg.get("enable_static_frame_detection", ENABLE_STATIC_FRAME_DETECTION))
+        STATIC_FRAME_DIFF_THRESHOLD = float(img_cfg.get("static_frame_diff_threshold", STATIC_FRAME_DIFF_THRESHOLD))
+        STATIC_FRAME_CONSECUTIVE_THRESHOLD = int(img_cfg.get("static_frame_consecutive_threshold", STATIC_FRAME_CONSECUTIVE_THRESHOLD))
+        if "static_frame_resize_width" in img_cfg:
+            resize_w = img_cfg.get("static_frame_resize_width")
+            STATIC_FRAME_RESIZE_WIDTH = int(resize_w) if resize_w else None
+        ENABLE_QUALITY_GATE = bool(img_cfg.get("enable_quality_gate", ENABLE_QUALITY_GATE))
+        quality_cfg = img_cfg.get("quality_gate", {}) if isinstance(img_cfg.get("quality_gate", {}), dict) else {}
+        QUALITY_BAND_ROW_VARIANCE = float(quality_cfg.get("band_row_variance", QUALITY_BAND_ROW_VARIANCE))
+        QUALITY_BAND_MIN_FRACTION = float(quality_cfg.get("band_min_fraction", QUALITY_BAND_MIN_FRACTION))
+        QUALITY_TEAR_MIN_DIFF = float(quality_cfg.get("tear_min_diff", QUALITY_TEAR_MIN_DIFF))
+        QUALITY_BLUR_RELATIVE = float(quality_cfg.get("blur_relative", QUALITY_BLUR_RELATIVE))
+        QUALITY_BLUR_MIN_SHARPNESS = float(quality_cfg.get("blur_min_sharpness", QUALITY_BLUR_MIN_SHARPNESS))
+        QUALITY_SATURATED_MAX_FRACTION = float(quality_cfg.get("saturated_max_fraction", QUALITY_SATURATED_MAX_FRACTION))
+        QUALITY_REINIT_CONSECUTIVE = int(quality_cfg.get("reinit_consecutive", QUALITY_REINIT_CONSECUTIVE))
+        overlays_cfg = img_cfg.get("overlays")
+        if isinstance(overlays_cfg, list):
+            OVERLAY_CONFIG = [o for o in overlays_cfg if isinstance(o, dict)]
+        FRAME_BUFFER_POOL_ENABLED = bool(img_cfg.get("buffer_pool", FRAME_BUFFER_POOL_ENABLED))
+        KEYFRAME_CACHE_SIZE = max(1, int(img_cfg.get("keyframe_cache_size", KEYFRAME_CACHE_SIZE)))
+        KEYFRAME_CACHE_EXPIRY_SECONDS = float(img_cfg.get("keyframe_cache_expiry_seconds", KEYFRAME_CACHE_EXPIRY_SECONDS))
+        KEYFRAME_HASH_MAX_DISTANCE = int(img_cfg.get("keyframe_hash_max_distance", KEYFRAME_HASH_MAX_DISTANCE))
+        regions_cfg = img_cfg.get("regions")
+        if isinstance(regions_cfg, list):
+            DETECTION_REGIONS_CONFIG = [r for r in regions_cfg if isinstance(r, dict)]
+        activity_cfg = img_cfg.get("activity_map", {}) if isinstance(img_cfg.get("activity_map", {}), dict) else {}
+        if not runtime_reload:  # 累加器只在启动时创建
+            ACTIVITY_MAP_ENABLED = bool(activity_cfg.get("enabled", ACTIVITY_MAP_ENABLED))
+            activity_dir_val = _resolve_placeholders(activity_cfg.get("dir", ACTIVITY_MAP_DIR or "") or "")
+            ACTIVITY_MAP_DIR = str(activity_dir_val) if activity_dir_val else None
+        ACTIVITY_MAP_FLUSH_INTERVAL_SECONDS = max(10.0, float(activity_cfg.get("flush_interval_seconds", ACTIVITY_MAP_FLUSH_INTERVAL_SECONDS)))
+        LUMA_STATS_ENABLED = bool(img_cfg.get("luma_stats", LUMA_STATS_ENABLED))
+        deflicker_cfg = img_cfg.get("deflicker", {}) if isinstance(img_cfg.get("deflicker", {}), dict) else {}
+        DEFLICKER_ENABLED = bool(deflicker_cfg.get("enabled", DEFLICKER_ENABLED))
+        DEFLICKER_TIME_CONSTANT_SECONDS = max(1.0, float(deflicker_cfg.get("time_constant_seconds", DEFLICKER_TIME_CONSTANT_SECONDS)))
+        DEFLICKER_MAX_GAMMA = max(1.0, float(deflicker_cfg.get("max_gamma", DEFLICKER_MAX_GAMMA)))
+        DEFLICKER_MIN_MEAN = float(deflicker_cfg.get("min_mean", DEFLICKER_MIN_MEAN))
 
         # --- disk management ---
         disk_cfg = nested.get("disk_management", {}) if isinstance(nested.get("disk_management", {}), dict) else {}
@@ -408,10 +1295,99 @@ def load_and_apply_yaml_config(config_path: str, runtime_reload: bool = False):
         IMAGE_STORAGE_CLEANUP_BATCH_DAYS = int(disk_cfg.get("cleanup_batch_days", IMAGE_STORAGE_CLEANUP_BATCH_DAYS))
         DISK_CHECK_INTERVAL_SECONDS = int(disk_cfg.get("check_interval_seconds", DISK_CHECK_INTERVAL_SECONDS))
         MIN_JPEG_SAVE_SIZE_BYTES = int(disk_cfg.get("min_jpeg_save_size_bytes", MIN_JPEG_SAVE_SIZE_BYTES))
+        routing_cfg = disk_cfg.get("storage_routing", {}) if isinstance(disk_cfg.get("storage_routing", {}), dict) else {}
+        if not runtime_reload:  # 存储目标只在启动时生效（迁移线程与待迁文件依赖目标列表）
+            STORAGE_ROUTING_ENABLED = bool(routing_cfg.get("enabled", STORAGE_ROUTING_ENABLED))
+            targets_cfg = routing_cfg.get("targets", STORAGE_TARGETS_CONFIG) or []
+            STORAGE_TARGETS_CONFIG = []
+            for idx, target in enumerate(targets_cfg if isinstance(targets_cfg, list) else []):
+                if isinstance(target, str):
+                    target = {"path": target}
+                if not isinstance(target, dict) or not target.get("path"):
+                    logger.warning(f"忽略无效的存储目标配置 #{idx}: {target!r}")
+                    continue
+                STORAGE_TARGETS_CONFIG.append({
+                    "path": _resolve_placeholders(str(target["path"])),
+                    "priority": int(target.get("priority", idx)),
+                    "name": str(target.get("name", f"target{idx}")),
+                })
+        STORAGE_WRITE_LATENCY_SLO_MS = float(routing_cfg.get("latency_slo_ms", STORAGE_WRITE_LATENCY_SLO_MS))
+        STORAGE_LATENCY_WINDOW = max(3, int(routing_cfg.get("latency_window", STORAGE_LATENCY_WINDOW)))
+        STORAGE_RECOVERY_PROBES = max(1, int(routing_cfg.get("recovery_probes", STORAGE_RECOVERY_PROBES)))
+        STORAGE_PROBE_INTERVAL_SECONDS = float(routing_cfg.get("probe_interval_seconds", STORAGE_PROBE_INTERVAL_SECONDS))
+        STORAGE_MIGRATE_BATCH_FILES = max(1, int(routing_cfg.get("migrate_batch_files", STORAGE_MIGRATE_BATCH_FILES)))
+        feed_cfg = disk_cfg.get("changefeed", {}) if isinstance(disk_cfg.get("changefeed", {}), dict) else {}
+        if not runtime_reload:  # 日志文件只在启动时打开
+            CHANGEFEED_ENABLED = bool(feed_cfg.get("enabled", CHANGEFEED_ENABLED))
+            feed_file_val = _resolve_placeholders(feed_cfg.get("file", CHANGEFEED_FILE or "") or "")
+            CHANGEFEED_FILE = str(feed_file_val) if feed_file_val else None
+        checksum_val = str(feed_cfg.get("checksum", CHANGEFEED_CHECKSUM) or "none").lower()
+        if checksum_val in ("crc32", "sha256", "none"):
+            CHANGEFEED_CHECKSUM = checksum_val
+        else:
+            logger.warning(f"未知的 changefeed.checksum '{checksum_val}'，保持 {CHANGEFEED_CHECKSUM}。")
+        CHANGEFEED_ROTATE_BYTES = int(feed_cfg.get("rotate_bytes", CHANGEFEED_ROTATE_BYTES))
+        cold_cfg = disk_cfg.get("cold_archive", {}) if isinstance(disk_cfg.get("cold_archive", {}), dict) else {}
+        if not runtime_reload:  # 归档线程只在启动时创建
+            COLD_ARCHIVE_ENABLED = bool(cold_cfg.get("enabled", COLD_ARCHIVE_ENABLED))
+        COLD_ARCHIVE_AFTER_DAYS = max(1, int(cold_cfg.get("after_days", COLD_ARCHIVE_AFTER_DAYS)))
+        encoder_val = str(cold_cfg.get("encoder", COLD_ARCHIVE_ENCODER) or "auto").lower()
+        if encoder_val in ("auto", "ffmpeg", "opencv"):
+            COLD_ARCHIVE_ENCODER = encoder_val
+        else:
+            logger.warning(f"未知的 cold_archive.encoder '{encoder_val}'，保持 {COLD_ARCHIVE_ENCODER}。")
+        COLD_ARCHIVE_FFMPEG_PATH = str(cold_cfg.get("ffmpeg_path", COLD_ARCHIVE_FFMPEG_PATH) or "ffmpeg")
+        COLD_ARCHIVE_GOP = max(1, int(cold_cfg.get("gop", COLD_ARCHIVE_GOP)))
+        COLD_ARCHIVE_CRF = int(cold_cfg.get("crf", COLD_ARCHIVE_CRF))
+        COLD_ARCHIVE_FPS = max(1.0, float(cold_cfg.get("fps", COLD_ARCHIVE_FPS)))
+        COLD_ARCHIVE_VERIFY_STRIDE = max(1, int(cold_cfg.get("verify_stride", COLD_ARCHIVE_VERIFY_STRIDE)))
+        COLD_ARCHIVE_MIN_PSNR = float(cold_cfg.get("min_psnr", COLD_ARCHIVE_MIN_PSNR))
+        COLD_ARCHIVE_CHECK_INTERVAL_SECONDS = max(60.0, float(cold_cfg.get("check_interval_seconds", COLD_ARCHIVE_CHECK_INTERVAL_SECONDS)))
+        spool_cfg = disk_cfg.get("write_spool", {}) if isinstance(disk_cfg.get("write_spool", {}), dict) else {}
+        if not runtime_reload:  # 缓冲目录与开关只在启动时生效（热重载不切换，避免丢失待写文件）
+            SPOOL_ENABLED = bool(spool_cfg.get("enabled", SPOOL_ENABLED))
+            if "dir" in spool_cfg:
+                spool_dir_val = _resolve_placeholders(spool_cfg.get("dir") or "")
+                SPOOL_DIR = str(spool_dir_val) if spool_dir_val else None
+        SPOOL_FLUSH_FILES = max(1, int(spool_cfg.get("flush_files", SPOOL_FLUSH_FILES)))
+        SPOOL_FLUSH_BYTES = int(spool_cfg.get("flush_bytes", SPOOL_FLUSH_BYTES))
+        SPOOL_FLUSH_INTERVAL_SECONDS = float(spool_cfg.get("flush_interval_seconds", SPOOL_FLUSH_INTERVAL_SECONDS))
+        SPOOL_MAX_BYTES = int(spool_cfg.get("max_bytes", SPOOL_MAX_BYTES))
+        planner_cfg = disk_cfg.get("storage_planner", {}) if isinstance(disk_cfg.get("storage_planner", {}), dict) else {}
+        STORAGE_PLANNER_ENABLED = bool(planner_cfg.get("enabled", STORAGE_PLANNER_ENABLED))
+        STORAGE_RETENTION_TARGET_DAYS = max(1, int(planner_cfg.get("retention_days", STORAGE_RETENTION_TARGET_DAYS)))
+        PLANNER_MIN_JPEG_QUALITY = int(planner_cfg.get("min_jpeg_quality", PLANNER_MIN_JPEG_QUALITY))
+        max_q_val = planner_cfg.get("max_jpeg_quality", PLANNER_MAX_JPEG_QUALITY)
+        PLANNER_MAX_JPEG_QUALITY = int(max_q_val) if max_q_val else None
+        PLANNER_MAX_SIMILARITY_THRESHOLD_INT = int(planner_cfg.get("max_similarity_threshold_percent_int", PLANNER_MAX_SIMILARITY_THRESHOLD_INT))
+        PLANNER_ADJUST_INTERVAL_SECONDS = int(planner_cfg.get("adjust_interval_seconds", PLANNER_ADJUST_INTERVAL_SECONDS))
+        planner_file_val = _resolve_placeholders(planner_cfg.get("state_file", PLANNER_STATE_FILE or ""))
+        PLANNER_STATE_FILE = str(planner_file_val) if planner_file_val else None
 
         # --- service ---
         svc_cfg = nested.get("service", {}) if isinstance(nested.get("service", {}), dict) else {}
         MAX_CONSECUTIVE_IMWRITE_FAILURES = int(svc_cfg.get("max_consecutive_imwrite_failures", MAX_CONSECUTIVE_IMWRITE_FAILURES))
+        CONTROL_SOCKET_ENABLED = bool(svc_cfg.get("control_socket_enabled", CONTROL_SOCKET_ENABLED))
+        gov_cfg = svc_cfg.get("governor", {}) if isinstance(svc_cfg.get("governor", {}), dict) else {}
+        GOVERNOR_ENABLED = bool(gov_cfg.get("enabled", GOVERNOR_ENABLED))
+        GOVERNOR_SAMPLE_INTERVAL_SECONDS = float(gov_cfg.get("sample_interval_seconds", GOVERNOR_SAMPLE_INTERVAL_SECONDS))
+        GOVERNOR_THERMAL_ZONE_GLOB = str(gov_cfg.get("thermal_zone_glob", GOVERNOR_THERMAL_ZONE_GLOB))
+        GOVERNOR_CPUFREQ_POLICY_GLOB = str(gov_cfg.get("cpufreq_policy_glob", GOVERNOR_CPUFREQ_POLICY_GLOB))
+        GOVERNOR_LOADAVG_PATH = str(gov_cfg.get("loadavg_path", GOVERNOR_LOADAVG_PATH))
+        GOVERNOR_TEMP_HIGH_C = float(gov_cfg.get("temp_high_c", GOVERNOR_TEMP_HIGH_C))
+        GOVERNOR_TEMP_LOW_C = min(GOVERNOR_TEMP_HIGH_C, float(gov_cfg.get("temp_low_c", GOVERNOR_TEMP_LOW_C)))
+        GOVERNOR_FREQ_RATIO_LOW = float(gov_cfg.get("freq_ratio_low", GOVERNOR_FREQ_RATIO_LOW))
+        GOVERNOR_FREQ_RATIO_RECOVER = max(GOVERNOR_FREQ_RATIO_LOW, float(gov_cfg.get("freq_ratio_recover", GOVERNOR_FREQ_RATIO_RECOVER)))
+        GOVERNOR_LOAD_HIGH = float(gov_cfg.get("load_high", GOVERNOR_LOAD_HIGH))
+        GOVERNOR_LOAD_LOW = min(GOVERNOR_LOAD_HIGH, float(gov_cfg.get("load_low", GOVERNOR_LOAD_LOW)))
+        GOVERNOR_STEP_DOWN_SAMPLES = max(1, int(gov_cfg.get("step_down_samples", GOVERNOR_STEP_DOWN_SAMPLES)))
+        GOVERNOR_STEP_UP_SAMPLES = max(1, int(gov_cfg.get("step_up_samples", GOVERNOR_STEP_UP_SAMPLES)))
+        GOVERNOR_MAX_LEVEL = max(0, min(len(GOVERNOR_LEVELS) - 1, int(gov_cfg.get("max_level", GOVERNOR_MAX_LEVEL))))
+        GOVERNOR_REDUCED_WIDTH = max(32, int(gov_cfg.get("reduced_width", GOVERNOR_REDUCED_WIDTH)))
+        GOVERNOR_HASH_SIMILAR_DISTANCE = int(gov_cfg.get("hash_similar_distance", GOVERNOR_HASH_SIMILAR_DISTANCE))
+        GOVERNOR_QUALITY_DROP = int(gov_cfg.get("quality_drop", GOVERNOR_QUALITY_DROP))
+        GOVERNOR_MIN_QUALITY = int(gov_cfg.get("min_quality", GOVERNOR_MIN_QUALITY))
+        GOVERNOR_INTERVAL_FACTOR = max(1.0, float(gov_cfg.get("interval_factor", GOVERNOR_INTERVAL_FACTOR)))
 
         # --- similarity --- （兼容旧配置）
         SIMILARITY_THRESHOLD_PERCENT_INT = int(flat.get("similarity_threshold_percent_int", SIMILARITY_THRESHOLD_PERCENT_INT))
@@ -466,9 +1442,118 @@ def signal_term_handler(signum, frame):
     if logger: logger.info(msg)
     else: print(msg, file=sys.stderr)
     shutdown_event.set()
+    wake_event.set()
+
+# --- Control Socket ---
+def flush_pending_writes(state: 'ServiceState | None' = None) -> dict:
+    """刷出尚未落盘的数据：写回缓冲中的抓拍、日志 handler 缓冲与内核页缓存（os.sync）。"""
+    t0 = time.perf_counter()
+    flushed = 0
+    if state is not None and state.spool is not None:
+        flushed = state.spool.flush_now()
+    flush_log_queue()
+    try:
+        os.sync()
+    except (AttributeError, OSError):
+        pass
+    return {"flush_ms": round((time.perf_counter() - t0) * 1000.0, 2), "spool_flushed": flushed}
+
+class ControlServer:
+    """本地控制套接字（Unix domain，一行命令 -> 一行 JSON 应答）。
+
+    在独立的守护线程中运行，只通过 Event 与主循环交互，不直接触碰相机或帧数据。
+    支持的命令见 CONTROL_COMMANDS。
+    """
+    def __init__(self, socket_path: str, state: 'ServiceState') -> None:
+        self.socket_path = socket_path
+        self.state = state
+        self._sock: socket.socket | None = None
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> bool:
+        """绑定套接字并启动服务线程；主路径不可用时回退到 /tmp，失败仅记录日志。"""
+        for candidate in _runtime_path_candidates(self.socket_path):
+            try:
+                if os.path.exists(candidate):
+                    os.remove(candidate)  # 上次异常退出残留的套接字文件
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.bind(candidate)
+                os.chmod(candidate, 0o660)
+                sock.listen(4)
+                sock.settimeout(1.0)
+            except OSError as e:
+                logger.warning(f"[CTL] 无法绑定控制套接字 {candidate}: {e}")
+                continue
+            self._sock = sock
+            self.socket_path = candidate
+            self._thread = threading.Thread(target=self._serve, name="ControlSocket", daemon=True)
+            self._thread.start()
+            logger.info(f"[CTL] 控制套接字已启动: {candidate}")
+            return True
+        logger.error("[CTL] 控制套接字不可用，status 将回退到 PID 检查。")
+        return False
+
+    def stop(self) -> None:
+        """关闭套接字并移除套接字文件。"""
+        if self._sock is None:
+            return
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+        self._sock = None
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+        try:
+            os.remove(self.socket_path)
+        except OSError:
+            pass
+
+    def _serve(self) -> None:
+        while not shutdown_event.is_set() and self._sock is not None:
+            try:
+                conn, _ = self._sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break  # 套接字已关闭
+            with conn:
+                try:
+                    conn.settimeout(2.0)
+                    with conn.makefile("r", encoding="utf-8") as rf:
+                        line = rf.readline(256)
+                    reply = self.dispatch(line)
+                    conn.sendall((json.dumps(reply, ensure_ascii=False) + "\n").encode("utf-8"))
+                except Exception as e:
+                    logger.debug(f"[CTL] 处理控制连接异常: {e}")
+
+    def dispatch(self, line: str) -> dict:
+        """解析并执行一条命令，返回应答字典（总包含 ok 字段）。"""
+        command = (line or "").strip().lower()
+        if command not in CONTROL_COMMANDS:
+            return {"ok": False, "error": f"unknown command '{command}'", "commands": list(CONTROL_COMMANDS)}
+        logger.info(f"[CTL] 收到控制命令: {command}")
+        if command == "status":
+            return {"ok": True, "status": build_health_snapshot(self.state)}
+        if command == "ping":
+            return {"ok": True}
+        if command == "snapshot":
+            capture_now_event.set()
+        elif command == "pause":
+            pause_event.set()
+        elif command == "resume":
+            pause_event.clear()
+        elif command == "reload":
+            if not CONFIG_ENABLED:
+                return {"ok": False, "error": "config loading disabled (start with --use-config)"}
+            reload_event.set()
+        elif command == "flush":
+            return {"ok": True, **flush_pending_writes(self.state)}
+        wake_event.set()
+        return {"ok": True}
 
 # --- Core Camera and Image Processing Functions ---
-# (get_fourcc_str, set_camera_parameter, initialize_camera, add_timestamp_to_frame
+# (get_fourcc_str, set_camera_parameter, initialize_camera, OverlayCompositor
 #  from v2.0.0 are good, ensure logger is used, and set_camera_parameter uses shutdown_event.wait)
 def get_fourcc_str(fourcc_int: int) -> str: # Identical to v2.0.0
     """将四字符码整数转为字符串，用于日志展示。"""
@@ -526,9 +1611,118 @@ def set_camera_parameter(cap: cv2.VideoCapture, prop_id: int, value, param_name:
                    f"经过 {retries} 次尝试后，实际值为 {final_actual_value}")
     return False
 
-def initialize_camera(camera_path: str, width: int, height: int, req_fourcc_str: str): # Identical to v2.0.0
-    """打开并初始化摄像头，设置 FOURCC/FPS/分辨率，返回 (cap, 实际FOURCC)。"""
+# --- Camera Capability Cache ---
+def get_camera_caps_cache_path() -> str:
+    """返回相机能力缓存文件路径（未配置时放在日志目录，服务对其有写权限）。"""
+    return CAMERA_CAPS_CACHE_FILE or os.path.join(LOG_DIR, "camera_caps.json")
+
+def get_camera_usb_id(device_path: str) -> str | None:
+    """通过 sysfs 解析设备节点对应的 USB 标识（VID:PID[:serial]），失败返回 None。"""
+    try:
+        node_name = os.path.basename(os.path.realpath(device_path))
+        probe = os.path.realpath(os.path.join("/sys/class/video4linux", node_name, "device"))
+        for _ in range(4):  # 接口目录 -> 设备目录，向上找 idVendor
+            vid_path = os.path.join(probe, "idVendor")
+            if os.path.isfile(vid_path):
+                with open(vid_path, "r") as f:
+                    vid = f.read().strip()
+                with open(os.path.join(probe, "idProduct"), "r") as f:
+                    pid = f.read().strip()
+                serial = ""
+                try:
+                    with open(os.path.join(probe, "serial"), "r") as f:
+                        serial = f.read().strip()
+                except OSError:
+                    pass
+                return f"{vid}:{pid}:{serial}" if serial else f"{vid}:{pid}"
+            probe = os.path.dirname(probe)
+    except OSError:
+        pass
+    return None
+
+def _camera_caps_key(camera_path: str, width: int, height: int, req_fourcc_str: str) -> str:
+    """能力缓存的键：设备路径 + 请求参数（请求变化即视为未命中）。"""
+    return f"{camera_path}|{width}x{height}|{(req_fourcc_str or '').upper()}|{CAMERA_REQUESTED_FPS}"
+
+def load_camera_caps_cache() -> dict:
+    """读取能力缓存文件，缺失或损坏时返回空结构。"""
+    try:
+        with open(get_camera_caps_cache_path(), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict) and isinstance(data.get("devices"), dict):
+            return data
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"[CAMERA] 读取能力缓存失败，将忽略: {e}")
+    return {"version": 1, "devices": {}}
+
+def update_camera_caps_cache(key: str, record: dict | None) -> None:
+    """写入（record=None 时删除）一条能力记录；先写临时文件再原子替换。"""
+    if not CAMERA_CAPS_CACHE_ENABLED:
+        return
+    cache_path = get_camera_caps_cache_path()
+    try:
+        data = load_camera_caps_cache()
+        if record is None:
+            if data["devices"].pop(key, None) is None:
+                return
+        else:
+            data["devices"][key] = record
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        logger.warning(f"[CAMERA] 写入能力缓存失败 {cache_path}: {e}")
+
+def _read_camera_actuals(cap: cv2.VideoCapture, width: int, height: int):
+    """读取相机当前 (宽, 高, FPS, FOURCC整数)，异常时返回请求值与 0。"""
+    try:
+        return (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                cap.get(cv2.CAP_PROP_FPS), int(cap.get(cv2.CAP_PROP_FOURCC)))
+    except Exception as e:
+        logger.warning(f"读取相机属性失败: {e}")
+        return width, height, 0.0, 0
+
+def _apply_cached_camera_caps(cap: cv2.VideoCapture, record: dict) -> bool:
+    """快速路径：按缓存记录一次性设置 FOURCC/FPS/尺寸，稳定等待后统一校验一次。
+
+    任一参数与记录不符返回 False，由调用方回落到完整的逐项重试流程。
+    """
+    cached_fourcc = str(record.get("fourcc") or "")
+    try:
+        if len(cached_fourcc) == 4:
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*cached_fourcc))
+        cap.set(cv2.CAP_PROP_FPS, CAMERA_REQUESTED_FPS)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, int(record["width"]))
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, int(record["height"]))
+    except Exception as e:
+        logger.warning(f"[CAMERA] 按缓存设置参数异常: {e}")
+        return False
+    if shutdown_event.wait(timeout=CAMERA_CAPS_SETTLE_SECONDS):
+        return False
+    actual_width, actual_height, _, actual_fourcc_int = _read_camera_actuals(cap, 0, 0)
+    actual_fourcc = get_fourcc_str(actual_fourcc_int)
+    if (actual_width, actual_height) != (int(record["width"]), int(record["height"])) or \
+       (cached_fourcc and actual_fourcc.upper() != cached_fourcc.upper()):
+        logger.warning(f"[CAMERA] 能力缓存校验不符: 期望 {cached_fourcc} {record['width']}x{record['height']}，"
+                       f"实际 {actual_fourcc} {actual_width}x{actual_height}；回落到完整初始化流程。")
+        return False
+    return True
+
+def initialize_camera(camera_path: str, width: int, height: int, req_fourcc_str: str,
+                      state: 'ServiceState | None' = None):
+    """打开并初始化摄像头，设置 FOURCC/FPS/分辨率，返回 (cap, 实际FOURCC)。
+
+    若能力缓存中有同一设备（路径 + USB 标识）与同一请求参数的成功记录，先走一次性
+    “设置 + 校验”的快速路径；校验不符时再执行逐项重试的完整流程。初始化耗时记录到
+    日志、能力缓存以及 state（如提供）。
+    """
     logger.info(f"[CAMERA] 打开并初始化设备: {camera_path} (V4L2)")
+    t_start = time.perf_counter()
     
     device_path = camera_path
     if not os.path.exists(device_path):
@@ -545,46 +1739,55 @@ def initialize_camera(camera_path: str, width: int, height: int, req_fourcc_str:
         logger.error(f"无法打开摄像头 {camera_path}")
         return None, "OPEN_FAILED"
 
-    effective_fourcc = "NOT_SET"
-    if req_fourcc_str:
-        target_fourcc_int = cv2.VideoWriter_fourcc(*req_fourcc_str)
-        set_camera_parameter(cap, cv2.CAP_PROP_FOURCC, target_fourcc_int, "FOURCC")
-    
-    set_camera_parameter(cap, cv2.CAP_PROP_FPS, 10, "FPS")
-    # Try to reduce internal buffering/latency where supported
-    try:
-        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-    except Exception:
-        pass
+    caps_key = _camera_caps_key(camera_path, width, height, req_fourcc_str)
+    usb_id = get_camera_usb_id(camera_path)
+    cached_record = None
+    if CAMERA_CAPS_CACHE_ENABLED:
+        cached_record = load_camera_caps_cache()["devices"].get(caps_key)
+        if cached_record and cached_record.get("usb_id") != usb_id:
+            logger.info(f"[CAMERA] 能力缓存的 USB 标识不符 ({cached_record.get('usb_id')} -> {usb_id})，忽略缓存。")
+            cached_record = None
+
+    init_mode = "full"
+    if cached_record and _apply_cached_camera_caps(cap, cached_record):
+        init_mode = "cached"
+    else:
+        if shutdown_event.is_set(): cap.release(); return None, "SHUTDOWN_DURING_INIT"
+        effective_fourcc = "NOT_SET"
+        if req_fourcc_str:
+            target_fourcc_int = cv2.VideoWriter_fourcc(*req_fourcc_str)
+            set_camera_parameter(cap, cv2.CAP_PROP_FOURCC, target_fourcc_int, "FOURCC")
+        
+        set_camera_parameter(cap, cv2.CAP_PROP_FPS, CAMERA_REQUESTED_FPS, "FPS")
+        # Try to reduce internal buffering/latency where supported
+        try:
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        except Exception:
+            pass
 
-    if shutdown_event.is_set(): cap.release(); return None, "SHUTDOWN_DURING_INIT"
-    time.sleep(0.1) 
-    try:
-        current_fourcc_int = int(cap.get(cv2.CAP_PROP_FOURCC))
-    except Exception as e:
-        logger.warning(f"读取 FOURCC 失败: {e}")
-        current_fourcc_int = 0
-    effective_fourcc = get_fourcc_str(current_fourcc_int)
-    if req_fourcc_str and effective_fourcc.upper() != req_fourcc_str.upper():
-         logger.warning(f"请求的FOURCC {req_fourcc_str} 未能精确设置，摄像头实际为 {effective_fourcc}")
+        if shutdown_event.is_set(): cap.release(); return None, "SHUTDOWN_DURING_INIT"
+        time.sleep(0.1) 
+        try:
+            current_fourcc_int = int(cap.get(cv2.CAP_PROP_FOURCC))
+        except Exception as e:
+            logger.warning(f"读取 FOURCC 失败: {e}")
+            current_fourcc_int = 0
+        effective_fourcc = get_fourcc_str(current_fourcc_int)
+        if req_fourcc_str and effective_fourcc.upper() != req_fourcc_str.upper():
+             logger.warning(f"请求的FOURCC {req_fourcc_str} 未能精确设置，摄像头实际为 {effective_fourcc}")
+
+        set_camera_parameter(cap, cv2.CAP_PROP_FRAME_WIDTH, width, "Width")
+        if shutdown_event.is_set(): cap.release(); return None, "SHUTDOWN_DURING_INIT"
+        set_camera_parameter(cap, cv2.CAP_PROP_FRAME_HEIGHT, height, "Height")
+        if shutdown_event.is_set(): cap.release(); return None, "SHUTDOWN_DURING_INIT"
+        
+        time.sleep(0.2) 
 
-    set_camera_parameter(cap, cv2.CAP_PROP_FRAME_WIDTH, width, "Width")
-    if shutdown_event.is_set(): cap.release(); return None, "SHUTDOWN_DURING_INIT"
-    set_camera_parameter(cap, cv2.CAP_PROP_FRAME_HEIGHT, height, "Height")
-    if shutdown_event.is_set(): cap.release(); return None, "SHUTDOWN_DURING_INIT"
-    
-    time.sleep(0.2) 
-    try:
-        actual_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        actual_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        actual_fps_val = cap.get(cv2.CAP_PROP_FPS) 
-        current_fourcc_int = int(cap.get(cv2.CAP_PROP_FOURCC)) 
-    except Exception as e:
-        logger.warning(f"读取相机属性失败: {e}")
-        actual_width, actual_height, actual_fps_val, current_fourcc_int = width, height, 0.0, 0
+    actual_width, actual_height, actual_fps_val, current_fourcc_int = _read_camera_actuals(cap, width, height)
     effective_fourcc = get_fourcc_str(current_fourcc_int)
+    init_ms = (time.perf_counter() - t_start) * 1000.0
 
-    logger.info(f"[CAMERA] 初始化完成: {camera_path}")
+    logger.info(f"[CAMERA] 初始化完成: {camera_path} (耗时 {init_ms:.1f}ms, 路径: {init_mode})")
     logger.info(f"[CAMERA] 请求参数 -> FOURCC: {req_fourcc_str if req_fourcc_str else 'N/A'}, 尺寸: {width}x{height}")
     logger.info(f"[CAMERA] 实际参数 -> FOURCC: {effective_fourcc} ({hex(current_fourcc_int)}), "
                 f"尺寸: {actual_width}x{actual_height}, "
@@ -592,139 +1795,927 @@ def initialize_camera(camera_path: str, width: int, height: int, req_fourcc_str:
     
     if actual_width != width or actual_height != height:
         logger.error(f"摄像头实际分辨率 {actual_width}x{actual_height} 与请求的 {width}x{height} 不符！")
+        # 协商未成功的结果不进入缓存，下次仍走完整流程
+        update_camera_caps_cache(caps_key, None)
+    else:
+        update_camera_caps_cache(caps_key, {
+            "device_path": camera_path,
+            "real_path": os.path.realpath(camera_path),
+            "usb_id": usb_id,
+            "fourcc": effective_fourcc,
+            "width": actual_width,
+            "height": actual_height,
+            "fps": round(float(actual_fps_val), 3),
+            "init_ms": round(init_ms, 1),
+            "init_mode": init_mode,
+            "updated": time.time(),
+        })
+
+    if state is not None:
+        state.last_camera_init_ms = init_ms
+        state.last_camera_init_mode = init_mode
+        state.camera_init_count += 1
     
     return cap, effective_fourcc
 
-def add_timestamp_to_frame(frame_to_modify, timestamp_format_str): # Identical to v2.0.0
-    """在图像右下角叠加时间戳，返回新图像。"""
-    if not ENABLE_TIMESTAMP:
-        return frame_to_modify
-    timestamp_text = datetime.now().strftime(timestamp_format_str)
-    font = cv2.FONT_HERSHEY_SIMPLEX
-    img_h, img_w = frame_to_modify.shape[:2]
-    font_scale = (img_h / 1080.0) * 1.0
-    if font_scale < 0.5: font_scale = 0.5
-    thickness = max(1, int(font_scale * 2.0)) 
-    margin = max(10, int(img_h * 0.05)) 
-
-    text_size, baseline = cv2.getTextSize(timestamp_text, font, font_scale, thickness)
-    text_width, text_height = text_size
-    org_x = img_w - text_width - margin
-    org_y = img_h - margin 
-    
-    cv2.putText(frame_to_modify, timestamp_text, (org_x, org_y), font, font_scale, 
-                (255, 255, 255), thickness, cv2.LINE_AA, bottomLeftOrigin=False)
-    return frame_to_modify
-
-def are_frames_similar(frame1: np.ndarray | None,
-                       frame2: np.ndarray | None,
-                       similarity_diff_rate_threshold_int: int) -> bool:
-    """比较两帧图像是否“足够相似”（变化很小）。
+# --- Activity Map ---
+class ActivityMap:
+    """每日活动热力图与逐分钟变化强度时间线，复用关键帧比较已经算出的阈值化差异图，几乎不增加开销。
+
+    - 热力图：缩小灰度分辨率的 float32 累加器，每次完整比较把差异像素（0/255）累加到对应位置，
+      写出时除以 255，即每个像素当天被判定为变化的次数
+    - 时间线：每天 1440 分钟 × (tick 数, 变化 tick 数, 变化率之和, 最大变化率)；变化率为轮廓面积百分比，
+      哈希距离过大而未做完整比较的变化帧按 100% 计
+    - 周期性（ACTIVITY_MAP_FLUSH_INTERVAL_SECONDS）、日切与停机时写出到当天目录：
+      activity_heatmap.png（按当天最大值归一化的伪彩色图）、activity_counts.png（16 位无损 PNG，
+      每像素变化次数，超过 65535 饱和）、activity_timeline.json（时间线）；启动时从当天已有文件恢复
+    """
+    COLUMNS = ("ticks", "changed", "rate_sum", "rate_max")
+    HEATMAP_PNG = "activity_heatmap.png"
+    HEATMAP_COUNTS = "activity_counts.png"
+    TIMELINE_JSON = "activity_timeline.json"
+
+    def __init__(self, base_dir: str) -> None:
+        self.base_dir = base_dir
+        self.day: str = ""  # "YYYY-MM/DD"
+        self.heat: np.ndarray | None = None
+        self.minutes = np.zeros((1440, len(self.COLUMNS)), dtype=np.float32)
+        self._minute = 0
+        self._pending_rate: float | None = None
+        self._dirty = False
+        self.last_flush_monotonic = time.monotonic()
+        self.flushes = 0
+        self.flush_errors = 0
+        self.last_flush_ms = 0.0
+        self.diffs_accumulated = 0
+        self.diffs_skipped = 0  # 差异图尺寸与累加器不一致且无法缩放（带检测区域）时跳过
+
+    def day_dir(self, day: str | None = None) -> str:
+        return os.path.join(ACTIVITY_MAP_DIR or self.base_dir, day or self.day)
+
+    def begin_tick(self, now: datetime) -> None:
+        day = now.strftime("%Y-%m/%d")
+        if day != self.day:
+            if self.day:
+                self.flush()
+            self._reset(day)
+        self._minute = now.hour * 60 + now.minute
+        self._pending_rate = None
+
+    def record_diff(self, thresh_img: np.ndarray, rate: float, full_shape: tuple, bbox) -> None:
+        """compare_reduced_frames 的回调：把阈值化差异图累加进热力图。"""
+        self._pending_rate = rate
+        if self.heat is None:
+            self.heat = np.zeros(full_shape[:2], dtype=np.float32)
+        if self.heat.shape != full_shape[:2]:
+            if bbox is not None:
+                self.diffs_skipped += 1
+                return
+            thresh_img = cv2.resize(thresh_img, (self.heat.shape[1], self.heat.shape[0]),
+                                    interpolation=cv2.INTER_NEAREST)
+        target = self.heat[bbox] if bbox is not None else self.heat
+        np.add(target, thresh_img, out=target)  # 原地累加（视图），不分配整帧临时数组
+        self.diffs_accumulated += 1
+        self._dirty = True
+
+    def end_tick(self, verdict: str | None) -> None:
+        row = self.minutes[self._minute]
+        row[0] += 1
+        if verdict is None:
+            row[1] += 1
+            rate = 100.0 if self._pending_rate is None else self._pending_rate
+        elif verdict == "SIMILARITY":
+            rate = self._pending_rate or 0.0
+        else:
+            rate = 0.0  # 黑帧/静止帧
+        row[2] += rate
+        if rate > row[3]:
+            row[3] = rate
+        self._pending_rate = None
+        self._dirty = True
+
+    def _reset(self, day: str) -> None:
+        self.day = day
+        self.heat = None
+        self.minutes.fill(0)
+        self._load()
+
+    def _load(self) -> None:
+        """恢复当天已写出的累加结果（服务重启不丢失当天的数据）。"""
+        day_dir = self.day_dir()
+        try:
+            with open(os.path.join(day_dir, self.TIMELINE_JSON), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            columns = data["minutes"]
+            ticks = np.asarray(columns["ticks"], dtype=np.float32)
+            if ticks.shape == (1440,):
+                self.minutes[:, 0] = ticks
+                self.minutes[:, 1] = columns["changed"]
+                self.minutes[:, 2] = np.asarray(columns["rate_mean"], dtype=np.float32) * ticks  # 文件中保存的是均值
+                self.minutes[:, 3] = columns["rate_max"]
+            counts = cv2.imread(os.path.join(day_dir, self.HEATMAP_COUNTS), cv2.IMREAD_UNCHANGED)
+            if counts is not None and counts.ndim == 2:
+                self.heat = counts.astype(np.float32) * 255.0
+            logger.info(f"[ACTIVITY] 已恢复 {self.day} 的活动累加 (ticks={int(self.minutes[:, 0].sum())})")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"[ACTIVITY] 恢复 {day_dir} 的活动数据失败: {e}，从零开始累加。")
 
-    方法：
-    1) 必要时降采样到较小宽度以节省 CPU
-    2) 转灰度，做绝对差阈值化
-    3) 形态学膨胀，再提取轮廓，累计有效轮廓面积占比
-    4) 若面积差异率 <= 阈值（单位：百分比×1/100），视为相似
+    def maybe_flush(self) -> None:
+        if self._dirty and time.monotonic() - self.last_flush_monotonic >= ACTIVITY_MAP_FLUSH_INTERVAL_SECONDS:
+            self.flush()
 
-    返回 False 的情况：
-    - 任一帧不是有效的 numpy 图像
-    - 尺寸对齐失败或颜色转换失败
-    - 实际差异率超阈值
+    def flush(self) -> None:
+        """写出当天的热力图与时间线（临时文件 + os.replace，读者不会看到半个文件）。"""
+        self.last_flush_monotonic = time.monotonic()
+        if not self._dirty or not self.day:
+            return
+        t0 = time.perf_counter()
+        day_dir = self.day_dir()
+        ticks = self.minutes[:, 0]
+        rate_mean = np.divide(self.minutes[:, 2], ticks, out=np.zeros_like(ticks), where=ticks > 0)
+        data = {
+            "day": self.day.replace("/", "-"),
+            "updated": datetime.now().isoformat(timespec="seconds"),
+            "minutes": {
+                "ticks": ticks.astype(int).tolist(),
+                "changed": self.minutes[:, 1].astype(int).tolist(),
+                "rate_mean": np.round(rate_mean, 3).tolist(),
+                "rate_max": np.round(self.minutes[:, 3], 3).tolist(),
+            },
+            "heatmap_shape": list(self.heat.shape) if self.heat is not None else None,
+            "heatmap_max": 0.0,
+        }
+        try:
+            os.makedirs(day_dir, exist_ok=True)
+            if self.heat is not None:
+                counts = self.heat / 255.0
+                peak = float(counts.max())
+                data["heatmap_max"] = round(peak, 1)
+                scaled = cv2.convertScaleAbs(counts, alpha=255.0 / peak if peak > 0 else 0.0)
+                for name, image in ((self.HEATMAP_COUNTS, np.minimum(counts, 65535.0).astype(np.uint16)),
+                                    (self.HEATMAP_PNG, cv2.applyColorMap(scaled, cv2.COLORMAP_JET))):
+                    ok, png = cv2.imencode(".png", image)
+                    if not ok:
+                        raise OSError(f"PNG 编码失败: {name}")
+                    with open(os.path.join(day_dir, name + ".tmp"), "wb") as f:
+                        f.write(png.tobytes())
+                    os.replace(os.path.join(day_dir, name + ".tmp"), os.path.join(day_dir, name))
+            with open(os.path.join(day_dir, self.TIMELINE_JSON + ".tmp"), "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(os.path.join(day_dir, self.TIMELINE_JSON + ".tmp"), os.path.join(day_dir, self.TIMELINE_JSON))
+            self._dirty = False
+            self.flushes += 1
+        except Exception as e:
+            self.flush_errors += 1
+            logger.warning(f"[ACTIVITY] 写出活动热力图失败 ({day_dir}): {e}")
+        self.last_flush_ms = (time.perf_counter() - t0) * 1000.0
+
+    def stats(self) -> dict:
+        ticks = self.minutes[:, 0]
+        active = ticks > 0
+        return {
+            "day": self.day,
+            "ticks": int(ticks.sum()),
+            "changed": int(self.minutes[:, 1].sum()),
+            "active_minutes": int(active.sum()),
+            "diffs_accumulated": self.diffs_accumulated,
+            "diffs_skipped": self.diffs_skipped,
+            "heatmap_shape": list(self.heat.shape) if self.heat is not None else [],
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "last_flush_ms": round(self.last_flush_ms, 1),
+        }
+
+# --- Luminance Statistics & Deflicker ---
+class LumaTracker:
+    """保存帧的亮度统计与编码前去闪烁，全部基于已有的缩小灰度帧（256 级直方图，无需额外解码）。
+
+    - 统计：平均亮度、p5/p50/p95 分位数、8 段直方图（千分比），连同实际使用的 gamma 追加到
+      当天目录的 luma_stats.jsonl，合并阶段可直接据此生成去闪烁曲线
+    - 去闪烁：目标亮度为按时间加权的指数滑动平均（时间常数 DEFLICKER_TIME_CONSTANT_SECONDS），
+      每帧求使平均亮度接近目标的 gamma，查表（cv2.LUT）映射整帧；gamma 量化到 0.01，查找表按需重建
     """
+    STATS_FILE = "luma_stats.jsonl"
+    HIST_BINS = 8
 
-    # 1. 检查输入帧的有效性
-    # cap.read() 返回的 ret, frame。如果 ret 是 False，frame可能是 None 或无效数据
-    if not isinstance(frame1, np.ndarray) or frame1.size == 0:
-        logger.debug("are_frames_similar: frame1 无效 (非 NumPy 数组、None 或空数组)。返回 False。")
-        return False
-    if not isinstance(frame2, np.ndarray) or frame2.size == 0:
-        logger.debug("are_frames_similar: frame2 无效 (非 NumPy 数组、None 或空数组)。返回 False。")
-        return False
+    def __init__(self) -> None:
+        self._levels = np.arange(256, dtype=np.float64)
+        self.target_mean: float | None = None
+        self._target_ts = 0.0
+        self.last_mean = 0.0
+        self.last_gamma = 1.0
+        self._lut_gamma = 1.0
+        self._lut: np.ndarray | None = None
+        self._file = None
+        self._file_dir = ""
+        self.frames_recorded = 0
+        self.frames_adjusted = 0
+        self.write_errors = 0
+
+    def measure(self, reduced_gray: np.ndarray) -> dict:
+        hist = cv2.calcHist([reduced_gray], [0], None, [256], [0, 256]).ravel()
+        total = float(hist.sum()) or 1.0
+        cdf = np.cumsum(hist)
+        p5, p50, p95 = (int(np.searchsorted(cdf, q * total)) for q in (0.05, 0.5, 0.95))
+        bins = hist.reshape(self.HIST_BINS, -1).sum(axis=1)
+        return {
+            "mean": round(float(hist @ self._levels) / total, 2),
+            "p5": p5, "p50": p50, "p95": p95,
+            "hist": [int(round(v * 1000.0 / total)) for v in bins],
+        }
+
+    def deflicker(self, frame: np.ndarray, mean: float, ts: float, pool: 'FramePool | None' = None) -> np.ndarray:
+        """更新目标亮度曲线并返回映射后的帧（无需调整时返回原帧）。"""
+        if self.target_mean is None:
+            self.target_mean = mean
+        else:
+            alpha = 1.0 - math.exp(-max(0.0, ts - self._target_ts) / DEFLICKER_TIME_CONSTANT_SECONDS)
+            self.target_mean += alpha * (mean - self.target_mean)
+        self._target_ts = ts
+        gamma = 1.0
+        if mean >= DEFLICKER_MIN_MEAN and self.target_mean >= DEFLICKER_MIN_MEAN:
+            m = min(0.98, max(0.02, mean / 255.0))
+            t = min(0.98, max(0.02, self.target_mean / 255.0))
+            gamma = min(DEFLICKER_MAX_GAMMA, max(1.0 / DEFLICKER_MAX_GAMMA, math.log(t) / math.log(m)))
+            gamma = round(gamma, 2)
+        self.last_gamma = gamma
+        if gamma == 1.0:
+            return frame
+        if self._lut is None or gamma != self._lut_gamma:
+            self._lut = np.clip(np.power(self._levels / 255.0, gamma) * 255.0 + 0.5, 0, 255).astype(np.uint8)
+            self._lut_gamma = gamma
+        self.frames_adjusted += 1
+        return cv2.LUT(frame, self._lut, dst=pool_buffer(pool, "deflicker", frame.shape))
+
+    def record(self, day_dir: str, filename: str, ts: float, stats: dict) -> None:
+        """追加一行统计（每天一个文件，保持打开，按行缓冲）。"""
+        try:
+            if self._file is None or self._file_dir != day_dir:
+                self.close()
+                os.makedirs(day_dir, exist_ok=True)
+                self._file = open(os.path.join(day_dir, self.STATS_FILE), "a", encoding="utf-8", buffering=1)
+                self._file_dir = day_dir
+            line = {"file": filename, "ts": round(ts, 3), **stats, "gamma": self.last_gamma}
+            self._file.write(json.dumps(line, separators=(",", ":")) + "\n")
+            self.frames_recorded += 1
+        except OSError as e:
+            self.write_errors += 1
+            if self.write_errors == 1 or self.write_errors % 100 == 0:
+                logger.warning(f"[LUMA] 写入亮度统计失败 ({day_dir}): {e} (累计 {self.write_errors} 次)")
+            self.close()
 
-    # 2. 如有必要先下采样以降低分辨率（节省CPU），再确保尺寸相同
-    h1, w1 = frame1.shape[:2]
-    h2, w2 = frame2.shape[:2]
-    frame2_resized = frame2
+    def close(self) -> None:
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def stats(self) -> dict:
+        return {
+            "deflicker": DEFLICKER_ENABLED,
+            "target_mean": round(self.target_mean, 2) if self.target_mean is not None else None,
+            "last_mean": round(self.last_mean, 2),
+            "last_gamma": self.last_gamma,
+            "frames_recorded": self.frames_recorded,
+            "frames_adjusted": self.frames_adjusted,
+            "write_errors": self.write_errors,
+        }
+
+# --- Two-Tier Capture ---
+class TwoTierCapture:
+    """两级采集：每个 tick 先读低分辨率探测帧做内容检测与关键帧比较，只有变化时才取全分辨率帧。
+
+    - switch：同一设备在探测分辨率与全分辨率之间切换。切换耗时（重新协商格式 + 丢弃不稳定帧）
+      逐次测量；切到全分辨率后，连续相似的 tick 数达到“往返切换耗时 / 每 tick 节省的耗时”才切回探测，
+      变化频繁时停留在全分辨率，避免切换成本超过收益
+    - device：探测帧来自单独的设备节点（如摄像头的第二路低分辨率流），无需切换
+    - 设备不支持探测分辨率、打开或读帧失败时自动回退为普通采集（直到相机重建）
+    探测帧与全分辨率帧的缩小灰度帧宽度都不超过 SIMILARITY_MAX_WIDTH，关键帧可以互相比较。
+    """
+    def __init__(self, cap, mode: str, state: 'ServiceState') -> None:
+        self.cap = cap
+        self.mode = mode
+        self.state = state
+        self.active = True
+        self.probing = False
+        self.fallback_reason = ""
+        self.probe_cap = None
+        self.probe_ticks = 0
+        self.full_grabs = 0
+        self.switches = 0
+        self.similar_streak = 0
+        self.switch_ms: deque[float] = deque(maxlen=32)
+        self.probe_ms: float | None = None  # 探测 tick 耗时（EMA）
+        self.full_ms: float | None = None   # 全分辨率 tick 耗时（EMA）
+        self._enter_probe()
+
+    def _fallback(self, reason: str) -> None:
+        logger.warning(f"[PROBE] 两级采集回退为普通采集: {reason}")
+        self.fallback_reason = reason
+        self.active = False
+        if self.mode == "switch" and self.probing:
+            ok, _ = self._set_size(DEFAULT_WIDTH, DEFAULT_HEIGHT, REQUESTED_FOURCC)
+            if not ok:
+                self.state.camera_reinit_requested = True  # 无法恢复全分辨率时重建相机
+        self.probing = False
+        self._release_probe_cap()
+
+    def _release_probe_cap(self) -> None:
+        if self.probe_cap is not None:
+            try:
+                self.probe_cap.release()
+            except Exception:
+                pass
+            self.probe_cap = None
 
-    # 下采样比例（按宽度上限等比缩小）
-    if w1 > SIMILARITY_MAX_WIDTH:
-        scale1 = SIMILARITY_MAX_WIDTH / float(w1)
-        new_w1, new_h1 = int(w1 * scale1), int(h1 * scale1)
-        try:
-            frame1 = cv2.resize(frame1, (new_w1, new_h1), interpolation=cv2.INTER_AREA)
-        except cv2.error:
-            return False
-        h1, w1 = frame1.shape[:2]
-    if w2 > SIMILARITY_MAX_WIDTH:
-        scale2 = SIMILARITY_MAX_WIDTH / float(w2)
-        new_w2, new_h2 = int(w2 * scale2), int(h2 * scale2)
+    def _set_size(self, width: int, height: int, fourcc: str | None) -> tuple[bool, float]:
+        """切换主设备分辨率（V4L2 会重新协商格式并重启流），返回 (是否生效, 耗时毫秒)。"""
+        t0 = time.perf_counter()
         try:
-            frame2 = cv2.resize(frame2, (new_w2, new_h2), interpolation=cv2.INTER_AREA)
-        except cv2.error:
+            if fourcc:
+                self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+            for _ in range(CAPTURE_PROBE_SWITCH_FLUSH_FRAMES):
+                self.cap.grab()
+            ok = (int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)) == width
+                  and int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) == height)
+        except Exception as e:
+            logger.warning(f"[PROBE] 切换分辨率到 {width}x{height} 异常: {e}")
+            ok = False
+        elapsed_ms = (time.perf_counter() - t0) * 1000.0
+        self.switch_ms.append(elapsed_ms)
+        self.switches += 1
+        return ok, elapsed_ms
+
+    def _enter_probe(self) -> None:
+        if self.mode == "device":
+            if not CAPTURE_PROBE_DEVICE:
+                self._fallback("未配置探测设备 (two_tier_capture.probe_device)")
+                return
+            self.probe_cap, _ = initialize_camera(CAPTURE_PROBE_DEVICE, CAPTURE_PROBE_WIDTH, CAPTURE_PROBE_HEIGHT,
+                                                  CAPTURE_PROBE_FOURCC or REQUESTED_FOURCC)
+            if self.probe_cap is None:
+                self._fallback(f"探测设备 {CAPTURE_PROBE_DEVICE} 无法打开")
+                return
+            self.probing = True
+            return
+        ok, elapsed_ms = self._set_size(CAPTURE_PROBE_WIDTH, CAPTURE_PROBE_HEIGHT, CAPTURE_PROBE_FOURCC)
+        self.probing = True  # 回退时需要恢复全分辨率
+        if not ok:
+            self._fallback(f"设备不支持探测分辨率 {CAPTURE_PROBE_WIDTH}x{CAPTURE_PROBE_HEIGHT}")
+            return
+        logger.debug("[PROBE] 切换到探测分辨率 %dx%d，耗时 %.1fms", CAPTURE_PROBE_WIDTH, CAPTURE_PROBE_HEIGHT, elapsed_ms)
+
+    def _enter_full(self) -> bool:
+        ok, elapsed_ms = self._set_size(DEFAULT_WIDTH, DEFAULT_HEIGHT,
+                                        REQUESTED_FOURCC if CAPTURE_PROBE_FOURCC else None)
+        self.probing = False
+        self.similar_streak = 0
+        if not ok:
+            self.active = False
+            self.fallback_reason = "切换回全分辨率失败"
+            logger.error("[PROBE] 切换回全分辨率失败，请求重建摄像头。")
+            self.state.camera_reinit_requested = True
             return False
-        h2, w2 = frame2.shape[:2]
+        logger.debug("[PROBE] 切换到全分辨率，耗时 %.1fms", elapsed_ms)
+        return True
 
-    if (h1, w1) != (h2, w2):
-        logger.debug(f"are_frames_similar: 帧尺寸不同。将 frame2 从 ({w2}x{h2}) 调整为 ({w1}x{h1})。")
+    def probe(self, force_save: bool = False) -> tuple[str | None, tuple | None]:
+        """读取并判定一帧探测帧。
+
+        返回 (跳过原因, None) 表示本 tick 到此结束；(None, (缩小灰度帧, 哈希)) 表示有变化，
+        调用方应读取全分辨率帧并把判定结果交给 process_and_save_frame；(None, None) 表示按普通流程采集。
+        """
+        if not self.active or not self.probing:
+            return None, None
+        if force_save:
+            if self.mode == "switch":
+                self._enter_full()
+            return None, None
+        t0 = time.perf_counter()
+        cap = self.probe_cap if self.probe_cap is not None else self.cap
+        pool = self.state.buffers
         try:
-            frame2_resized = cv2.resize(frame2, (w1, h1), interpolation=cv2.INTER_AREA)
-        except cv2.error as e:
-            logger.error(f"are_frames_similar: 调整 frame2 尺寸失败: {e}。返回 False。")
-            return False # 调整尺寸失败，无法比较
-
-    # 3. 转换为灰度图进行比较
-    #    确保处理单通道和三通道输入，最终得到单通道灰度图
-    try:
-        if frame1.ndim == 3 and frame1.shape[2] == 3: # BGR
-            gray1 = cv2.cvtColor(frame1, cv2.COLOR_BGR2GRAY)
-        elif frame1.ndim == 2: # Already grayscale
-            gray1 = frame1
+            cap.grab()  # 丢弃缓冲中的旧帧
+            probe_buf = pool.peek("probe_capture") if pool is not None else None
+            ret, frame = cap.read(probe_buf) if probe_buf is not None else cap.read()
+        except Exception as e:
+            ret, frame = False, None
+            logger.debug("[PROBE] 读取探测帧异常: %s", e)
+        if not ret or frame is None:
+            self._fallback("探测帧读取失败")
+            return None, None
+        if pool is not None:
+            pool.adopt("probe_capture", frame)
+        if frame.ndim == 3 and frame.shape[2] == 2:
+            # 未转换的 YUYV：直接取亮度通道，比先转 BGR 再转灰度便宜得多
+            frame = cv2.cvtColor(frame, cv2.COLOR_YUV2GRAY_YUYV, dst=pool_buffer(pool, "probe_gray", frame.shape[:2]))
+        reduced = reduce_frame_for_similarity(frame, governed_similarity_width(self.state), pool=pool)
+        if reduced is None:
+            self._fallback(f"探测帧格式无法处理 (shape: {frame.shape})")
+            return None, None
+        verdict, frame_hash = judge_reduced_frame(self.state, reduced, (DEFAULT_WIDTH, DEFAULT_HEIGHT))
+        self.probe_ticks += 1
+        self.probe_ms = _ema(self.probe_ms, (time.perf_counter() - t0) * 1000.0)
+        if verdict:
+            return verdict, None
+        self.full_grabs += 1
+        if self.mode == "switch" and not self._enter_full():
+            return None, None
+        return None, (reduced, frame_hash)
+
+    def after_full_frame(self, verdict, elapsed_ms: float) -> None:
+        """全分辨率 tick 结束后调用：更新耗时，switch 模式下判断是否值得切回探测分辨率。"""
+        if not self.active:
+            return
+        self.full_ms = _ema(self.full_ms, elapsed_ms)
+        if self.mode != "switch" or self.probing:
+            return
+        self.similar_streak = self.similar_streak + 1 if verdict == "SIMILARITY" else 0
+        if self.similar_streak >= self.hold_ticks():
+            self._enter_probe()
+
+    def hold_ticks(self) -> int:
+        """切回探测分辨率前需要的连续相似 tick 数：一次往返切换的耗时由之后每个探测 tick 节省的耗时摊销。"""
+        if not self.switch_ms or self.full_ms is None or self.probe_ms is None:
+            return 1
+        saving_ms = max(0.5, self.full_ms - self.probe_ms)
+        round_trip_ms = 2.0 * sorted(self.switch_ms)[len(self.switch_ms) // 2]
+        return int(min(CAPTURE_PROBE_MAX_HOLD_TICKS, max(1, math.ceil(round_trip_ms / saving_ms))))
+
+    def close(self) -> None:
+        """停用两级采集（配置关闭或模式变化）：恢复全分辨率并释放探测设备。"""
+        if self.mode == "switch" and self.probing and self.active:
+            self._enter_full()
+        self.probing = False
+        self._release_probe_cap()
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "active": self.active,
+            "probing": self.probing,
+            "fallback_reason": self.fallback_reason,
+            "probe_ticks": self.probe_ticks,
+            "full_grabs": self.full_grabs,
+            "switches": self.switches,
+            "switch_ms_p50": round(sorted(self.switch_ms)[len(self.switch_ms) // 2], 1) if self.switch_ms else 0.0,
+            "probe_ms": round(self.probe_ms or 0.0, 2),
+            "full_ms": round(self.full_ms or 0.0, 2),
+            "hold_ticks": self.hold_ticks() if self.mode == "switch" else 0,
+        }
+
+def _ema(previous: float | None, value: float, alpha: float = 0.2) -> float:
+    return value if previous is None else previous + alpha * (value - previous)
+
+# --- Overlay Compositor ---
+class TextOverlay:
+    """单个叠加层：文本来源（timestamp/text/file）+ 锚点 + 缓存的 alpha 掩码。"""
+    def __init__(self, name: str, kind: str, anchor: str = "bottom-right", color=(255, 255, 255),
+                 text: str = "", fmt: str = "", path: str = "", refresh_seconds: float = 10.0) -> None:
+        self.name = name
+        self.kind = kind
+        self.anchor = anchor
+        self.color = tuple(int(c) for c in color)
+        self.text = text
+        self.fmt = fmt
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self.cost_ms: deque[float] = deque(maxlen=120)
+        self._file_value = ""
+        self._file_read_monotonic = -1e9
+        # 渲染缓存（分辨率变化时由合成器清空）
+        self.rendered_text: str | None = None
+        self.mask: np.ndarray | None = None
+        self.offsets: list[int] = []
+        # 混合用的预乘缓存：(255-alpha) 三通道、color*alpha 前景，掩码变化时重建
+        self.inv_alpha: np.ndarray | None = None
+        self.foreground: np.ndarray | None = None
+        self.scratch: np.ndarray | None = None
+
+    def update_blend_cache(self) -> None:
+        """由当前掩码重建混合缓存，使逐帧混合只剩两次 OpenCV 逐像素运算。"""
+        alpha = cv2.merge([self.mask, self.mask, self.mask])
+        self.inv_alpha = 255 - alpha
+        solid = np.empty_like(alpha)
+        solid[...] = self.color
+        self.foreground = cv2.multiply(solid, alpha, scale=1.0 / 255.0)
+        self.scratch = np.empty_like(alpha)
+
+    def current_text(self, now: datetime) -> str:
+        """返回本帧应显示的文本；file 类型按 refresh_seconds 节流读取。"""
+        if self.kind == "timestamp":
+            return now.strftime(self.fmt)
+        if self.kind == "file":
+            if time.monotonic() - self._file_read_monotonic >= self.refresh_seconds:
+                self._file_read_monotonic = time.monotonic()
+                try:
+                    with open(self.path, "r", encoding="utf-8", errors="replace") as f:
+                        self._file_value = f.readline(128).strip()
+                except OSError:
+                    self._file_value = "--"
+            return (self.text or "{value}").replace("{value}", self._file_value)
+        return self.text
+
+class OverlayCompositor:
+    """叠加层合成器：按分辨率缓存字形精灵，只重绘变化的字符，只在文本包围盒内做 alpha 混合。
+
+    - 几何参数（字号/线宽/边距）沿用原时间戳的比例规则，每个分辨率只计算一次
+    - 每个字符用 cv2.putText 渲染一次为 alpha 精灵，按字符前进宽度拼接成整行掩码
+    - 文本长度与字宽不变时（时间戳的常见情况）仅替换变化位置的精灵
+    - 同一锚点的多个叠加层自下而上（或自上而下）堆叠
+    """
+    FONT = cv2.FONT_HERSHEY_SIMPLEX
+    ANCHORS = ("bottom-right", "bottom-left", "top-right", "top-left")
+
+    def __init__(self, overlays: list[TextOverlay]) -> None:
+        self.overlays = overlays
+        self._layout_size: tuple[int, int] | None = None
+        self._glyphs: dict[str, tuple[np.ndarray, int]] = {}
+        self.font_scale = 1.0
+        self.thickness = 1
+        self.margin = 10
+        self.line_height = 0
+        self._ascent = 0
+
+    def _ensure_layout(self, img_h: int, img_w: int) -> None:
+        if self._layout_size == (img_h, img_w):
+            return
+        self.font_scale = max(0.5, (img_h / 1080.0) * 1.0)
+        self.thickness = max(1, int(self.font_scale * 2.0))
+        self.margin = max(10, int(img_h * 0.05))
+        (_, text_h), baseline = cv2.getTextSize("Ag|", self.FONT, self.font_scale, self.thickness)
+        self._ascent = text_h + self.thickness
+        self.line_height = self._ascent + baseline + self.thickness
+        self._glyphs = {}
+        for overlay in self.overlays:
+            overlay.rendered_text, overlay.mask, overlay.offsets = None, None, []
+        self._layout_size = (img_h, img_w)
+
+    def _glyph(self, ch: str) -> tuple[np.ndarray, int]:
+        """返回 (字形 alpha 精灵, 前进宽度)；首次使用时渲染并缓存。"""
+        cached = self._glyphs.get(ch)
+        if cached is None:
+            (ink_w, _), _ = cv2.getTextSize(ch, self.FONT, self.font_scale, self.thickness)
+            (pair_w, _), _ = cv2.getTextSize(ch + ch, self.FONT, self.font_scale, self.thickness)
+            advance = max(1, pair_w - ink_w)
+            sprite = np.zeros((self.line_height, max(1, ink_w)), dtype=np.uint8)
+            cv2.putText(sprite, ch, (0, self._ascent), self.FONT, self.font_scale, 255,
+                        self.thickness, cv2.LINE_AA)
+            cached = (sprite, advance)
+            self._glyphs[ch] = cached
+        return cached
+
+    def _blit(self, mask: np.ndarray, x: int, ch: str) -> None:
+        sprite, _ = self._glyph(ch)
+        w = min(sprite.shape[1], mask.shape[1] - x)
+        if w > 0:
+            np.maximum(mask[:, x:x + w], sprite[:, :w], out=mask[:, x:x + w])
+
+    def _render(self, overlay: TextOverlay, text: str) -> np.ndarray:
+        """生成/更新叠加层的整行掩码。"""
+        old = overlay.rendered_text
+        if old is not None and overlay.mask is not None and len(old) == len(text):
+            changed = [i for i, (a, b) in enumerate(zip(old, text)) if a != b]
+            if all(self._glyph(old[i])[1] == self._glyph(text[i])[1] for i in changed):
+                mask = overlay.mask
+                for i in changed:
+                    x = overlay.offsets[i]
+                    mask[:, x:x + self._glyph(old[i])[0].shape[1]] = 0
+                    for j in (i - 1, i, i + 1):  # 相邻字形可能有 1~2px 的笔画重叠
+                        if 0 <= j < len(text):
+                            self._blit(mask, overlay.offsets[j], text[j])
+                overlay.rendered_text = text
+                return mask
+        offsets, x = [], 0
+        for ch in text:
+            offsets.append(x)
+            x += self._glyph(ch)[1]
+        width = max([offsets[i] + self._glyph(ch)[0].shape[1] for i, ch in enumerate(text)] + [1])
+        mask = np.zeros((self.line_height, width), dtype=np.uint8)
+        for i, ch in enumerate(text):
+            self._blit(mask, offsets[i], ch)
+        overlay.rendered_text, overlay.mask, overlay.offsets = text, mask, offsets
+        return mask
+
+    def _origin(self, overlay: TextOverlay, mask_w: int, img_h: int, img_w: int,
+                stack_offset: dict[str, int]) -> tuple[int, int]:
+        """计算叠加层左上角坐标，并推进同一锚点的堆叠偏移。"""
+        anchor = overlay.anchor if overlay.anchor in stack_offset else "bottom-right"
+        x0 = img_w - mask_w - self.margin if anchor.endswith("right") else self.margin
+        if anchor.startswith("bottom"):
+            # 与原实现一致：基线位于 img_h - margin
+            y0 = img_h - self.margin - self._ascent - stack_offset[anchor]
         else:
-            logger.warning(f"are_frames_similar: frame1 格式未知 (shape: {frame1.shape})。返回 False。")
-            return False
+            y0 = self.margin + stack_offset[anchor]
+        stack_offset[anchor] += int(self.line_height * 1.2)
+        return x0, y0
+
+    def exclusion_regions(self, img_h: int, img_w: int, now: datetime, pad: int = 8) -> list[dict]:
+        """返回叠加层在画面中的包围盒（exclude 区域格式），供离线比较已叠加时间戳的归档图片。"""
+        self._ensure_layout(img_h, img_w)
+        stack_offset = {anchor: 0 for anchor in self.ANCHORS}
+        regions = []
+        for overlay in self.overlays:
+            text = overlay.current_text(now)
+            if not text:
+                continue
+            mask = self._render(overlay, text)
+            overlay.update_blend_cache()
+            x0, y0 = self._origin(overlay, mask.shape[1], img_h, img_w, stack_offset)
+            # 时间戳宽度随数字变化，左右额外留出一个字宽
+            extra = pad + self._glyph("0")[1]
+            regions.append({"name": overlay.name, "mode": "exclude",
+                            "rect": [x0 - extra, y0 - pad, mask.shape[1] + 2 * extra, mask.shape[0] + 2 * pad]})
+        return regions
+
+    def apply(self, frame: np.ndarray, now: datetime) -> np.ndarray:
+        """将全部叠加层原地混合进 frame（BGR uint8）并返回 frame。"""
+        if not (isinstance(frame, np.ndarray) and frame.ndim == 3 and frame.shape[2] == 3):
+            return frame
+        img_h, img_w = frame.shape[:2]
+        self._ensure_layout(img_h, img_w)
+        stack_offset = {anchor: 0 for anchor in self.ANCHORS}
+        for overlay in self.overlays:
+            t0 = time.perf_counter()
+            text = overlay.current_text(now)
+            if not text:
+                continue
+            if text != overlay.rendered_text:
+                self._render(overlay, text)
+                overlay.update_blend_cache()
+            mask_h, mask_w = overlay.mask.shape
+            x0, y0 = self._origin(overlay, mask_w, img_h, img_w, stack_offset)
+            # 裁剪到画面内，只在包围盒 ROI 上做混合
+            mx0, my0 = max(0, -x0), max(0, -y0)
+            x0, y0 = max(0, x0), max(0, y0)
+            x1, y1 = min(img_w, x0 + mask_w - mx0), min(img_h, y0 + mask_h - my0)
+            if x1 <= x0 or y1 <= y0:
+                continue
+            crop = (slice(my0, my0 + (y1 - y0)), slice(mx0, mx0 + (x1 - x0)))
+            roi = frame[y0:y1, x0:x1]
+            scratch = overlay.scratch[crop]
+            # roi = roi * (255 - a) / 255 + color * a / 255
+            cv2.multiply(roi, overlay.inv_alpha[crop], dst=scratch, scale=1.0 / 255.0)
+            cv2.add(scratch, overlay.foreground[crop], dst=roi)
+            overlay.cost_ms.append((time.perf_counter() - t0) * 1000.0)
+        return frame
+
+    def stats(self) -> dict:
+        """各叠加层平均耗时（毫秒，滑动窗口）。"""
+        return {o.name: round(sum(o.cost_ms) / len(o.cost_ms), 3) if o.cost_ms else 0.0 for o in self.overlays}
+
+def build_overlay_compositor(ts_format: str | None = None) -> OverlayCompositor:
+    """根据 OVERLAY_CONFIG / ENABLE_TIMESTAMP 构建合成器；未配置叠加层时仅叠加右下角时间戳。
+
+    ts_format 为 timestamp 叠加层未单独指定 format 时使用的 strftime 格式。
+    """
+    specs = OVERLAY_CONFIG or [{"type": "timestamp"}]
+    overlays = []
+    for idx, spec in enumerate(specs):
+        kind = str(spec.get("type", "text")).lower()
+        if kind not in ("timestamp", "text", "file"):
+            logger.warning(f"[OVERLAY] 未知叠加层类型 '{kind}'，已忽略。")
+            continue
+        if kind == "timestamp" and not ENABLE_TIMESTAMP:
+            continue
+        color = spec.get("color", (255, 255, 255))
+        overlays.append(TextOverlay(
+            name=str(spec.get("name") or (kind if kind == "timestamp" else f"{kind}{idx}")),
+            kind=kind,
+            anchor=str(spec.get("position", "bottom-right")),
+            color=tuple(int(c) for c in color)[:3] if isinstance(color, (list, tuple)) and len(color) >= 3 else (255, 255, 255),
+            text=str(spec.get("text", "")),
+            fmt=str(spec.get("format") or ts_format or TIMESTAMP_FORMAT),
+            path=str(spec.get("path", "")),
+            refresh_seconds=float(spec.get("refresh_seconds", 10.0)),
+        ))
+    return OverlayCompositor(overlays)
+
+# --- Frame Buffer Pool ---
+class FramePool:
+    """按名称复用的帧缓冲区，供 OpenCV 的 dst= 参数与 cap.read(image) 使用。
+
+    每个名称的缓冲区只在形状/类型变化（协商分辨率改变）时重新分配，稳态下逐帧零分配，
+    避免小内存设备上长期运行的分配器抖动与 RSS 碎片。缓冲区内容只在当前帧内有效，
+    需要跨帧保留的数据（关键帧、静止检测探针）必须复制到常驻缓冲区。
+    """
+    def __init__(self) -> None:
+        self._buffers: dict[str, np.ndarray] = {}
+        self.allocations: int = 0
+        self.allocated_bytes: int = 0
+
+    def get(self, name: str, shape: tuple, dtype=np.uint8) -> np.ndarray:
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = np.empty(shape, dtype)
+            self._buffers[name] = buf
+            self.allocations += 1
+            self.allocated_bytes += buf.nbytes
+        return buf
+
+    def peek(self, name: str) -> np.ndarray | None:
+        return self._buffers.get(name)
+
+    def adopt(self, name: str, arr: np.ndarray) -> None:
+        """登记由外部分配的缓冲区（如 cap.read 因尺寸变化返回了新数组）。"""
+        if self._buffers.get(name) is not arr:
+            self._buffers[name] = arr
+            self.allocations += 1
+            self.allocated_bytes += arr.nbytes
+
+    def stats(self) -> dict:
+        return {
+            "buffers": len(self._buffers),
+            "resident_bytes": sum(b.nbytes for b in self._buffers.values()),
+            "allocations": self.allocations,
+            "allocated_bytes": self.allocated_bytes,
+        }
+
+def pool_buffer(pool: FramePool | None, name: str, shape: tuple) -> np.ndarray | None:
+    """池化时返回复用缓冲区，否则返回 None（OpenCV 的 dst=None 即自行分配）。"""
+    return pool.get(name, shape) if pool is not None else None
+
+# --- Change Detection Regions ---
+class RegionMask:
+    """变化检测的感兴趣区域（include）与忽略区域（exclude）掩码。
+
+    - 区域在 YAML 中以矩形 rect: [x, y, w, h] 或多边形 polygon: [[x, y], ...] 给出，坐标为采集帧像素
+    - 每种（采集尺寸, 缩小尺寸）组合只光栅化一次，得到缩小灰度帧尺寸的掩码
+    - 比较时只处理掩码外接矩形内的像素，矩形外（被排除的）像素不参与任何计算
+    - 每个 include 区域单独给出变化分数（区域内变化像素占比，百分比）
+    """
+    def __init__(self, regions: list[dict], frame_size: tuple[int, int], reduced_size: tuple[int, int]) -> None:
+        self.key = (frame_size, reduced_size)
+        fw, fh = frame_size
+        rw, rh = reduced_size
+        sx, sy = rw / float(fw), rh / float(fh)
+        include = np.zeros((rh, rw), np.uint8)
+        exclude = np.zeros((rh, rw), np.uint8)
+        named: list[tuple[str, np.ndarray]] = []
+        has_include = False
+        for idx, region in enumerate(regions):
+            pts = self._region_points(region)
+            if pts is None:
+                logger.warning(f"[ROI] 区域 #{idx} 缺少有效的 rect/polygon，已忽略: {region}")
+                continue
+            scaled = np.round(pts * (sx, sy)).astype(np.int32)
+            region_mask = np.zeros((rh, rw), np.uint8)
+            cv2.fillPoly(region_mask, [scaled], 255)
+            if str(region.get("mode", "include")).lower() == "exclude":
+                cv2.bitwise_or(exclude, region_mask, dst=exclude)
+            else:
+                has_include = True
+                cv2.bitwise_or(include, region_mask, dst=include)
+                named.append((str(region.get("name") or f"roi{idx}"), region_mask))
+        combined = include if has_include else np.full((rh, rw), 255, np.uint8)
+        combined[exclude > 0] = 0
+        self.active_pixels = int(cv2.countNonZero(combined))
+        x, y, w, h = cv2.boundingRect(combined) if self.active_pixels else (0, 0, 0, 0)
+        self.bbox = (slice(y, y + h), slice(x, x + w))
+        self.mask = combined[self.bbox]
+        self.needs_mask = self.active_pixels < w * h  # 外接矩形内仍有被排除的像素
+        # 各 include 区域在外接矩形坐标系中的子矩形与掩码
+        self.rois: list[tuple[str, tuple[slice, slice], np.ndarray, int]] = []
+        for name, region_mask in named:
+            cropped = cv2.bitwise_and(region_mask, combined)[self.bbox]
+            count = int(cv2.countNonZero(cropped))
+            if count == 0:
+                continue
+            rx, ry, rw_, rh_ = cv2.boundingRect(cropped)
+            sub = (slice(ry, ry + rh_), slice(rx, rx + rw_))
+            self.rois.append((name, sub, cropped[sub].copy(), count))
+        logger.info(f"[ROI] 检测掩码已光栅化: 缩小尺寸 {rw}x{rh}, 有效像素 {self.active_pixels} "
+                    f"({self.active_pixels * 100.0 / max(1, rw * rh):.1f}%), 外接矩形 {w}x{h}, 区域 {len(self.rois)} 个")
+
+    @staticmethod
+    def _region_points(region: dict) -> np.ndarray | None:
+        try:
+            if "rect" in region:
+                x, y, w, h = (float(v) for v in region["rect"])
+                return np.array([[x, y], [x + w, y], [x + w, y + h], [x, y + h]], np.float64)
+            if "polygon" in region:
+                pts = np.array(region["polygon"], np.float64)
+                if pts.ndim == 2 and pts.shape[0] >= 3 and pts.shape[1] == 2:
+                    return pts
+        except (TypeError, ValueError):
+            pass
+        return None
 
-        if frame2_resized.ndim == 3 and frame2_resized.shape[2] == 3: # BGR
-            gray2 = cv2.cvtColor(frame2_resized, cv2.COLOR_BGR2GRAY)
-        elif frame2_resized.ndim == 2: # Already grayscale
-            gray2 = frame2_resized
-        else:
-            logger.warning(f"are_frames_similar: frame2_resized 格式未知 (shape: {frame2_resized.shape})。返回 False。")
-            return False
+    def roi_scores(self, changed: np.ndarray) -> dict[str, float]:
+        """changed 为外接矩形内的二值变化图，返回各区域变化像素占比（百分比）。"""
+        scores = {}
+        for name, sub, roi_mask, count in self.rois:
+            hits = cv2.countNonZero(cv2.bitwise_and(changed[sub], roi_mask))
+            scores[name] = round(hits * 100.0 / count, 3)
+        return scores
+
+def get_region_mask(state: 'ServiceState', frame_size: tuple[int, int],
+                    reduced_size: tuple[int, int]) -> RegionMask | None:
+    """返回当前分辨率的检测掩码（未配置区域时为 None），分辨率变化时重新光栅化。"""
+    if not DETECTION_REGIONS_CONFIG:
+        return None
+    key = (frame_size, reduced_size)
+    if state.region_mask is None or state.region_mask.key != key:
+        state.region_mask = RegionMask(DETECTION_REGIONS_CONFIG, frame_size, reduced_size)
+    return state.region_mask
+
+def reduce_frame_for_similarity(frame: np.ndarray | None, max_width: int | None = None,
+                                pool: FramePool | None = None) -> np.ndarray | None:
+    """将帧等比降采样到 SIMILARITY_MAX_WIDTH（或 max_width）以内并转为灰度。
+
+    得到的“缩小灰度帧”是相似度判断与内容检测（黑帧/静止帧）共用的输入，
+    每帧只计算一次。输入无效或转换失败时返回 None。
+    给定 pool 时结果写入复用缓冲区（下一帧会被覆盖）。
+    """
+    if not isinstance(frame, np.ndarray) or frame.size == 0:
+        return None
+    max_width = max_width or SIMILARITY_MAX_WIDTH
+    h, w = frame.shape[:2]
+    try:
+        if w > max_width:
+            scale = max_width / float(w)
+            size = (int(w * scale), int(h * scale))
+            frame = cv2.resize(frame, size, dst=pool_buffer(pool, "reduce_resized", (size[1], size[0]) + frame.shape[2:]),
+                               interpolation=cv2.INTER_AREA)
+        if frame.ndim == 3 and frame.shape[2] == 3: # BGR
+            return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=pool_buffer(pool, "reduce_gray", frame.shape[:2]))
+        if frame.ndim == 2: # Already grayscale
+            if w > max_width:
+                return frame
+            if pool is None:
+                return frame.copy()
+            gray = pool.get("reduce_gray", frame.shape)
+            np.copyto(gray, frame)
+            return gray
+        logger.warning(f"reduce_frame_for_similarity: 帧格式未知 (shape: {frame.shape})。")
+        return None
     except cv2.error as e:
-        logger.error(f"are_frames_similar: 转换为灰度图失败: {e}。返回 False。")
-        return False
+        logger.error(f"reduce_frame_for_similarity: 降采样/灰度转换失败: {e}。")
+        return None
 
-    # 3.5 再次确保尺寸与 dtype 一致
+def compare_reduced_frames(gray1: np.ndarray, gray2: np.ndarray,
+                           similarity_diff_rate_threshold_int: int,
+                           regions: RegionMask | None = None,
+                           pool: FramePool | None = None,
+                           on_diff=None) -> tuple[bool, float, dict[str, float]]:
+    """比较两张缩小灰度帧，返回 (是否相似, 轮廓面积差异率百分比, 各区域变化分数)。
+
+    绝对差阈值化 -> 形态学膨胀 -> 提取外轮廓，累计有效轮廓面积占比；
+    差异率 <= 阈值（单位：百分比×1/100）视为相似。异常时返回 (False, 100.0, {})。
+    给定 regions 时只在检测掩码的外接矩形内计算，差异率以有效像素为分母。
+    on_diff(阈值化差异图, 差异率, 整帧尺寸, 外接矩形切片或 None) 用于复用差异图（如活动热力图），
+    差异图可能位于复用缓冲区，回调内不得保留引用。
+    """
+    # 确保尺寸与 dtype 一致
     try:
         if gray1.shape != gray2.shape:
-            logger.debug(f"are_frames_similar: 灰度尺寸不一致 {gray1.shape} vs {gray2.shape}，调整 gray2 以匹配 gray1。")
+            logger.debug("compare_reduced_frames: 灰度尺寸不一致 %s vs %s，调整 gray2 以匹配 gray1。", gray1.shape, gray2.shape)
             gray2 = cv2.resize(gray2, (gray1.shape[1], gray1.shape[0]), interpolation=cv2.INTER_AREA)
         if gray1.dtype != gray2.dtype:
-            logger.debug(f"are_frames_similar: 灰度 dtype 不一致 {gray1.dtype} vs {gray2.dtype}，转换 gray2 dtype。")
+            logger.debug("compare_reduced_frames: 灰度 dtype 不一致 %s vs %s，转换 gray2 dtype。", gray1.dtype, gray2.dtype)
             gray2 = gray2.astype(gray1.dtype, copy=False)
     except Exception as e:
-        logger.error(f"are_frames_similar: 对齐尺寸/dtype 时异常: {e}。返回 False。")
-        return False
+        logger.error(f"compare_reduced_frames: 对齐尺寸/dtype 时异常: {e}。")
+        return False, 100.0, {}
 
-    # 4. 计算轮廓面积差异率
     image_total_pixels = gray1.shape[0] * gray1.shape[1]
+    full_shape = gray1.shape
+    if regions is not None:
+        if regions.key[1] == (gray1.shape[1], gray1.shape[0]):
+            # 只取掩码外接矩形（切片视图，无拷贝）
+            gray1 = gray1[regions.bbox]
+            gray2 = gray2[regions.bbox]
+            image_total_pixels = regions.active_pixels
+        else:
+            logger.debug("compare_reduced_frames: 检测掩码尺寸 %s 与帧 %s 不匹配，按整帧比较。", regions.key[1], gray1.shape)
+            regions = None
     if image_total_pixels == 0:
-        logger.debug("are_frames_similar: 图像总像素为0。返回 False。")
-        return False
+        logger.debug("compare_reduced_frames: 图像总像素为0。")
+        return False, 100.0, {}
 
     try:
-        abs_diff_img = cv2.absdiff(gray1, gray2)
+        abs_diff_img = cv2.absdiff(gray1, gray2, dst=pool_buffer(pool, "diff_abs", gray1.shape))
     except cv2.error as e:
-        logger.error(f"are_frames_similar: absdiff 失败: {e}。返回 False。")
-        return False
+        logger.error(f"compare_reduced_frames: absdiff 失败: {e}。")
+        return False, 100.0, {}
     _, thresh_img = cv2.threshold(abs_diff_img,
                                   DEFAULT_CONTOUR_PIXEL_THRESHOLD,
                                   255,
-                                  cv2.THRESH_BINARY)
+                                  cv2.THRESH_BINARY,
+                                  dst=pool_buffer(pool, "diff_thresh", gray1.shape))
+
+    if regions is not None and regions.needs_mask:
+        cv2.bitwise_and(thresh_img, regions.mask, dst=thresh_img)
 
     dilated_thresh_img = cv2.dilate(thresh_img,
                                     CONTOUR_KERNEL,
+                                    dst=pool_buffer(pool, "diff_dilated", gray1.shape),
                                     iterations=DEFAULT_CONTOUR_DILATION_ITERATIONS)
 
     contours, _ = cv2.findContours(dilated_thresh_img,
@@ -739,29 +2730,384 @@ def are_frames_similar(frame1: np.ndarray | None,
 
     contour_area_actual_diff_rate_percent = (total_significant_contour_area / image_total_pixels) * 100.0
 
-    # 5. 根据阈值判断是否相似
     # 将传入的整数阈值转换为实际百分比上限
     similarity_threshold_as_percentage = similarity_diff_rate_threshold_int / 100.0
 
-    logger.debug(f"are_frames_similar: 实际轮廓差异率: {contour_area_actual_diff_rate_percent:.4f}%, " +
-                 f"设定的相似度差异上限: {similarity_threshold_as_percentage:.4f}% " +
-                 f"(传入整数: {similarity_diff_rate_threshold_int})")
-
-    if contour_area_actual_diff_rate_percent <= similarity_threshold_as_percentage:
-        # 差异小或等于阈值，认为相似 (变化小)
-        # logger.info(f"are_frames_similar: 差异率达标{contour_area_actual_diff_rate_percent:.4f}%，判定为相似 (True)。")
-        return True
-    else:
-        # 差异大，认为不相似 (变化大)
-        # logger.info(f"are_frames_similar: 差异率超标{contour_area_actual_diff_rate_percent:.4f}%，判定为不相似 (False)。")
-        return False
+    logger.debug("compare_reduced_frames: 实际轮廓差异率: %.4f%%, 设定的相似度差异上限: %.4f%% (传入整数: %s)",
+                 contour_area_actual_diff_rate_percent, similarity_threshold_as_percentage,
+                 similarity_diff_rate_threshold_int)
 
-def process_and_save_frame(state: 'ServiceState', frame_data, effective_fourcc, base_save_dir, jpeg_quality_val, ts_format):
-    """处理一帧图像并尝试保存。
+    # 差异小或等于阈值，认为相似 (变化小)；否则不相似 (变化大)
+    roi_scores = regions.roi_scores(dilated_thresh_img) if regions is not None and regions.rois else {}
+    if on_diff is not None:
+        on_diff(thresh_img, contour_area_actual_diff_rate_percent, full_shape,
+                regions.bbox if regions is not None else None)
+    return (contour_area_actual_diff_rate_percent <= similarity_threshold_as_percentage,
+            contour_area_actual_diff_rate_percent,
+            roi_scores)
+
+def are_frames_similar(frame1: np.ndarray | None,
+                       frame2: np.ndarray | None,
+                       similarity_diff_rate_threshold_int: int) -> bool:
+    """比较两帧图像是否“足够相似”（变化很小）。
+
+    方法：
+    1) 必要时降采样到较小宽度以节省 CPU，并转灰度（reduce_frame_for_similarity）
+    2) 做绝对差阈值化、形态学膨胀，再提取轮廓，累计有效轮廓面积占比（compare_reduced_frames）
+    3) 若面积差异率 <= 阈值（单位：百分比×1/100），视为相似
+
+    返回 False 的情况：
+    - 任一帧不是有效的 numpy 图像
+    - 尺寸对齐失败或颜色转换失败
+    - 实际差异率超阈值
+    """
+
+    # 1. 检查输入帧的有效性
+    # cap.read() 返回的 ret, frame。如果 ret 是 False，frame可能是 None 或无效数据
+    if not isinstance(frame1, np.ndarray) or frame1.size == 0:
+        logger.debug("are_frames_similar: frame1 无效 (非 NumPy 数组、None 或空数组)。返回 False。")
+        return False
+    if not isinstance(frame2, np.ndarray) or frame2.size == 0:
+        logger.debug("are_frames_similar: frame2 无效 (非 NumPy 数组、None 或空数组)。返回 False。")
+        return False
+
+    # 2. 降采样 + 灰度
+    gray1 = reduce_frame_for_similarity(frame1)
+    gray2 = reduce_frame_for_similarity(frame2)
+    if gray1 is None or gray2 is None:
+        return False
+
+    # 3. 轮廓面积差异率判定
+    return compare_reduced_frames(gray1, gray2, similarity_diff_rate_threshold_int)[0]
+
+# --- Keyframe Cache ---
+def compute_frame_hash(reduced_gray: np.ndarray) -> int:
+    """64 位差值哈希（dHash）：缩小到 9x8，比较水平相邻像素。对整体亮度变化不敏感。
+
+    先按步长抽样（切片视图，无拷贝）再做区域平均，哈希耗时约为直接 INTER_AREA 的 1/20。
+    """
+    step = max(1, min(reduced_gray.shape[0] // 64, reduced_gray.shape[1] // 72))
+    tiny = cv2.resize(reduced_gray[::step, ::step], (9, 8), interpolation=cv2.INTER_AREA)
+    bits = np.packbits(tiny[:, 1:] > tiny[:, :-1])
+    return int.from_bytes(bits.tobytes(), "big")
+
+class KeyframeCache:
+    """近期显著帧的 LRU 缓存，抑制在两种状态间来回切换的场景（开关灯、开关门、夜视切换）反复保存。
+
+    - 每个关键帧保存缩小灰度帧与 64 位感知哈希
+    - 新帧先与所有关键帧比较汉明距离（整数位运算，几乎无开销），只与最近者做完整轮廓比较
+    - 命中的关键帧移到队尾（最近使用）；超过 KEYFRAME_CACHE_SIZE 淘汰最久未用，
+      超过 KEYFRAME_CACHE_EXPIRY_SECONDS 未命中的关键帧过期
+    """
+    def __init__(self) -> None:
+        self._entries: deque[list] = deque()  # [哈希, 缩小灰度帧, 最近命中的 monotonic 时间]，队尾最近使用
+        self.lookups: int = 0
+        self.full_compares: int = 0
+        self.hash_rejects: int = 0
+        self.hash_only_decisions: int = 0  # 降级模式下只按哈希判定的次数
+        self.older_hits: int = 0  # 命中非最新关键帧的次数（即被抑制的来回切换保存）
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expire(self, now_mono: float) -> None:
+        while self._entries and now_mono - self._entries[0][2] > KEYFRAME_CACHE_EXPIRY_SECONDS:
+            self._entries.popleft()  # 队首最久未用，过期只可能从队首开始
+
+    def match(self, reduced_gray: np.ndarray, frame_hash: int, threshold_int: int,
+              regions: 'RegionMask | None' = None, now: float | None = None,
+              pool: FramePool | None = None, on_diff=None,
+              hash_only_distance: int | None = None) -> tuple[bool, dict[str, float]]:
+        """判断是否与某个关键帧相似，返回 (是否相似, 与最近关键帧比较的各区域变化分数)。
+
+        now 默认为 time.monotonic()；离线重放归档时传入帧的拍摄时间戳。
+        on_diff 透传给 compare_reduced_frames（只在做完整比较时调用）。
+        hash_only_distance 不为 None 时只按哈希判定（降级模式）：最近的汉明距离不超过该值即相似，不做轮廓比较。
+        """
+        now_mono = time.monotonic() if now is None else now
+        self._expire(now_mono)
+        if not self._entries:
+            return False, {}
+        self.lookups += 1
+        best_idx, best_dist = -1, 65
+        for idx in range(len(self._entries) - 1, -1, -1):  # 从最新开始，距离相同时优先最近使用
+            dist = (self._entries[idx][0] ^ frame_hash).bit_count()
+            if dist < best_dist:
+                best_idx, best_dist = idx, dist
+        if best_dist > KEYFRAME_HASH_MAX_DISTANCE:
+            self.hash_rejects += 1
+            return False, {}
+        entry = self._entries[best_idx]
+        if hash_only_distance is not None:
+            self.hash_only_decisions += 1
+            similar, roi_scores = best_dist <= hash_only_distance, {}
+        else:
+            self.full_compares += 1
+            similar, _, roi_scores = compare_reduced_frames(entry[1], reduced_gray, threshold_int, regions, pool, on_diff)
+        if similar:
+            entry[2] = now_mono
+            if best_idx != len(self._entries) - 1:
+                self.older_hits += 1
+                del self._entries[best_idx]
+                self._entries.append(entry)
+        return similar, roi_scores
+
+    def add(self, reduced_gray: np.ndarray, frame_hash: int, now: float | None = None, copy: bool = False) -> None:
+        """加入关键帧。copy=True 表示 reduced_gray 位于复用缓冲区，需复制（优先复用被淘汰条目的数组）。"""
+        stored = reduced_gray
+        if copy:
+            recycled = self._entries[0][1] if len(self._entries) >= KEYFRAME_CACHE_SIZE else None
+            if recycled is not None and recycled.shape == reduced_gray.shape and recycled.dtype == reduced_gray.dtype:
+                np.copyto(recycled, reduced_gray)
+                stored = recycled
+            else:
+                stored = reduced_gray.copy()
+        self._entries.append([frame_hash, stored, time.monotonic() if now is None else now])
+        while len(self._entries) > KEYFRAME_CACHE_SIZE:
+            self._entries.popleft()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "lookups": self.lookups,
+            "full_compares": self.full_compares,
+            "hash_rejects": self.hash_rejects,
+            "hash_only_decisions": self.hash_only_decisions,
+            "older_hits": self.older_hits,
+        }
+
+class FrameQualityGate:
+    """帧质量门限：在缩小灰度帧上拒绝 USB 传输残帧、撕裂帧、对焦搜索中的失焦帧与过曝帧。
+
+    - band：底部连续的填充行（行内方差近 0、亮度一致且非纯黑/纯白）占比超过阈值
+    - tear：相邻行平均差在某一行突增，且上一张合格帧同一位置并无该边缘（静态水平边缘不误判）；
+      同一位置连续 TEAR_REBASELINE_FRAMES 帧都出现时视为场景中新出现的水平边缘（放下百叶窗、相机被碰），接受并作为新基线
+    - blur：清晰度（拉普拉斯方差 / 灰度方差，对整体亮度变化不敏感）低于近期合格帧基线的一定比例；
+      连续多帧失焦时视为场景确实变化，以当前帧重建基线
+    - saturated：过曝像素占比过高（自动曝光恢复中的整帧泛白）
+    行统计只取每 4 列一列；基线按缩小帧尺寸分别维护（两级采集/降级宽度切换时互不干扰）。
+    """
+    REASONS = ("band", "tear", "blur", "saturated")
+    COLUMN_STRIDE = 4
+    BAND_MIN_LEVEL = 24.0      # 低于该亮度的填充行视为压暗的夜景而非残帧
+    BAND_MAX_LEVEL = 240.0
+    BAND_FILL_TOLERANCE = 2.0
+    TEAR_RATIO = 4.0
+    TEAR_REBASELINE_FRAMES = 5
+    SATURATED_LEVEL = 250
+    BLUR_EMA_ALPHA = 0.1
+    BLUR_WARMUP_FRAMES = 5
+    BLUR_REBASELINE_FRAMES = 10
+
+    def __init__(self) -> None:
+        self._baselines: dict[tuple, dict] = {}  # 缩小帧尺寸 -> {"sharpness", "frames", "row_diff", "blur_streak"}
+        self.rejects = {reason: 0 for reason in self.REASONS}
+        self.consecutive_rejects = 0
+        self.frames_checked = 0
+        self.rebaselines = 0
+        self.tear_rebaselines = 0
+        self.last_sharpness: float | None = None
+        self.check_ms: float | None = None
+
+    def check(self, reduced_gray: np.ndarray) -> str | None:
+        """返回拒绝原因（REASONS 之一），合格时返回 None 并更新基线。"""
+        t0 = time.perf_counter()
+        reason, base, sharpness, row_diff = self._evaluate(reduced_gray)
+        self.frames_checked += 1
+        self.last_sharpness = sharpness
+        if reason is None:
+            self.consecutive_rejects = 0
+            base["tear_streak"] = 0
+            base["row_diff"] = row_diff
+            base["sharpness"] = _ema(base["sharpness"], sharpness, self.BLUR_EMA_ALPHA)
+            base["frames"] += 1
+        else:
+            self.rejects[reason] += 1
+            self.consecutive_rejects += 1
+        self.check_ms = _ema(self.check_ms, (time.perf_counter() - t0) * 1000.0)
+        return reason
+
+    def _evaluate(self, gray: np.ndarray):
+        base = self._baselines.setdefault(gray.shape, {"sharpness": None, "frames": 0, "row_diff": None,
+                                                       "blur_streak": 0, "tear_streak": 0, "tear_row": -1})
+        # 均值/方差/相邻行差都用 cv2.reduce/norm 计算（cv2.meanStdDev 对 16 位图像慢一个数量级）
+        rows = gray[:, ::self.COLUMN_STRIDE].astype(np.float32)
+        row_mean = cv2.reduce(rows, 1, cv2.REDUCE_AVG).ravel()
+        row_var = cv2.reduce(cv2.multiply(rows, rows), 1, cv2.REDUCE_AVG).ravel() - row_mean * row_mean
+        row_diff = cv2.reduce(cv2.absdiff(rows[1:], rows[:-1]), 1, cv2.REDUCE_AVG).ravel()
+        lap = cv2.Laplacian(gray, cv2.CV_16S)
+        n = float(gray.size)
+        lap_var = cv2.norm(lap, cv2.NORM_L2SQR) / n - (cv2.sumElems(lap)[0] / n) ** 2
+        gray_var = cv2.norm(gray, cv2.NORM_L2SQR) / n - (cv2.sumElems(gray)[0] / n) ** 2
+        sharpness = lap_var / max(1.0, gray_var)
+
+        if QUALITY_BAND_MIN_FRACTION > 0:
+            fill = row_mean[-1]
+            if self.BAND_MIN_LEVEL <= fill <= self.BAND_MAX_LEVEL:
+                flat = (row_var < QUALITY_BAND_ROW_VARIANCE) & (np.abs(row_mean - fill) < self.BAND_FILL_TOLERANCE)
+                uneven = np.flatnonzero(~flat)
+                run = len(flat) - (int(uneven[-1]) + 1 if uneven.size else 0)
+                if run >= QUALITY_BAND_MIN_FRACTION * len(flat):
+                    return "band", base, sharpness, row_diff
+        if QUALITY_SATURATED_MAX_FRACTION > 0:
+            saturated = np.count_nonzero(rows >= self.SATURATED_LEVEL) / float(rows.size)
+            if saturated > QUALITY_SATURATED_MAX_FRACTION:
+                return "saturated", base, sharpness, row_diff
+        prev_diff = base["row_diff"]
+        if QUALITY_TEAR_MIN_DIFF > 0 and prev_diff is not None and prev_diff.shape == row_diff.shape:
+            excess = row_diff - prev_diff
+            i = int(np.argmax(excess))
+            if excess[i] >= QUALITY_TEAR_MIN_DIFF and row_diff[i] >= self.TEAR_RATIO * max(1.0, float(prev_diff[i])):
+                # 撕裂位置随机；同一行（±1）反复出现说明是场景本身的新边缘
+                base["tear_streak"] = base["tear_streak"] + 1 if abs(i - base["tear_row"]) <= 1 else 1
+                base["tear_row"] = i
+                if base["tear_streak"] < self.TEAR_REBASELINE_FRAMES:
+                    return "tear", base, sharpness, row_diff
+                if base["tear_streak"] == self.TEAR_REBASELINE_FRAMES:
+                    logger.info(f"[QUALITY] 第 {i} 行连续 {base['tear_streak']} 帧出现新的水平边缘，视为场景变化，重建行差基线。")
+                    self.tear_rebaselines += 1
+        blurred = sharpness < QUALITY_BLUR_MIN_SHARPNESS
+        if not blurred and QUALITY_BLUR_RELATIVE > 0 and base["frames"] >= self.BLUR_WARMUP_FRAMES:
+            blurred = sharpness < QUALITY_BLUR_RELATIVE * base["sharpness"]
+        if blurred:
+            base["blur_streak"] += 1
+            if base["blur_streak"] < self.BLUR_REBASELINE_FRAMES:
+                return "blur", base, sharpness, row_diff
+            # 连续失焦：更可能是场景本身变化（熄灯/起雾），以当前帧为新基线
+            logger.info(f"[QUALITY] 连续 {base['blur_streak']} 帧清晰度 {sharpness:.3f} 低于基线 "
+                        f"{(base['sharpness'] or 0.0):.3f}，重建清晰度基线。")
+            base["sharpness"] = None
+            self.rebaselines += 1
+        base["blur_streak"] = 0
+        return None, base, sharpness, row_diff
+
+    def stats(self) -> dict:
+        return {
+            "enabled": ENABLE_QUALITY_GATE,
+            "frames_checked": self.frames_checked,
+            "rejected": sum(self.rejects.values()),
+            "rejects": dict(self.rejects),
+            "consecutive_rejects": self.consecutive_rejects,
+            "blur_rebaselines": self.rebaselines,
+            "tear_rebaselines": self.tear_rebaselines,
+            "last_sharpness": round(self.last_sharpness, 4) if self.last_sharpness is not None else None,
+            "sharpness_baseline": {f"{w}x{h}": round(b["sharpness"], 4) for (h, w), b in self._baselines.items()
+                                   if b["sharpness"] is not None},
+            "check_ms": round(self.check_ms, 3) if self.check_ms is not None else None,
+        }
+
+def check_frame_content(state: 'ServiceState', reduced_gray: np.ndarray) -> str | None:
+    """基于缩小灰度帧的黑帧/帧质量/静止帧检测（按 YAML 开关启用），几乎不增加开销。
+
+    - 黑帧：平均亮度低于 BLACK_FRAME_THRESHOLD，直接跳过编码与写盘（镜头遮挡/夜间全黑）
+    - 帧质量：残帧/撕裂/失焦/过曝帧跳过保存（见 FrameQualityGate），按原因计数；
+      连续拒绝每达到 QUALITY_REINIT_CONSECUTIVE 的整数倍时请求重建相机
+    - 静止帧：与上一帧（再缩小到 STATIC_FRAME_RESIZE_WIDTH）的平均绝对差低于阈值，
+      连续达到 STATIC_FRAME_CONSECUTIVE_THRESHOLD 后视为画面冻结，跳过保存
+    - 任一类连续计数每达到其阈值的整数倍时，请求重建相机（state.camera_reinit_requested）
+
+    返回 "BLACK_FRAME" / "QUALITY_REJECT" / "STATIC_FRAME" 表示应跳过本帧，None 表示继续处理。
+    """
+    if ENABLE_BLACK_FRAME_DETECTION:
+        mean_luma = cv2.mean(reduced_gray)[0]
+        if mean_luma < BLACK_FRAME_THRESHOLD:
+            state.consecutive_black_frames += 1
+            state.frames_black += 1
+            if state.consecutive_black_frames % max(1, BLACK_FRAME_CONSECUTIVE_THRESHOLD) == 0:
+                logger.warning(f"[CONTENT] 连续 {state.consecutive_black_frames} 帧为黑帧 (平均亮度 {mean_luma:.1f} "
+                               f"< {BLACK_FRAME_THRESHOLD})，请求重建摄像头。")
+                state.camera_reinit_requested = True
+            return "BLACK_FRAME"
+        state.consecutive_black_frames = 0
+
+    if ENABLE_QUALITY_GATE:
+        if state.quality_gate is None:
+            state.quality_gate = FrameQualityGate()
+        gate = state.quality_gate
+        reason = gate.check(reduced_gray)
+        if reason is not None:
+            logger.debug("[QUALITY] 帧质量不合格 (%s)，跳过保存", reason)
+            if QUALITY_REINIT_CONSECUTIVE > 0 and gate.consecutive_rejects % QUALITY_REINIT_CONSECUTIVE == 0:
+                logger.warning(f"[QUALITY] 连续 {gate.consecutive_rejects} 帧质量不合格 (最近: {reason})，请求重建摄像头。")
+                state.camera_reinit_requested = True
+            return "QUALITY_REJECT"
+
+    if ENABLE_STATIC_FRAME_DETECTION:
+        probe = reduced_gray
+        # 池化时探针需保留到下一帧，在两个常驻缓冲区之间交替写入
+        slot = f"static_probe{state.static_probe_slot}"
+        state.static_probe_slot ^= 1
+        if STATIC_FRAME_RESIZE_WIDTH and reduced_gray.shape[1] > STATIC_FRAME_RESIZE_WIDTH:
+            scale = STATIC_FRAME_RESIZE_WIDTH / float(reduced_gray.shape[1])
+            size = (STATIC_FRAME_RESIZE_WIDTH, max(1, int(reduced_gray.shape[0] * scale)))
+            probe = cv2.resize(reduced_gray, size, dst=pool_buffer(state.buffers, slot, (size[1], size[0])),
+                               interpolation=cv2.INTER_AREA)
+        elif state.buffers is not None:
+            probe = state.buffers.get(slot, reduced_gray.shape)
+            np.copyto(probe, reduced_gray)
+        prev_probe = state.static_probe
+        state.static_probe = probe
+        if prev_probe is not None and prev_probe.shape == probe.shape:
+            mean_abs_diff = cv2.norm(prev_probe, probe, cv2.NORM_L1) / float(probe.size)
+            if mean_abs_diff < STATIC_FRAME_DIFF_THRESHOLD:
+                state.consecutive_static_frames += 1
+                if state.consecutive_static_frames >= STATIC_FRAME_CONSECUTIVE_THRESHOLD:
+                    state.frames_static += 1
+                    if state.consecutive_static_frames % max(1, STATIC_FRAME_CONSECUTIVE_THRESHOLD) == 0:
+                        logger.warning(f"[CONTENT] 连续 {state.consecutive_static_frames} 帧画面完全静止 "
+                                       f"(平均差 {mean_abs_diff:.3f} < {STATIC_FRAME_DIFF_THRESHOLD})，疑似画面冻结，请求重建摄像头。")
+                        state.camera_reinit_requested = True
+                    return "STATIC_FRAME"
+                return None
+        state.consecutive_static_frames = 0
+    return None
+
+def judge_reduced_frame(state: 'ServiceState', reduced_frame: np.ndarray, frame_size: tuple[int, int],
+                        force_save: bool = False) -> tuple[str | None, int]:
+    """对缩小灰度帧做内容检测与关键帧比较，返回 (跳过原因, 帧哈希)。
+
+    跳过原因为 "BLACK_FRAME" / "QUALITY_REJECT" / "STATIC_FRAME" / "SIMILARITY"，None 表示应保存；
+    force_save=True 时只计算哈希。frame_size 为检测区域坐标所在的全分辨率尺寸。
+    启用活动热力图时，关键帧比较的差异图与判定结果同时计入当天的热力图与时间线。
+    """
+    activity = state.activity if not force_save else None
+    if activity is not None:
+        activity.begin_tick(datetime.now())
+    if not force_save:
+        content_verdict = check_frame_content(state, reduced_frame)
+        if content_verdict:
+            if activity is not None:
+                activity.end_tick(content_verdict)
+            return content_verdict, 0
+    # 判断是否接近，如果和近期任一关键帧类似则直接跳过
+    # 关键帧保存为缩小灰度帧（在叠加时间戳之前生成），不受叠加层影响，也无需整帧拷贝
+    regions = get_region_mask(state, frame_size, (reduced_frame.shape[1], reduced_frame.shape[0]))
+    frame_hash = compute_frame_hash(reduced_frame[regions.bbox] if regions is not None else reduced_frame)
+    if not force_save:
+        similar, state.last_roi_scores = state.keyframes.match(
+            reduced_frame,
+            frame_hash,
+            state.planner.similarity_threshold_int if state.planner else SIMILARITY_THRESHOLD_PERCENT_INT,
+            regions,
+            pool=state.buffers,
+            on_diff=activity.record_diff if activity is not None else None,
+            hash_only_distance=state.governor.hash_only_distance() if state.governor is not None else None
+        )
+        if activity is not None:
+            activity.end_tick("SIMILARITY" if similar else None)
+        if similar:
+            return "SIMILARITY", frame_hash
+    return None, frame_hash
+
+def process_and_save_frame(state: 'ServiceState', frame_data, effective_fourcc, base_save_dir, quality_val, ts_format,
+                           force_save: bool = False, judged: tuple[np.ndarray, int] | None = None):
+    """处理一帧图像并尝试保存。
 
     - 必要时做色彩空间转换/灰度转 BGR
-    - 与上一显著帧比较，相似则跳过保存
-    - 添加时间戳，按照年月/日分目录保存
+    - 可选的黑帧/帧质量/静止帧检测，命中则跳过编码与写盘
+    - 与上一显著帧比较，相似则跳过保存（force_save=True 时跳过检测与比较，如控制命令 snapshot）
+    - judged=(缩小灰度帧, 哈希) 表示两级采集的探测帧已判定为变化，不再重复检测
+    - 添加时间戳，按 OUTPUT_FORMAT 编码（quality_val 为 0-100 的格式质量），按照年月/日分目录保存
     - 失败计数进入 state，不抛异常
     """
 
@@ -769,7 +3115,7 @@ def process_and_save_frame(state: 'ServiceState', frame_data, effective_fourcc,
         logger.error("接收到空帧，无法处理。")
         return None
 
-    logger.debug(f"接收到帧。原始 - 尺寸: {frame_data.shape}, dtype: {frame_data.dtype}, FOURCC上下文: {effective_fourcc}")
+    logger.debug("接收到帧。原始 - 尺寸: %s, dtype: %s, FOURCC上下文: %s", frame_data.shape, frame_data.dtype, effective_fourcc)
     processed_frame = frame_data
 
     # try:
@@ -782,75 +3128,90 @@ def process_and_save_frame(state: 'ServiceState', frame_data, effective_fourcc,
 
     if effective_fourcc.upper() in ['YUYV', 'YUY2'] and \
        not (processed_frame.ndim == 3 and processed_frame.shape[2] == 3):
-        logger.info(f"帧的FOURCC上下文为 {effective_fourcc} 且非BGR，尝试YUV->BGR转换。帧Shape: {processed_frame.shape}")
+        logger.debug("帧的FOURCC上下文为 %s 且非BGR，尝试YUV->BGR转换。帧Shape: %s", effective_fourcc, processed_frame.shape)
         try:
             if processed_frame.shape[1] == DEFAULT_WIDTH * 2 and processed_frame.ndim == 2: 
-                 processed_frame = cv2.cvtColor(processed_frame, cv2.COLOR_YUV2BGR_YUYV) 
+                 bgr_shape = (processed_frame.shape[0], processed_frame.shape[1] // 2, 3)
+                 processed_frame = cv2.cvtColor(processed_frame, cv2.COLOR_YUV2BGR_YUYV,
+                                                dst=pool_buffer(state.buffers, "bgr", bgr_shape))
             elif processed_frame.ndim == 3 and processed_frame.shape[2] == 2: 
-                 processed_frame = cv2.cvtColor(processed_frame, cv2.COLOR_YUV2BGR_YUYV)
+                 bgr_shape = processed_frame.shape[:2] + (3,)
+                 processed_frame = cv2.cvtColor(processed_frame, cv2.COLOR_YUV2BGR_YUYV,
+                                                dst=pool_buffer(state.buffers, "bgr", bgr_shape))
             else:
-                logger.warning(f"未知的YUYV帧结构: {processed_frame.shape}，无法自动转换。")
+                logger.warning("未知的YUYV帧结构: %s，无法自动转换。", processed_frame.shape)
             
             if processed_frame.ndim == 3 and processed_frame.shape[2] == 3:
-                 logger.info(f"YUV 转换为 BGR 成功. 新图像尺寸: {processed_frame.shape}")
+                 logger.debug("YUV 转换为 BGR 成功. 新图像尺寸: %s", processed_frame.shape)
             else: 
-                 logger.error(f"YUV 转换为 BGR 后尺寸/通道数不正确: {processed_frame.shape}. 保留原始帧。")
+                 logger.error("YUV 转换为 BGR 后尺寸/通道数不正确: %s. 保留原始帧。", processed_frame.shape)
                  processed_frame = frame_data 
         except cv2.error as e:
             logger.error(f"YUV 转换为 BGR 失败: {e}. 将使用原始帧。", exc_info=True)
             processed_frame = frame_data
     elif processed_frame.ndim == 2: 
-        logger.info(f"图像是单通道灰度图 (shape: {processed_frame.shape})，转换为BGR。")
-        processed_frame = cv2.cvtColor(processed_frame, cv2.COLOR_GRAY2BGR)
+        logger.debug("图像是单通道灰度图 (shape: %s)，转换为BGR。", processed_frame.shape)
+        processed_frame = cv2.cvtColor(processed_frame, cv2.COLOR_GRAY2BGR,
+                                       dst=pool_buffer(state.buffers, "bgr", processed_frame.shape + (3,)))
     elif not (processed_frame.ndim == 3 and processed_frame.shape[2] == 3):
-        logger.warning(f"图像格式未知或非预期 (shape: {processed_frame.shape}). 尝试直接处理。")
+        logger.warning("图像格式未知或非预期 (shape: %s). 尝试直接处理。", processed_frame.shape)
 
-    # 判断是否接近，如果和上一次成功保存类似则直接跳过
-    # 使用上一显著帧的副本，避免被后续时间戳叠加修改
-    prev_sig_frame = None
-    try:
-        if isinstance(state.last_significant_frame, np.ndarray):
-            prev_sig_frame = state.last_significant_frame.copy()
-    except Exception:
-        prev_sig_frame = state.last_significant_frame
-
-    frames_are_indeed_similar = are_frames_similar(
-        prev_sig_frame,
-        processed_frame,
-        SIMILARITY_THRESHOLD_PERCENT_INT
-    )
-    if frames_are_indeed_similar:
-        #if logger: # logger.info(f"当前帧与上一显著帧相似 (差异 <= {SIMILARITY_THRESHOLD_PERCENT_INT/100.0:.2f}%)，不保存。")
-        perform_save_this_frame = False
-        return "SIMILARITY"
+    if judged is not None:
+        # 两级采集：探测帧已完成判定，关键帧沿用探测帧的缩小灰度帧与哈希
+        reduced_frame, frame_hash = judged
     else:
-        # if logger: logger.info(f"当前帧与上一显著帧不相似 (差异 > {SIMILARITY_THRESHOLD_PERCENT_INT/100.0:.2f}%)，将保存。")
-        perform_save_this_frame = True
-        # 保存未加时间戳前的帧，以避免时间戳影响相似度判断
-        try:
-            state.last_significant_frame = processed_frame.copy() if isinstance(processed_frame, np.ndarray) else processed_frame
-        except Exception:
-            state.last_significant_frame = processed_frame
+        # 缩小灰度帧：内容检测与相似度判断共用，每帧只计算一次
+        reduced_frame = reduce_frame_for_similarity(processed_frame, governed_similarity_width(state), pool=state.buffers)
+        if reduced_frame is not None:
+            verdict, frame_hash = judge_reduced_frame(
+                state, reduced_frame, (processed_frame.shape[1], processed_frame.shape[0]), force_save)
+            if verdict:
+                return verdict
+    if reduced_frame is not None:
+        state.keyframes.add(reduced_frame, frame_hash, copy=state.buffers is not None)
 
+    now = datetime.now()
+    luma_stats = None
+    if (LUMA_STATS_ENABLED or DEFLICKER_ENABLED) and reduced_frame is not None:
+        # 统计取自映射前的缩小灰度帧（原始曝光），gamma 一并记录，合并阶段可自行重建曲线
+        try:
+            if state.luma is None:
+                state.luma = LumaTracker()
+            luma_stats = state.luma.measure(reduced_frame)
+            state.luma.last_mean = luma_stats["mean"]
+            if DEFLICKER_ENABLED:
+                processed_frame = state.luma.deflicker(processed_frame, luma_stats["mean"], now.timestamp(), state.buffers)
+            if not LUMA_STATS_ENABLED:
+                luma_stats = None
+        except Exception as e:
+            logger.error(f"亮度统计/去闪烁失败: {e}", exc_info=True)
+            luma_stats = None
     try:
-        frame_with_timestamp = add_timestamp_to_frame(processed_frame, ts_format)
+        if state.governor is not None and state.governor.overlays_disabled():
+            frame_with_timestamp = processed_frame  # 降级：不绘制叠加层
+        else:
+            if state.overlays is None:
+                state.overlays = build_overlay_compositor(ts_format)
+            frame_with_timestamp = state.overlays.apply(processed_frame, now)
     except Exception as e:
-        logger.error(f"添加时间戳失败: {e}. 将保存不带时间戳的图像。", exc_info=True)
+        logger.error(f"添加叠加层失败: {e}. 将保存不带叠加层的图像。", exc_info=True)
         frame_with_timestamp = processed_frame
 
-    now = datetime.now()
-    save_subdir = os.path.join(base_save_dir, now.strftime("%Y-%m"), now.strftime("%d"))
+    save_root = base_save_dir
+    save_subdir = os.path.join(base_save_dir, capture_dir_relpath(now))
     
     try:
-        if not os.path.isdir(save_subdir):
+        # 启用存储路由时目录由路由器在选定目标上创建
+        if state.router is None and not os.path.isdir(save_subdir):
             os.makedirs(save_subdir, exist_ok=True)
     except OSError as e:
         logger.error(f"创建目录 {save_subdir} 失败: {e}。")
         # 尝试回退目录
         if IMAGE_SAVE_FALLBACK_DIR:
             try:
-                fallback_subdir = os.path.join(IMAGE_SAVE_FALLBACK_DIR, now.strftime("%Y-%m"), now.strftime("%d"))
+                fallback_subdir = os.path.join(IMAGE_SAVE_FALLBACK_DIR, capture_dir_relpath(now))
                 os.makedirs(fallback_subdir, exist_ok=True)
+                save_root = IMAGE_SAVE_FALLBACK_DIR
                 save_subdir = fallback_subdir
                 logger.warning(f"使用回退保存目录: {save_subdir}")
             except OSError as e_fb:
@@ -864,55 +3225,1236 @@ def process_and_save_frame(state: 'ServiceState', frame_data, effective_fourcc,
     #time_str = now.strftime("%H%M%S_%f") 
     #filename = f"{time_str}.jpg" 
     #filepath = os.path.join(save_subdir, filename)
-    file_timestamp = now.strftime("%Y%m%d_%H%M%S_%f")
-    filename = f"capture_{file_timestamp}.jpg"
-    filepath = os.path.join(save_subdir, filename) # 保存到年月子目录中
+    output_format = resolve_output_format(OUTPUT_FORMAT)
+    extension = OUTPUT_FORMAT_EXTENSIONS[output_format]
+    filename = capture_filename(now, extension)
+    filepath = os.path.join(save_subdir, filename) # 保存到日期（分片）子目录中
+
+    logger.debug("尝试将图像保存到: %s (格式: %s, 质量: %s)", filepath, output_format, quality_val)
+    try:
+        # 先在内存中编码：文件大小直接可得，过小的结果不会产生任何写盘与元数据操作
+        encode_success, encoded = cv2.imencode(extension, frame_with_timestamp, output_encode_params(output_format, quality_val))
+        if not encode_success:
+            logger.error(f"cv2.imencode 编码 {output_format} 图像失败 (返回False): {filepath}")
+            state.consecutive_imwrite_failures += 1
+            return None
+        actual_size = int(encoded.size)
+        if MIN_JPEG_SAVE_SIZE_BYTES and MIN_JPEG_SAVE_SIZE_BYTES > 0 and actual_size < MIN_JPEG_SAVE_SIZE_BYTES:
+            logger.error(
+                f"{output_format} 文件过小({actual_size}B < {MIN_JPEG_SAVE_SIZE_BYTES}B)，判定为失败。"
+            )
+            state.consecutive_imwrite_failures += 1
+            return None
+        relpath = os.path.relpath(filepath, save_root)
+        if state.spool is not None and state.spool.put(save_root, relpath, encoded):
+            logger.debug("图像已进入写回缓冲: %s", filepath)
+        else:
+            if state.router is not None:
+                filepath = state.router.write(relpath, encoded)
+            else:
+                write_capture_file(filepath, encoded)
+            logger.debug("图像保存成功: %s", filepath)
+            if state.changefeed is not None:
+                state.changefeed.added([(relpath, actual_size, changefeed_checksum(encoded), now.timestamp())])
+        state.consecutive_imwrite_failures = 0
+        if state.planner is not None:
+            state.planner.record_save(actual_size, now.timestamp())
+        if luma_stats is not None:
+            state.luma.record(os.path.join(base_save_dir, capture_day_relpath(now)),
+                              filename, now.timestamp(), luma_stats)
+        return filepath
+    except Exception as e:
+        logger.error(f"保存图像时发生异常: {e}", exc_info=True)
+        state.consecutive_imwrite_failures += 1
+        return None
+
+# --- Capture Path Layout ---
+# 抓拍路径: {base}/YYYY-MM/DD[/分片]/capture_%Y%m%d_%H%M%S_%f.ext
+# 日期层固定：清理、变更日志、冷归档、存储规划与活动图都以日期目录为单位。日期目录下可按 CAPTURE_SHARD_FORMAT
+# 再分片，避免白天高频抓拍时单个目录数万个文件拖慢 listdir/rsync/rmtree。读取一侧与分片布局无关，
+# 同一天内新旧布局的文件可以共存（切换分片格式或迁移中断后都能正确列出）。
+CAPTURE_FILE_PREFIX = "capture_"
+CAPTURE_SHARD_DIRECTIVES = ("%H", "%M")
+CAPTURE_SHARD_MAX_DEPTH = 3
+
+def validate_shard_format(fmt: str) -> str:
+    """校验并规范化分片格式：'/' 分隔的层级，每层至少含一个 %H/%M，其余字符限 [0-9A-Za-z_-]。非法时抛 ValueError。"""
+    fmt = (fmt or "").strip().strip("/")
+    if not fmt:
+        return ""
+    parts = fmt.split("/")
+    if len(parts) > CAPTURE_SHARD_MAX_DEPTH:
+        raise ValueError(f"分片层级过深 ({len(parts)} > {CAPTURE_SHARD_MAX_DEPTH})")
+    for part in parts:
+        rest = part
+        for directive in CAPTURE_SHARD_DIRECTIVES:
+            rest = rest.replace(directive, "")
+        if rest == part or "%" in rest or not all(c.isalnum() or c in "_-" for c in rest):
+            raise ValueError(f"非法的分片层级 '{part}'（只允许 {'/'.join(CAPTURE_SHARD_DIRECTIVES)} 与 [0-9A-Za-z_-]）")
+    return fmt
+
+def capture_day_relpath(ts: datetime) -> str:
+    """日期目录的相对路径（YYYY-MM/DD）。"""
+    return os.path.join(ts.strftime("%Y-%m"), ts.strftime("%d"))
+
+def capture_shard_relpath(ts: datetime, shard_format: str | None = None) -> str:
+    """日期目录内的分片相对路径（不分片时为空字符串）；shard_format 为 None 时使用当前配置。"""
+    fmt = CAPTURE_SHARD_FORMAT if shard_format is None else shard_format
+    return os.path.join(*ts.strftime(fmt).split("/")) if fmt else ""
+
+def capture_dir_relpath(ts: datetime, shard_format: str | None = None) -> str:
+    """抓拍文件所在目录的相对路径（日期目录 + 分片）。"""
+    shard = capture_shard_relpath(ts, shard_format)
+    return os.path.join(capture_day_relpath(ts), shard) if shard else capture_day_relpath(ts)
+
+def capture_filename(ts: datetime, extension: str) -> str:
+    return f"{CAPTURE_FILE_PREFIX}{ts.strftime('%Y%m%d_%H%M%S_%f')}{extension}"
+
+def parse_capture_datetime(filename: str) -> datetime | None:
+    """从 capture_%Y%m%d_%H%M%S_%f.* 文件名解析拍摄时间（本地时间）。"""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    if not stem.startswith(CAPTURE_FILE_PREFIX):
+        return None
+    try:
+        return datetime.strptime(stem[len(CAPTURE_FILE_PREFIX):], "%Y%m%d_%H%M%S_%f")
+    except ValueError:
+        return None
+
+def parse_capture_timestamp(filename: str) -> float | None:
+    """从 capture_%Y%m%d_%H%M%S_%f.* 文件名解析拍摄时间戳（epoch 秒）。"""
+    dt = parse_capture_datetime(filename)
+    return dt.timestamp() if dt is not None else None
+
+def _scan_day_captures(dir_path: str, depth: int, found: list[tuple[str, str]]) -> None:
+    try:
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                name = entry.name
+                if name.startswith(CAPTURE_FILE_PREFIX) and name.lower().endswith(CAPTURE_FILE_EXTENSIONS):
+                    found.append((name, entry.path))
+                elif depth > 0 and not name.startswith(".") and entry.is_dir(follow_symlinks=False):
+                    _scan_day_captures(entry.path, depth - 1, found)
+    except OSError:
+        pass
 
-    logger.debug(f"尝试将图像保存到: {filepath} (质量: {jpeg_quality_val})")
+def list_day_captures(day_dir: str) -> list[str]:
+    """按拍摄时间顺序列出日期目录（含各级分片子目录）下的抓拍文件。
+
+    按文件名排序（文件名本身即时间顺序），因此新旧分片布局混存时顺序依然正确。
+    """
+    found: list[tuple[str, str]] = []
+    _scan_day_captures(day_dir, CAPTURE_SHARD_MAX_DEPTH, found)
+    found.sort()
+    return [path for _, path in found]
+
+def find_capture_path(base_dir: str, filename: str) -> str | None:
+    """按文件名（即拍摄时间）定位抓拍文件：先试当前分片布局与不分片的位置，再扫描当天目录的任意布局。"""
+    dt = parse_capture_datetime(filename)
+    if dt is None:
+        return None
+    name = os.path.basename(filename)
+    for rel in dict.fromkeys((capture_dir_relpath(dt), capture_day_relpath(dt))):
+        path = os.path.join(base_dir, rel, name)
+        if os.path.isfile(path):
+            return path
+    return next((p for p in list_day_captures(os.path.join(base_dir, capture_day_relpath(dt)))
+                 if os.path.basename(p) == name), None)
+
+def remove_empty_shard_dirs(day_dir: str) -> int:
+    """自底向上删除日期目录下的空分片子目录（日期目录本身保留），返回删除的目录数。"""
+    removed = 0
+    for root, dirs, files in os.walk(day_dir, topdown=False):
+        if root == day_dir or files:
+            continue
+        try:
+            os.rmdir(root)
+            removed += 1
+        except OSError:
+            pass  # 非空（含隐藏文件或刚写入的新文件）
+    return removed
+
+# --- Capture File Output & Write-Behind Spool ---
+OUTPUT_FORMAT_EXTENSIONS = {"jpeg": ".jpg", "webp": ".webp", "avif": ".avif"}
+CAPTURE_FILE_EXTENSIONS = (".jpg", ".jpeg", ".webp", ".avif")  # 目录扫描识别的抓拍扩展名（与当前输出格式无关）
+_output_format_support: dict[str, bool] = {}
+_output_format_warned: set[str] = set()
+
+def output_quality(fmt: str | None = None) -> int:
+    """输出格式的基础质量（0-100）；JPEG 未单独配置时沿用 camera.jpeg_quality。"""
+    fmt = fmt or resolve_output_format(OUTPUT_FORMAT)
+    quality = OUTPUT_FORMAT_OPTIONS.get(fmt, {}).get("quality")
+    return int(quality if quality is not None else JPEG_SAVE_QUALITY)
+
+def output_encode_params(fmt: str, quality: int) -> list[int]:
+    """cv2.imencode 参数：质量由调用方给出（存储规划器可能已下调），其余取自 OUTPUT_FORMAT_OPTIONS。"""
+    opts = OUTPUT_FORMAT_OPTIONS.get(fmt, {})
+    if fmt == "webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, max(1, min(100, int(quality)))]
+    if fmt == "avif":
+        return [cv2.IMWRITE_AVIF_QUALITY, max(0, min(100, int(quality))),
+                cv2.IMWRITE_AVIF_SPEED, max(0, min(9, int(opts.get("speed", 8))))]
+    params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    if opts.get("optimize"):
+        params += [cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+    if opts.get("progressive"):
+        params += [cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+    return params
+
+def output_format_supported(fmt: str) -> bool:
+    """以一次小图编码探测当前 OpenCV 构建是否支持该格式（结果缓存）。"""
+    if fmt not in _output_format_support:
+        try:
+            if fmt == "avif" and not hasattr(cv2, "IMWRITE_AVIF_QUALITY"):
+                raise cv2.error("OpenCV 版本不提供 AVIF 编码参数")
+            ok, _ = cv2.imencode(OUTPUT_FORMAT_EXTENSIONS[fmt], np.zeros((16, 16, 3), np.uint8),
+                                 output_encode_params(fmt, 50))
+        except (cv2.error, KeyError):
+            ok = False
+        _output_format_support[fmt] = bool(ok)
+    return _output_format_support[fmt]
+
+def resolve_output_format(fmt: str) -> str:
+    """配置的输出格式不受支持时回退为 JPEG（只在首次探测时告警）。"""
+    if fmt == "jpeg" or output_format_supported(fmt):
+        return fmt
+    if fmt not in _output_format_warned:
+        _output_format_warned.add(fmt)
+        logger.warning(f"当前 OpenCV 构建不支持 {fmt} 编码，改为保存 JPEG。")
+    return "jpeg"
+
+def _current_umask() -> int:
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+CAPTURE_FILE_MODE = 0o644
+_NEEDS_FCHMOD = bool(_current_umask() & CAPTURE_FILE_MODE)  # umask 会屏蔽 644 中的位时才需要额外 fchmod
+
+def write_capture_file(path: str, data) -> None:
+    """写入一个抓拍文件（权限 644）。data 为支持缓冲区协议的对象（bytes / np.ndarray）。
+
+    以 os.open 的 mode 参数直接创建 644 文件，umask 允许时不再需要单独的 chmod 元数据操作。
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, CAPTURE_FILE_MODE)
     try:
-        save_success = cv2.imwrite(filepath, frame_with_timestamp, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality_val])
-        if save_success:
-            logger.debug(f"图像成功保存为JPEG: {filepath}")
-            state.consecutive_imwrite_failures = 0
+        if _NEEDS_FCHMOD:
+            os.fchmod(fd, CAPTURE_FILE_MODE)
+        view = memoryview(data).cast("B")
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+    finally:
+        os.close(fd)
+
+_libc_syncfs = None
+
+def sync_filesystem(path: str) -> None:
+    """同步 path 所在文件系统（Linux syncfs，一次调用覆盖整批文件与目录元数据）；不可用时退化为 os.sync()。"""
+    global _libc_syncfs
+    if _libc_syncfs is None:
+        try:
+            import ctypes
+            _libc_syncfs = ctypes.CDLL(None, use_errno=True).syncfs
+        except (OSError, AttributeError):
+            _libc_syncfs = False
+    if _libc_syncfs:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            fd = -1
+        if fd >= 0:
             try:
-                os.chmod(filepath, 0o644) 
-                logger.debug(f"文件权限设置为 644: {filepath}")
-            except OSError as e:
-                logger.warning(f"设置文件 {filepath} 权限失败: {e}")
-            # 可选：最小 JPEG 文件大小检查
-            if MIN_JPEG_SAVE_SIZE_BYTES and MIN_JPEG_SAVE_SIZE_BYTES > 0:
-                try:
-                    actual_size = os.path.getsize(filepath)
-                except OSError as e_sz:
-                    logger.error(f"读取文件大小失败: {e_sz}")
-                    actual_size = 0
-                if actual_size < MIN_JPEG_SAVE_SIZE_BYTES:
+                if _libc_syncfs(fd) == 0:
+                    return
+            finally:
+                os.close(fd)
+    os.sync()
+
+class WriteBehindSpool:
+    """写回缓冲：抓拍先落在 tmpfs（或内存），由后台线程按数量/字节/时间触发批量搬运到存储目录。
+
+    - 搬运严格按入队顺序进行，遇到写入错误即停止本批，剩余文件留待下次重试（不乱序）
+    - 每批写完后对目标文件系统做一次 syncfs，随后才从缓冲中删除，崩溃时最多重写而不丢失
+    - tmpfs 模式下启动时扫描缓冲目录恢复上次未搬运的文件；停机（SIGTERM）时排空
+    - 缓冲超过 SPOOL_MAX_BYTES 时 put() 返回 False，由调用方直接同步写盘
+    """
+    def __init__(self, spool_dir: str | None, router: 'StorageRouter | None' = None) -> None:
+        self.spool_dir = spool_dir
+        self.router = router  # 启用存储路由时由路由器选择落盘目标（忽略入队时的目标根目录）
+        self.changefeed: Changefeed | None = None  # 文件落盘（批次 syncfs 之后）才写入变更日志
+        self._pending: deque[list] = deque()  # [目标根目录, 相对路径, 字节数, 入队时间, 数据(仅内存模式)]
+        self._pending_bytes = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # 后台刷写与 flush_now 互斥，保证顺序
+        self._wake = threading.Event()
+        self._closing = False
+        self._created_dirs: set[str] = set()
+        self._thread: threading.Thread | None = None
+        self.files_flushed: int = 0
+        self.bytes_flushed: int = 0
+        self.batches: int = 0
+        self.errors: int = 0
+        self.overflows: int = 0
+        self.recovered: int = 0
+        self.flush_ms: deque[float] = deque(maxlen=128)
+        if self.spool_dir:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            self._recover()
+
+    def _recover(self) -> None:
+        """恢复上次运行遗留在缓冲目录中的文件（按相对路径排序即拍摄顺序）。"""
+        found = []
+        for root, _, names in os.walk(self.spool_dir):
+            for name in names:
+                full = os.path.join(root, name)
+                if name.endswith(".tmp"):
                     try:
-                        os.remove(filepath)
+                        os.remove(full)  # 写入缓冲时中断的半个文件
                     except OSError:
                         pass
-                    logger.error(
-                        f"JPEG 文件过小({actual_size}B < {MIN_JPEG_SAVE_SIZE_BYTES}B)，判定为失败。"
-                    )
-                    state.consecutive_imwrite_failures += 1
-                    return None
-            return filepath
+                    continue
+                try:
+                    found.append((os.path.relpath(full, self.spool_dir), os.path.getsize(full)))
+                except OSError:
+                    continue
+        for relpath, size in sorted(found):
+            self._pending.append([IMAGE_SAVE_BASE_DIR, relpath, size, time.time(), None])
+            self._pending_bytes += size
+        self.recovered = len(found)
+        if found:
+            logger.warning(f"[SPOOL] 从 {self.spool_dir} 恢复 {len(found)} 个未落盘文件 "
+                           f"({self._pending_bytes / 1024**2:.1f}MB)，将写入 {IMAGE_SAVE_BASE_DIR}")
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="SpoolFlusher", daemon=True)
+        self._thread.start()
+        if self._pending:
+            self._wake.set()
+
+    def put(self, base_dir: str, relpath: str, data) -> bool:
+        """放入一个已编码文件；缓冲已满或写 tmpfs 失败时返回 False（调用方应直接写盘）。"""
+        size = len(data)
+        if self._pending_bytes + size > SPOOL_MAX_BYTES:
+            self.overflows += 1
+            return False
+        payload = data
+        if self.spool_dir:
+            spool_path = os.path.join(self.spool_dir, relpath)
+            try:
+                spool_sub = os.path.dirname(spool_path)
+                if spool_sub not in self._created_dirs:
+                    os.makedirs(spool_sub, exist_ok=True)
+                    self._created_dirs.add(spool_sub)
+                write_capture_file(f"{spool_path}.tmp", data)
+                os.replace(f"{spool_path}.tmp", spool_path)
+            except OSError as e:
+                logger.warning(f"[SPOOL] 写入缓冲失败 {spool_path}: {e}，改为直接写盘。")
+                return False
+            payload = None
+        with self._lock:
+            self._pending.append([base_dir, relpath, size, time.time(), payload])
+            self._pending_bytes += size
+            trigger = len(self._pending) >= SPOOL_FLUSH_FILES or self._pending_bytes >= SPOOL_FLUSH_BYTES
+        if trigger:
+            self._wake.set()
+        return True
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(timeout=SPOOL_FLUSH_INTERVAL_SECONDS)
+            self._wake.clear()
+            self._flush_batch()
+            if self._closing:
+                break
+
+    def _flush_batch(self) -> int:
+        """搬运当前全部待写文件，返回成功数量。"""
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending)
+            if not batch:
+                return 0
+            t0 = time.perf_counter()
+            done = 0
+            roots = set()
+            flushed = []
+            for base_dir, relpath, size, queued_at, payload in batch:
+                dest = os.path.join(base_dir, relpath)
+                try:
+                    if payload is None:
+                        with open(os.path.join(self.spool_dir, relpath), "rb") as f:
+                            payload = f.read()
+                    if self.router is not None:
+                        dest = self.router.write(relpath, payload)
+                        base_dir = dest[:-len(relpath)].rstrip(os.sep) or os.sep
+                    else:
+                        dest_dir = os.path.dirname(dest)
+                        if dest_dir not in self._created_dirs:
+                            os.makedirs(dest_dir, exist_ok=True)
+                            self._created_dirs.add(dest_dir)
+                        write_capture_file(dest, payload)
+                except OSError as e:
+                    self.errors += 1
+                    self._created_dirs.discard(os.path.dirname(dest))
+                    logger.error(f"[SPOOL] 写入 {dest} 失败: {e}，本批剩余 {len(batch) - done} 个文件稍后重试。")
+                    break
+                roots.add(base_dir)
+                if self.changefeed is not None:
+                    flushed.append((relpath, size, changefeed_checksum(payload), queued_at))
+                done += 1
+            if done:
+                for root in roots:
+                    try:
+                        sync_filesystem(root)
+                    except OSError as e:
+                        logger.warning(f"[SPOOL] 同步文件系统 {root} 失败: {e}")
+                if flushed:
+                    self.changefeed.added(flushed)
+                with self._lock:
+                    for _ in range(done):
+                        item = self._pending.popleft()
+                        self._pending_bytes -= item[2]
+                        self.bytes_flushed += item[2]
+                if self.spool_dir:
+                    for _, relpath, _, _, _ in batch[:done]:
+                        try:
+                            os.remove(os.path.join(self.spool_dir, relpath))
+                        except OSError:
+                            pass
+                self.files_flushed += done
+                self.batches += 1
+                self.flush_ms.append((time.perf_counter() - t0) * 1000.0)
+                logger.debug("[SPOOL] 批量写入 %d 个文件，耗时 %.1fms", done, self.flush_ms[-1])
+            return done
+
+    def flush_now(self) -> int:
+        """立即同步刷写（控制命令 flush），返回写入的文件数。"""
+        return self._flush_batch()
+
+    def close(self, timeout: float = 60.0) -> None:
+        """停机排空：唤醒后台线程做最后一批刷写并等待其结束。"""
+        self._closing = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+        if self._pending:
+            self._flush_batch()
+        if self._pending:
+            logger.error(f"[SPOOL] 停机时仍有 {len(self._pending)} 个文件未能落盘"
+                         + (f"，保留在 {self.spool_dir} 待下次启动恢复。" if self.spool_dir else "（内存缓冲，已丢失）。"))
         else:
-            logger.error(f"cv2.imwrite 保存JPEG图像失败 (返回False): {filepath}")
-            state.consecutive_imwrite_failures += 1
+            logger.info(f"[SPOOL] 已排空，共写入 {self.files_flushed} 个文件。")
+
+    def stats(self) -> dict:
+        recent = sorted(self.flush_ms)
+        oldest = self._pending[0][3] if self._pending else None
+        return {
+            "depth_files": len(self._pending),
+            "depth_bytes": self._pending_bytes,
+            "oldest_pending_s": round(time.time() - oldest, 1) if oldest else 0.0,
+            "files_flushed": self.files_flushed,
+            "bytes_flushed": self.bytes_flushed,
+            "batches": self.batches,
+            "errors": self.errors,
+            "overflows": self.overflows,
+            "recovered": self.recovered,
+            "flush_ms_p50": round(recent[len(recent) // 2], 1) if recent else 0.0,
+            "flush_ms_p95": round(recent[min(len(recent) - 1, int(0.95 * len(recent)))], 1) if recent else 0.0,
+            "flush_ms_max": round(recent[-1], 1) if recent else 0.0,
+        }
+
+# --- Multi-Target Storage Routing ---
+class StorageTarget:
+    """一个存储目标及其写入健康度（滑动窗口平均延迟 + 错误，带恢复迟滞）。"""
+    def __init__(self, name: str, path: str, priority: int) -> None:
+        self.name = name
+        self.path = path
+        self.priority = priority
+        self.latencies: deque[float] = deque(maxlen=STORAGE_LATENCY_WINDOW)
+        self.degraded: bool = False
+        self.degraded_reason: str = ""
+        self.degraded_since: float | None = None
+        self.good_probes: int = 0
+        self.writes: int = 0
+        self.errors: int = 0
+        self.last_error: str = ""
+        self._created_dirs: set[str] = set()
+        self.lock = threading.Lock()  # 同一目标上的写入串行（采集线程与迁移线程），延迟样本才可比
+
+    def record(self, latency_ms: float, ok: bool, error: str = "") -> None:
+        if not ok:
+            self.errors += 1
+            self.last_error = error
+            self._degrade(f"写入错误: {error}")
+            return
+        self.writes += 1
+        self.latencies.append(latency_ms)
+        if not self.degraded and len(self.latencies) >= 3:
+            avg = sum(self.latencies) / len(self.latencies)
+            if avg > STORAGE_WRITE_LATENCY_SLO_MS:
+                self._degrade(f"平均写入延迟 {avg:.0f}ms > SLO {STORAGE_WRITE_LATENCY_SLO_MS:.0f}ms")
+
+    def record_probe(self, latency_ms: float, ok: bool, error: str = "") -> None:
+        """降级期间的探测结果：连续 STORAGE_RECOVERY_PROBES 次达标才恢复，避免在边缘状态来回切换。"""
+        if not ok:
+            self.errors += 1
+            self.last_error = error
+            self.good_probes = 0
+            return
+        if latency_ms > STORAGE_WRITE_LATENCY_SLO_MS:
+            self.good_probes = 0
+            return
+        self.good_probes += 1
+        if self.degraded and self.good_probes >= STORAGE_RECOVERY_PROBES:
+            logger.info(f"[STORAGE] 目标 {self.name} ({self.path}) 已恢复（连续 {self.good_probes} 次探测 "
+                        f"< {STORAGE_WRITE_LATENCY_SLO_MS:.0f}ms），降级持续 {time.time() - (self.degraded_since or time.time()):.0f}s。")
+            self.degraded = False
+            self.degraded_reason = ""
+            self.degraded_since = None
+
+    def _degrade(self, reason: str) -> None:
+        self.good_probes = 0
+        self.latencies.clear()  # 恢复后以新样本重新评估
+        if not self.degraded:
+            self.degraded = True
+            self.degraded_since = time.time()
+            logger.warning(f"[STORAGE] 目标 {self.name} ({self.path}) 降级: {reason}")
+        self.degraded_reason = reason
+
+    def write(self, relpath: str, data) -> str:
+        dest = os.path.join(self.path, relpath)
+        dest_dir = os.path.dirname(dest)
+        if dest_dir not in self._created_dirs:
+            os.makedirs(dest_dir, exist_ok=True)
+            self._created_dirs.add(dest_dir)
+        try:
+            write_capture_file(dest, data)
+        except OSError:
+            self._created_dirs.discard(dest_dir)  # 目录可能已被清理，下次重新创建
+            raise
+        return dest
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "priority": self.priority,
+            "healthy": not self.degraded,
+            "reason": self.degraded_reason,
+            "degraded_for_s": round(time.time() - self.degraded_since, 1) if self.degraded_since else 0.0,
+            "latency_ms_avg": round(sum(self.latencies) / len(self.latencies), 1) if self.latencies else 0.0,
+            "latency_ms_max": round(max(self.latencies), 1) if self.latencies else 0.0,
+            "writes": self.writes,
+            "errors": self.errors,
+            "last_error": self.last_error,
+        }
+
+class StorageRouter:
+    """按优先级在多个存储目标之间路由抓拍写入，并在主目标恢复后把备选目标中的文件迁回主目标。
+
+    - 写入选择优先级最高的健康目标；写入失败时依次尝试其余目标（全部失败才抛出 OSError）
+    - 降级目标不再承接写入，由后台线程定期做探测写入（写入 + fsync）以判断是否恢复
+    - 主目标健康时按时间顺序把备选目标中的文件分批迁回（每批一次 syncfs 后再删除源文件），
+      迁回写入同样计入主目标延迟，主目标再次降级时立即停止
+    - 待迁回清单只在启动后全量扫描一次（上次运行遗留的文件），之后由 write() 登记写入备选目标的文件
+    - 写入只持有目标自身的锁：迁移线程写主目标时，采集线程写备选目标不受阻塞
+    """
+    PROBE_FILE = ".storage_probe"
+    MIGRATE_MIN_AGE_SECONDS = 5.0  # 跳过刚写入的文件，避免与正在进行的写入竞争
+
+    def __init__(self, targets_cfg: list) -> None:
+        if not targets_cfg:
+            targets_cfg = [{"path": IMAGE_SAVE_BASE_DIR, "priority": 0, "name": "primary"}]
+            if IMAGE_SAVE_FALLBACK_DIR:
+                targets_cfg.append({"path": IMAGE_SAVE_FALLBACK_DIR, "priority": 1, "name": "fallback"})
+        self.targets = sorted(
+            (StorageTarget(t["name"], t["path"], t["priority"]) for t in targets_cfg),
+            key=lambda t: t.priority,
+        )
+        self.primary = self.targets[0]
+        self._lock = threading.Lock()  # 只保护待迁回清单
+        self._pending: dict[str, list[str]] = {t.name: [] for t in self.targets[1:]}
+        self._pending_scanned = False
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.migrated_files: int = 0
+        self.migrated_bytes: int = 0
+        self.migration_errors: int = 0
+        self.pending_migration: int = 0
+        self.last_target: str = self.primary.name
+
+    def select(self) -> StorageTarget:
+        for target in self.targets:
+            if not target.degraded:
+                return target
+        return self.primary  # 全部降级时仍写主目标（由写入错误决定下一步）
+
+    def write(self, relpath: str, data) -> str:
+        """写入一个文件，返回实际落盘路径；所有目标都失败时抛出最后一个 OSError。"""
+        first = self.select()
+        candidates = [first] + [t for t in self.targets if t is not first]
+        last_exc: OSError | None = None
+        for target in candidates:
+            t0 = time.perf_counter()
+            try:
+                with target.lock:
+                    dest = target.write(relpath, data)
+            except OSError as e:
+                target.record((time.perf_counter() - t0) * 1000.0, False, str(e))
+                last_exc = e
+                continue
+            target.record((time.perf_counter() - t0) * 1000.0, True)
+            if target is not self.primary:
+                with self._lock:
+                    self._pending[target.name].append(relpath)
+            if target.name != self.last_target:
+                logger.warning(f"[STORAGE] 写入目标切换: {self.last_target} -> {target.name} ({target.path})")
+                self.last_target = target.name
+            return dest
+        raise last_exc if last_exc else OSError("没有可用的存储目标")
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="StorageMigrator", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+    def _run(self) -> None:
+        while not self._stop.wait(STORAGE_PROBE_INTERVAL_SECONDS):
+            try:
+                for target in self.targets:
+                    if target.degraded:
+                        self._probe(target)
+                if not self.primary.degraded:
+                    self._migrate_back()
+            except Exception as e:
+                logger.error(f"[STORAGE] 探测/迁回时发生异常: {e}", exc_info=True)
+
+    def _probe(self, target: StorageTarget) -> None:
+        path = os.path.join(target.path, self.PROBE_FILE)
+        t0 = time.perf_counter()
+        try:
+            os.makedirs(target.path, exist_ok=True)
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.write(fd, os.urandom(4096))
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            os.remove(path)
+        except OSError as e:
+            target.record_probe((time.perf_counter() - t0) * 1000.0, False, str(e))
+            return
+        target.record_probe((time.perf_counter() - t0) * 1000.0, True)
+
+    def _pending_files(self, target: StorageTarget) -> list[str]:
+        """列出备选目标中等待迁回的文件（相对路径，按时间顺序）。"""
+        relpaths = []
+        for day_dir in list_day_dirs(target.path):
+            day_files = []
+            for root, _, names in os.walk(day_dir):  # 含分片子目录
+                day_files.extend(os.path.relpath(os.path.join(root, n), target.path) for n in names)
+            relpaths.extend(sorted(day_files, key=os.path.basename))
+        return relpaths
+
+    def _migrate_back(self) -> None:
+        if not self._pending_scanned:
+            for target in self.targets[1:]:
+                found = self._pending_files(target)
+                with self._lock:
+                    known = set(found)
+                    self._pending[target.name] = found + [r for r in self._pending[target.name] if r not in known]
+            self._pending_scanned = True
+        with self._lock:
+            self.pending_migration = sum(len(v) for v in self._pending.values())
+        for target in self.targets[1:]:
+            with self._lock:
+                relpaths = list(self._pending[target.name])
+            done: set[str] = set()
+            for start in range(0, len(relpaths), STORAGE_MIGRATE_BATCH_FILES):
+                if self._stop.is_set() or self.primary.degraded:
+                    break
+                handled = self._migrate_batch(target, relpaths[start:start + STORAGE_MIGRATE_BATCH_FILES])
+                done.update(handled)
+                if not handled:
+                    break  # 余下的文件太新或主目标写入失败，下一轮再试
+            if done:
+                with self._lock:
+                    self._pending[target.name] = [r for r in self._pending[target.name] if r not in done]
+                self._prune_empty_dirs(target)
+        with self._lock:
+            self.pending_migration = sum(len(v) for v in self._pending.values())
+
+    def _migrate_batch(self, source: StorageTarget, relpaths: list[str]) -> list[str]:
+        """迁回一批文件，返回已从清单移除的相对路径（已迁回，或源文件已不存在）。"""
+        copied = []
+        gone = []
+        cutoff = time.time() - self.MIGRATE_MIN_AGE_SECONDS
+        for relpath in relpaths:
+            src = os.path.join(source.path, relpath)
+            try:
+                st = os.stat(src)
+                if st.st_mtime > cutoff:
+                    continue
+                dest = os.path.join(self.primary.path, relpath)
+                if os.path.exists(dest) and os.path.getsize(dest) == st.st_size:
+                    copied.append(relpath)  # 上次迁移已写入（删除源文件前中断）
+                    continue
+                with open(src, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                gone.append(relpath)  # 已被磁盘清理/冷归档删除
+                continue
+            except OSError as e:
+                logger.debug(f"[STORAGE] 跳过待迁回文件 {src}: {e}")
+                continue
+            t0 = time.perf_counter()
+            try:
+                with self.primary.lock:
+                    self.primary.write(relpath, data)
+            except OSError as e:
+                self.primary.record((time.perf_counter() - t0) * 1000.0, False, str(e))
+                self.migration_errors += 1
+                break
+            self.primary.record((time.perf_counter() - t0) * 1000.0, True)
+            copied.append(relpath)
+            self.migrated_bytes += len(data)
+            if self.primary.degraded:
+                break
+        if not copied:
+            return gone
+        try:
+            sync_filesystem(self.primary.path)  # 先确保主目标落盘，再删除源文件
+        except OSError as e:
+            logger.error(f"[STORAGE] 同步主目标失败，本批源文件保留: {e}")
+            self.migration_errors += 1
+            return gone
+        for relpath in copied:
+            try:
+                os.remove(os.path.join(source.path, relpath))
+            except OSError:
+                pass
+        self.migrated_files += len(copied)
+        logger.info(f"[STORAGE] 已从 {source.name} 迁回 {len(copied)} 个文件到 {self.primary.name}。")
+        return gone + copied
+
+    def _prune_empty_dirs(self, target: StorageTarget) -> None:
+        for day_dir in reversed(list_day_dirs(target.path)):
+            remove_empty_shard_dirs(day_dir)
+            for d in (day_dir, os.path.dirname(day_dir)):
+                try:
+                    os.rmdir(d)
+                except OSError:
+                    break
+
+    def stats(self) -> dict:
+        return {
+            "active": self.select().name,
+            "pending_migration": self.pending_migration,
+            "migrated_files": self.migrated_files,
+            "migrated_bytes": self.migrated_bytes,
+            "migration_errors": self.migration_errors,
+            "targets": {t.name: t.stats() for t in self.targets},
+        }
+
+# --- Changefeed Journal ---
+def get_changefeed_path() -> str:
+    """变更日志路径（未配置时位于日志目录，与 'changes' 命令的默认值一致）。"""
+    return CHANGEFEED_FILE or os.path.join(LOG_DIR, "changefeed.jsonl")
+
+def changefeed_checksum(data) -> str | None:
+    """按 CHANGEFEED_CHECKSUM 计算已编码文件内容的校验值（数据已在内存中，无需回读文件）。"""
+    if CHANGEFEED_CHECKSUM == "none":
+        return None
+    if CHANGEFEED_CHECKSUM == "sha256":
+        return "sha256:" + hashlib.sha256(data).hexdigest()
+    return f"crc32:{zlib.crc32(data) & 0xFFFFFFFF:08x}"
+
+class Changefeed:
+    """追加式变更日志（JSON Lines）：下游同步/合成只需处理游标之后的新条目，而不必扫描整天目录。
+
+    记录字段：seq（单调递增）、event（added/deleted/day_closed）、path（相对归档根目录）、
+    size、checksum、ts。day_closed 的 path 为以 "/" 结尾的日期目录；deleted 的 path 为日期目录
+    （磁盘清理整天删除）或单个文件（冷归档后删除的原始图片）。
+    每次追加后 flush，日切与停机时 fsync；日切时超过 CHANGEFEED_ROTATE_BYTES 则轮转为 .1。
+    """
+    def __init__(self, path: str, base_dir: str) -> None:
+        self.path = path
+        self.base_dir = base_dir
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.seq = max(self._last_seq(path), self._last_seq(f"{path}.1"))
+        self._file = open(path, "a", encoding="utf-8")
+        self.day: str | None = None
+        self.records_written: int = 0
+        self._recover_open_day()
+
+    @staticmethod
+    def _last_seq(path: str) -> int:
+        try:
+            with open(path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                f.seek(max(0, size - 65536))
+                lines = f.read().splitlines()
+        except OSError:
+            return 0
+        for line in reversed(lines):
+            try:
+                return int(json.loads(line)["seq"])
+            except (ValueError, KeyError, TypeError):
+                continue  # 崩溃时写了一半的行
+        return 0
+
+    def _recover_open_day(self) -> None:
+        """上次运行停在更早的日期且未写日切标记时补写（例如跨午夜停机）。"""
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - 65536))
+                lines = f.read().splitlines()
+        except OSError:
+            return
+        for line in reversed(lines):
+            try:
+                last = json.loads(line)
+            except ValueError:
+                continue
+            last_day = last["path"][:11] if last.get("event") == "added" else None
+            if last_day and last_day != datetime.now().strftime("%Y-%m/%d/"):
+                self.day = last_day
+                self.roll_day(datetime.now())
+            break
+
+    def _append(self, records: list[dict]) -> None:
+        with self._lock:
+            for record in records:
+                self.seq += 1
+                self._file.write(json.dumps({"seq": self.seq, **record}, ensure_ascii=False) + "\n")
+            self._file.flush()
+            self.records_written += len(records)
+
+    def added(self, items: list[tuple]) -> None:
+        """记录已落盘的文件：items 为 (相对路径, 字节数, 校验值, 时间戳) 列表，按落盘顺序。"""
+        if items:
+            self.roll_day(datetime.fromtimestamp(items[0][3]))
+        self._append([
+            {"event": "added", "path": relpath, "size": size, "checksum": checksum, "ts": round(ts, 3)}
+            for relpath, size, checksum, ts in items
+        ])
+
+    def deleted(self, day_dir: str, files: int) -> None:
+        """记录整天目录被清理（day_dir 为绝对路径）。"""
+        relpath = os.path.relpath(day_dir, self.base_dir).replace(os.sep, "/").rstrip("/") + "/"
+        self._append([{"event": "deleted", "path": relpath, "files": files, "ts": round(time.time(), 3)}])
+
+    def removed(self, relpaths: list[str]) -> None:
+        """记录单个文件被删除（relpaths 为相对归档根目录的路径）。"""
+        ts = round(time.time(), 3)
+        self._append([{"event": "deleted", "path": relpath, "ts": ts} for relpath in relpaths])
+
+    def moved(self, items: list[tuple]) -> None:
+        """记录文件在归档内移动（如重新分片）：items 为 (原相对路径, 新相对路径, 字节数) 列表。
+
+        每个文件先写新路径的 added，再写原路径的 deleted（读取端任何时刻都不会丢失文件）。
+        移动的是历史日期的文件，不触发日切。
+        """
+        ts = round(time.time(), 3)
+        records = []
+        for old, new, size in items:
+            records.append({"event": "added", "path": new, "size": size, "checksum": None, "ts": ts})
+            records.append({"event": "deleted", "path": old, "ts": ts})
+        self._append(records)
+
+    def roll_day(self, now: datetime) -> None:
+        """日期变化时为前一天写入日切标记（文件数/字节数取自磁盘），并按需轮转日志。"""
+        day = now.strftime("%Y-%m/%d/")
+        with self._lock:  # 写回缓冲刷写线程与主循环都会调用：比较与更新须原子，日切标记只写一次
+            if self.day is not None and day <= self.day:
+                return  # 只向前推进（写回缓冲中昨天排队的文件可能在日切后才落盘）
+            previous, self.day = self.day, day
+        if previous is None:
+            return
+        day_path = os.path.join(self.base_dir, previous)
+        files = len(list_day_captures(day_path))
+        self._append([{"event": "day_closed", "path": previous, "files": files,
+                       "bytes": _dir_size_bytes(day_path), "ts": round(time.time(), 3)}])
+        with self._lock:
+            try:
+                os.fsync(self._file.fileno())
+                if self._file.tell() > CHANGEFEED_ROTATE_BYTES:
+                    self._file.close()
+                    os.replace(self.path, f"{self.path}.1")
+                    self._file = open(self.path, "a", encoding="utf-8")
+                    logger.info(f"[FEED] 变更日志已轮转: {self.path}.1 (最后序号 {self.seq})")
+            except OSError as e:
+                logger.error(f"[FEED] 同步/轮转变更日志失败: {e}")
+        logger.info(f"[FEED] 日切标记: {previous} ({files} 个文件)")
+
+    def close(self) -> None:
+        with self._lock:
+            try:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError:
+                pass
+            self._file.close()
+
+    def stats(self) -> dict:
+        return {"path": self.path, "seq": self.seq, "records_written": self.records_written}
+
+def open_offline_changefeed(base_dir: str, path: str | None = None) -> 'Changefeed | None':
+    """离线工具改动归档（删除/移动文件）时打开服务的变更日志，使下游游标能看到这些改动。
+
+    变更日志不存在（服务未启用）时返回 None。服务正在运行时也返回 None 并记录 WARNING：
+    两个进程各自维护序号，同时追加会产生重复序号。
+    """
+    path = path or get_changefeed_path()
+    if not os.path.exists(path):
+        return None
+    _, pid = _read_pid(PID_FILE_PATH)
+    running = False
+    if pid is not None and pid != os.getpid():
+        try:
+            os.kill(pid, 0)
+            running = True
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            running = True
+    if running:
+        logger.warning(f"[FEED] 服务正在运行 (PID {pid})，本次改动不写入变更日志 {path}；"
+                       f"下游游标需要对受影响的日期做一次全量同步。")
+        return None
+    try:
+        return Changefeed(path, base_dir)
+    except OSError as e:
+        logger.warning(f"[FEED] 打开变更日志 {path} 失败: {e}；下游游标需要对受影响的日期做一次全量同步。")
+        return None
+
+# --- Cold-Tier Video Archive ---
+COLD_SEGMENT_FILE = "segment.mp4"
+COLD_INDEX_FILE = "segment_index.json"
+
+class _FfmpegPipeWriter:
+    """以 rawvideo 管道向 ffmpeg 写入 BGR 帧，接口与 cv2.VideoWriter 的 write/release 一致。"""
+    def __init__(self, path: str, size: tuple[int, int], fps: float) -> None:
+        cmd = [COLD_ARCHIVE_FFMPEG_PATH, "-hide_banner", "-loglevel", "error", "-y",
+               "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{size[0]}x{size[1]}", "-r", f"{fps:g}", "-i", "-",
+               "-c:v", "libx264", "-preset", "veryfast", "-crf", str(COLD_ARCHIVE_CRF),
+               "-g", str(COLD_ARCHIVE_GOP), "-keyint_min", str(COLD_ARCHIVE_GOP), "-sc_threshold", "0",
+               "-pix_fmt", "yuv420p", "-movflags", "+faststart", "-f", "mp4", path]
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def write(self, frame: np.ndarray) -> None:
+        self._proc.stdin.write(memoryview(np.ascontiguousarray(frame)).cast("B"))
+
+    def release(self) -> None:
+        _, err = self._proc.communicate()
+        if self._proc.returncode != 0:
+            raise OSError(f"ffmpeg 退出码 {self._proc.returncode}: {err.decode(errors='replace').strip()[-300:]}")
+
+def _cold_encoder_name() -> str:
+    if COLD_ARCHIVE_ENCODER == "auto":
+        return "ffmpeg" if shutil.which(COLD_ARCHIVE_FFMPEG_PATH) else "opencv"
+    return COLD_ARCHIVE_ENCODER
+
+def _open_segment_writer(path: str, size: tuple[int, int]):
+    if _cold_encoder_name() == "ffmpeg":
+        return _FfmpegPipeWriter(path, size, COLD_ARCHIVE_FPS)
+    params = []  # FFmpeg 后端不支持 VIDEOWRITER_PROP_QUALITY，只能设置关键帧间隔
+    if hasattr(cv2, "VIDEOWRITER_PROP_KEY_INTERVAL"):
+        params += [cv2.VIDEOWRITER_PROP_KEY_INTERVAL, COLD_ARCHIVE_GOP]
+    writer = cv2.VideoWriter(path, cv2.CAP_FFMPEG, cv2.VideoWriter_fourcc(*"mp4v"), COLD_ARCHIVE_FPS, size, params)
+    if not writer.isOpened():
+        raise OSError(f"OpenCV 无法创建视频段 {path}")
+    return writer
+
+def load_segment_index(day_dir: str) -> dict | None:
+    """读取日期目录的视频段索引：{segment, fps, gop, size, ts: [拍摄时间], files: [原始文件名]}。"""
+    try:
+        with open(os.path.join(day_dir, COLD_INDEX_FILE), "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(index, dict) or len(index.get("ts", [])) != len(index.get("files", [])):
+        return None
+    return index
+
+def read_segment_frame(day_dir: str, index: dict, frame_idx: int) -> np.ndarray | None:
+    """随机读取视频段中的一帧：定位到不晚于目标的最近关键帧，再顺序解码到目标帧（最多 GOP - 1 帧）。"""
+    cap = cv2.VideoCapture(os.path.join(day_dir, index.get("segment", COLD_SEGMENT_FILE)))
+    try:
+        if not cap.isOpened():
             return None
-    except Exception as e:
-        logger.error(f"cv2.imwrite 保存图像时发生异常: {e}", exc_info=True)
-        state.consecutive_imwrite_failures += 1
+        gop = max(1, int(index.get("gop", COLD_ARCHIVE_GOP)))
+        keyframe = (frame_idx // gop) * gop
+        if keyframe:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+        for _ in range(frame_idx - keyframe):
+            if not cap.grab():
+                return None
+        ok, frame = cap.read()
+        return frame if ok else None
+    finally:
+        cap.release()
+
+def extract_archived_frame(base_dir: str, ts: float) -> tuple[np.ndarray, float, str] | None:
+    """按时间戳取回一帧：返回 (BGR 帧, 实际拍摄时间, 原始文件名)，取最接近 ts 的帧。
+
+    日期目录仍有原始 JPEG 时直接读取文件；已归档的帧从视频段随机读取。
+    """
+    day_dir = os.path.join(base_dir, capture_day_relpath(datetime.fromtimestamp(ts)))
+    candidates: list[tuple[float, str, str | int]] = []
+    for path in list_day_captures(day_dir):
+        capture_ts = parse_capture_timestamp(path)
+        if capture_ts is not None:
+            candidates.append((capture_ts, os.path.basename(path), path))
+    index = load_segment_index(day_dir)
+    if index is not None:
+        candidates += [(t, name, i) for i, (t, name) in enumerate(zip(index["ts"], index["files"]))]
+    if not candidates:
         return None
+    capture_ts, name, source = min(candidates, key=lambda c: abs(c[0] - ts))
+    if isinstance(source, str):
+        frame = cv2.imread(source, cv2.IMREAD_COLOR)
+    else:
+        frame = read_segment_frame(day_dir, index, source)
+    return (frame, capture_ts, name) if frame is not None else None
+
+def _psnr(a: np.ndarray, b: np.ndarray) -> float:
+    mse = cv2.norm(a, b, cv2.NORM_L2SQR) / float(a.size)
+    return 99.0 if mse <= 1e-10 else 10.0 * math.log10(255.0 ** 2 / mse)
+
+def verify_segment(segment_path: str, paths: list[str | None], index: dict) -> str | None:
+    """校验视频段：帧数与原始文件一致；每 COLD_ARCHIVE_VERIFY_STRIDE 帧与原图比较 PSNR（缩小灰度）；
+    再抽一帧按关键帧随机读取，须与顺序解码结果完全一致。返回失败原因，通过时返回 None。
+
+    paths 中的 None 表示原始文件已删除（上次删除中断），该帧只计数；此时剩余的原始文件逐帧比较，
+    因为它们正是接下来要删除的文件。
+    """
+    resumed = any(p is None for p in paths)
+    cap = cv2.VideoCapture(segment_path)
+    if not cap.isOpened():
+        return "无法打开视频段"
+    size = tuple(index["size"])
+    probe_idx = min(len(paths) - 1, COLD_ARCHIVE_GOP + COLD_ARCHIVE_GOP // 2)  # 落在第二个 GOP 中间，覆盖定位 + 解码
+    probe_frame = None
+    count = 0
+    try:
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if count < len(paths) and paths[count] is not None and (resumed or count % COLD_ARCHIVE_VERIFY_STRIDE == 0):
+                original = cv2.imread(paths[count], cv2.IMREAD_GRAYSCALE)
+                if original is None:
+                    return f"无法读取原始文件 {paths[count]}"
+                if (original.shape[1], original.shape[0]) != size:
+                    original = cv2.resize(original, size, interpolation=cv2.INTER_AREA)
+                psnr = _psnr(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), original)
+                if psnr < COLD_ARCHIVE_MIN_PSNR:
+                    return f"第 {count} 帧 PSNR {psnr:.1f}dB < {COLD_ARCHIVE_MIN_PSNR}dB"
+            if count == probe_idx:
+                probe_frame = frame.copy()
+            count += 1
+    finally:
+        cap.release()
+    if count != len(paths):
+        return f"帧数不一致: 视频段 {count}, 原始 {len(paths)}"
+    seek_dir = os.path.dirname(segment_path)
+    sought = read_segment_frame(seek_dir, dict(index, segment=os.path.basename(segment_path)), probe_idx)
+    if sought is None or probe_frame is None or not np.array_equal(sought, probe_frame):
+        return f"随机读取第 {probe_idx} 帧与顺序解码不一致"
+    return None
+
+def archive_day_to_segment(day_dir: str, base_dir: str, changefeed: 'Changefeed | None' = None,
+                           keep_originals: bool = False, stop_event: Event | None = None) -> dict:
+    """把一个日期目录的抓拍编码为视频段 + 索引，校验通过后（syncfs 之后）删除原始 JPEG。
+
+    已有索引且剩余 JPEG 全部在索引中（上次删除中断）时只重新校验并删除；
+    已有索引但出现索引外的新文件（如迁回的文件）时保持原样，不再合并。
+    """
+    rel_day = os.path.relpath(day_dir, base_dir)
+    result = {"day": rel_day, "frames": 0, "original_bytes": 0, "segment_bytes": 0,
+              "removed": 0, "status": "skipped", "reason": ""}
+    paths = list_day_captures(day_dir)
+    if not paths:
+        return result
+    segment_path = os.path.join(day_dir, COLD_SEGMENT_FILE)
+    index = load_segment_index(day_dir)
+    t0 = time.perf_counter()
+    if index is not None:
+        indexed = set(index["files"])
+        if not all(os.path.basename(p) in indexed for p in paths):
+            result["reason"] = "已有视频段，存在索引外的文件"
+            return result
+        by_name = {os.path.basename(p): p for p in paths}
+        verify_paths = [by_name.get(name) for name in index["files"]]
+        # 删除任何原始文件前都重新校验已有视频段（可能在中断后损坏或被截断）；
+        # 部分原始文件已删除时，已删除的帧只核对帧数，剩余原始文件逐帧比较
+        reason = verify_segment(segment_path, verify_paths, index)
+        if reason:
+            result.update(status="failed", reason=f"已有视频段校验失败，原始文件保留: {reason}")
+            return result
+        if any(p is None for p in verify_paths):
+            result["reason"] = "上次删除中断，已重新校验视频段并删除剩余原始文件"
+    else:
+        timestamps = [parse_capture_timestamp(p) for p in paths]
+        first = None
+        for p in paths:
+            first = cv2.imread(p, cv2.IMREAD_COLOR)
+            if first is not None:
+                break
+        if first is None:
+            result.update(status="failed", reason="没有可解码的原始文件")
+            return result
+        size = (first.shape[1] & ~1, first.shape[0] & ~1)  # yuv420p 需要偶数尺寸
+        tmp_path = os.path.join(day_dir, f".{COLD_SEGMENT_FILE}.tmp.mp4")
+        kept_paths: list[str] = []
+        kept_ts: list[float] = []
+        try:
+            writer = _open_segment_writer(tmp_path, size)
+            try:
+                for path, capture_ts in zip(paths, timestamps):
+                    if stop_event is not None and stop_event.is_set():
+                        raise InterruptedError("停机中断归档")
+                    frame = cv2.imread(path, cv2.IMREAD_COLOR)
+                    if frame is None:
+                        logger.warning(f"[COLD] 无法解码 {path}，不纳入视频段（原始文件保留）。")
+                        continue
+                    if (frame.shape[1], frame.shape[0]) != size:
+                        frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+                    writer.write(frame)
+                    kept_paths.append(path)
+                    kept_ts.append(capture_ts if capture_ts is not None else os.path.getmtime(path))
+            finally:
+                writer.release()
+            index = {"version": 1, "segment": COLD_SEGMENT_FILE, "encoder": _cold_encoder_name(),
+                     "fps": COLD_ARCHIVE_FPS, "gop": COLD_ARCHIVE_GOP, "size": list(size),
+                     "ts": [round(t, 6) for t in kept_ts], "files": [os.path.basename(p) for p in kept_paths]}
+            reason = verify_segment(tmp_path, kept_paths, index)
+            if reason:
+                result.update(status="failed", reason=reason)
+                return result
+            os.replace(tmp_path, segment_path)
+            with open(os.path.join(day_dir, COLD_INDEX_FILE + ".tmp"), "w", encoding="utf-8") as f:
+                json.dump(index, f, separators=(",", ":"))
+            os.replace(os.path.join(day_dir, COLD_INDEX_FILE + ".tmp"), os.path.join(day_dir, COLD_INDEX_FILE))
+        except (OSError, InterruptedError, cv2.error) as e:
+            result.update(status="failed", reason=str(e))
+            return result
+        finally:
+            if os.path.exists(tmp_path):
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+        paths = kept_paths
+        if changefeed is not None:
+            now_ts = time.time()
+            changefeed.added([(os.path.join(rel_day, name), os.path.getsize(os.path.join(day_dir, name)), None, now_ts)
+                              for name in (COLD_SEGMENT_FILE, COLD_INDEX_FILE)])
+    result["frames"] = len(index["files"])
+    result["segment_bytes"] = os.path.getsize(segment_path) if os.path.exists(segment_path) else 0
+    result["original_bytes"] = sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+    if not keep_originals:
+        sync_filesystem(day_dir)  # 视频段与索引先落盘，再删除原始文件
+        removed = []
+        for path in paths:
+            try:
+                os.remove(path)
+                removed.append(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"[COLD] 删除原始文件 {path} 失败: {e}")
+        result["removed"] = len(removed)
+        if changefeed is not None and removed:
+            changefeed.removed([os.path.relpath(path, base_dir).replace(os.sep, "/") for path in removed])
+        remove_empty_shard_dirs(day_dir)
+    result["status"] = "archived"
+    result["elapsed_s"] = round(time.perf_counter() - t0, 2)
+    return result
+
+def cold_archive_candidates(base_dir: str, after_days: int) -> list[str]:
+    """早于 after_days 天、仍有原始 JPEG 的日期目录（按时间顺序）。"""
+    cutoff = (datetime.now() - timedelta(days=after_days)).strftime("%Y-%m/%d")
+    days = []
+    for day_dir in list_day_dirs(base_dir):
+        if os.path.relpath(day_dir, base_dir).replace(os.sep, "/") >= cutoff:
+            break
+        if list_day_captures(day_dir):
+            days.append(day_dir)
+    return days
+
+class ColdArchiver:
+    """后台冷数据归档线程：每 COLD_ARCHIVE_CHECK_INTERVAL_SECONDS 检查一次，逐天归档（线程以最低优先级运行）。"""
+    def __init__(self, base_dir: str, changefeed: 'Changefeed | None' = None) -> None:
+        self.base_dir = base_dir
+        self.changefeed = changefeed
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.days_archived = 0
+        self.days_failed = 0
+        self.original_bytes = 0
+        self.segment_bytes = 0
+        self.last_result: dict = {}
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="ColdArchiver", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+
+    def _run(self) -> None:
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)  # Linux 下 nice 值按线程生效
+        except (OSError, AttributeError):
+            pass
+        while not self._stop.wait(COLD_ARCHIVE_CHECK_INTERVAL_SECONDS):
+            try:
+                for day_dir in cold_archive_candidates(self.base_dir, COLD_ARCHIVE_AFTER_DAYS):
+                    if self._stop.is_set():
+                        break
+                    self._archive(day_dir)
+            except Exception as e:
+                logger.error(f"[COLD] 归档时发生异常: {e}", exc_info=True)
+
+    def _archive(self, day_dir: str) -> None:
+        res = archive_day_to_segment(day_dir, self.base_dir, self.changefeed, stop_event=self._stop)
+        self.last_result = res
+        if res["status"] == "archived":
+            self.days_archived += 1
+            self.original_bytes += res["original_bytes"]
+            self.segment_bytes += res["segment_bytes"]
+            logger.info(f"[COLD] 已归档 {res['day']}: {res['frames']} 帧, "
+                        f"{res['original_bytes'] / 1024**2:.1f}MB -> {res['segment_bytes'] / 1024**2:.1f}MB")
+        elif res["status"] == "failed":
+            self.days_failed += 1
+            logger.warning(f"[COLD] 归档 {res['day']} 失败（原始文件保留）: {res['reason']}")
+
+    def stats(self) -> dict:
+        return {
+            "encoder": _cold_encoder_name(),
+            "days_archived": self.days_archived,
+            "days_failed": self.days_failed,
+            "density": round(self.original_bytes / self.segment_bytes, 1) if self.segment_bytes else 0.0,
+            "last": {k: self.last_result.get(k) for k in ("day", "status", "reason")} if self.last_result else {},
+        }
 
 # --- Disk Space Management ---
-def get_oldest_day_dir(base_dir: str) -> str | None: # Identical to v2.0.0
-    """在以 YYYY-MM/DD 组织的目录结构下，找到最老的日期目录路径。"""
+def list_day_dirs(base_dir: str) -> list[str]:
+    """按时间顺序列出 YYYY-MM/DD 结构下的所有日期目录路径。"""
     all_day_paths = []
     if not os.path.isdir(base_dir):
-        logger.warning(f"get_oldest_day_dir: Base directory '{base_dir}' not found or not a directory.")
-        return None
+        logger.warning(f"list_day_dirs: Base directory '{base_dir}' not found or not a directory.")
+        return all_day_paths
     for ym_dir_name in sorted(os.listdir(base_dir)):
         ym_path = os.path.join(base_dir, ym_dir_name)
         if os.path.isdir(ym_path) and len(ym_dir_name) == 7 and ym_dir_name[4] == '-': # Valid YYYY-MM
@@ -925,12 +4467,17 @@ def get_oldest_day_dir(base_dir: str) -> str | None: # Identical to v2.0.0
                     except ValueError:
                         logger.debug(f"Skipping non-day directory: {d_path}")
                         continue
+    return all_day_paths # Lexicographical sort of YYYY-MM/DD is chronological
+
+def get_oldest_day_dir(base_dir: str) -> str | None: # Identical to v2.0.0
+    """在以 YYYY-MM/DD 组织的目录结构下，找到最老的日期目录路径。"""
+    all_day_paths = list_day_dirs(base_dir)
     if all_day_paths:
-        return all_day_paths[0] # Lexicographical sort of YYYY-MM/DD is chronological
+        return all_day_paths[0]
     return None
 
-def check_and_manage_disk_space(): # Identical to v2.0.0 logic
-    """检查磁盘占用并在超过阈值时删除最旧日期目录（批量）。"""
+def check_and_manage_disk_space(changefeed: 'Changefeed | None' = None):
+    """检查磁盘占用并在超过阈值时删除最旧日期目录（批量）；启用变更日志时记录删除事件。"""
     try:
         usage = shutil.disk_usage(IMAGE_STORAGE_MONITOR_PATH)
         percent_used = (usage.used / usage.total) * 100
@@ -951,8 +4498,11 @@ def check_and_manage_disk_space(): # Identical to v2.0.0 logic
                 if oldest_dir_to_delete:
                     logger.warning(f"[DISK] 准备删除最旧日期目录 ({i+1}/{IMAGE_STORAGE_CLEANUP_BATCH_DAYS}): {oldest_dir_to_delete}")
                     try:
+                        files = len(list_day_captures(oldest_dir_to_delete)) if changefeed is not None else 0
                         shutil.rmtree(oldest_dir_to_delete)
                         logger.info(f"[DISK] 已删除目录: {oldest_dir_to_delete}")
+                        if changefeed is not None:
+                            changefeed.deleted(oldest_dir_to_delete, files)
                     except OSError as e:
                         logger.error(f"删除目录 {oldest_dir_to_delete} 失败: {e}", exc_info=True)
                         break 
@@ -964,26 +4514,506 @@ def check_and_manage_disk_space(): # Identical to v2.0.0 logic
     except Exception as e:
         logger.error(f"[DISK] 检查/清理异常: {e}", exc_info=True)
 
-# --- Get Current Capture Interval ---
-def get_current_capture_interval() -> float: # support sub-second intervals like 2.5s
-    """根据时间表返回当前拍摄间隔（秒，float）。"""
-    now_time = datetime.now().time()
-    for schedule_item in CAPTURE_SCHEDULE_CONFIG:
-        if now_time < schedule_item["end_time_exclusive"]:
-            return schedule_item["interval_seconds"]
-    return DEFAULT_INTERVAL_LATE_NIGHT
+# --- Storage Planner ---
+def get_planner_state_path() -> str:
+    """存储规划器状态文件路径（未配置时位于日志目录）。"""
+    return PLANNER_STATE_FILE or os.path.join(LOG_DIR, "storage_planner.json")
+
+def _dir_size_bytes(path: str, depth: int = CAPTURE_SHARD_MAX_DEPTH) -> int:
+    """统计日期目录下常规文件的总字节数（含至多 depth 层分片子目录）。"""
+    total = 0
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+                    elif depth > 0 and entry.is_dir(follow_symlinks=False):
+                        total += _dir_size_bytes(entry.path, depth - 1)
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return total
+
+class StoragePlanner:
+    """存储预算规划器：让归档收敛到“保留 N 天”的目标，而不是在清理阈值附近反复振荡。
+
+    - 每日字节预算 = 归档可用容量 / 目标保留天数；
+      归档可用容量 = 卷容量 × IMAGE_STORAGE_MAX_USAGE_PERCENT − 非归档占用
+    - 预计日写入量 = 近 24h 保存帧数（按小时分桶，不足 24h 时按已观测时长外推）× 近期平均每帧字节数
+    - 超预算时先降低 JPEG 质量（不低于下限），到下限仍超出再提高相似度阈值；
+      低于预算时按相反顺序恢复（先恢复相似度阈值，再提高质量）
+    - 历史日期目录的大小只统计一次（后台线程），与调节状态一起持久化，重启后无需全量扫描
+    """
+    BYTES_PER_FRAME_ALPHA = 0.05   # 每帧字节数 EWMA 系数（约 20 帧适应一次质量变化）
+    HIGH_WATER = 1.05              # 预计/预算 超过该比值时收紧
+    LOW_WATER = 0.90               # 低于该比值时放宽
+    SIMILARITY_STEP_INT = 10       # 相似度阈值每次调整 0.10%
+
+    def __init__(self, state_path: str) -> None:
+        self.state_path = state_path
+        self.jpeg_quality: int = self.max_quality()
+        self.similarity_threshold_int: int = SIMILARITY_THRESHOLD_PERCENT_INT
+        self.bytes_per_frame: float = 0.0
+        self.hourly: deque[list] = deque(maxlen=25)  # [整点时间戳, 帧数, 字节数]
+        self.day_sizes: dict[str, int] = {}  # 已结束日期目录 -> 字节数
+        self.archive_bytes: int | None = None  # 后台统计完成前为 None
+        self.daily_budget_bytes: float = 0.0
+        self.adjustments: int = 0
+        self._last_adjust_monotonic: float = time.monotonic()
+        self._usage = None
+        self._scan_thread: threading.Thread | None = None
+        self._load()
+
+    @staticmethod
+    def max_quality() -> int:
+        return int(PLANNER_MAX_JPEG_QUALITY or output_quality())
+
+    def _load(self) -> None:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"[PLAN] 读取存储规划状态失败 {self.state_path}: {e}")
+            return
+        try:
+            self.jpeg_quality = int(data.get("jpeg_quality", self.jpeg_quality))
+            self.similarity_threshold_int = int(data.get("similarity_threshold_int", self.similarity_threshold_int))
+            self.bytes_per_frame = float(data.get("bytes_per_frame", 0.0))
+            cutoff = time.time() - 86400
+            self.hourly.extend([int(h), int(n), int(b)] for h, n, b in data.get("hourly", []) if h + 3600 > cutoff)
+            self.day_sizes = {str(k): int(v) for k, v in data.get("day_sizes", {}).items()}
+            self._clamp()
+            logger.info(f"[PLAN] 已恢复存储规划状态: 质量={self.jpeg_quality}, 相似度阈值={self.similarity_threshold_int}")
+        except Exception as e:
+            logger.warning(f"[PLAN] 存储规划状态格式无效，忽略: {e}")
+
+    def save(self) -> None:
+        """原子写入调节状态（临时文件 + os.replace）。"""
+        data = {
+            "jpeg_quality": self.jpeg_quality,
+            "similarity_threshold_int": self.similarity_threshold_int,
+            "bytes_per_frame": round(self.bytes_per_frame, 1),
+            "hourly": list(self.hourly),
+            "day_sizes": dict(self.day_sizes),
+        }
+        tmp_path = f"{self.state_path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.state_path)
+        except Exception as e:
+            logger.warning(f"[PLAN] 写入存储规划状态失败 {self.state_path}: {e}")
+
+    def _clamp(self) -> None:
+        """热重载后边界可能变化，保证当前值落在 [下限, 上限] 内。"""
+        lo_q = min(PLANNER_MIN_JPEG_QUALITY, self.max_quality())
+        self.jpeg_quality = max(lo_q, min(self.max_quality(), self.jpeg_quality))
+        max_thr = max(SIMILARITY_THRESHOLD_PERCENT_INT, PLANNER_MAX_SIMILARITY_THRESHOLD_INT)
+        self.similarity_threshold_int = max(SIMILARITY_THRESHOLD_PERCENT_INT, min(max_thr, self.similarity_threshold_int))
+
+    def record_save(self, nbytes: int, ts: float) -> None:
+        """记录一次成功保存（字节数计入当前小时桶与每帧字节数 EWMA）。"""
+        if nbytes <= 0:
+            return
+        hour = int(ts // 3600) * 3600
+        if self.hourly and self.hourly[-1][0] == hour:
+            self.hourly[-1][1] += 1
+            self.hourly[-1][2] += nbytes
+        else:
+            self.hourly.append([hour, 1, nbytes])
+        if self.bytes_per_frame <= 0:
+            self.bytes_per_frame = float(nbytes)
+        else:
+            self.bytes_per_frame += self.BYTES_PER_FRAME_ALPHA * (nbytes - self.bytes_per_frame)
+
+    def frames_per_day(self, now: float) -> float | None:
+        """近 24h 保存帧数；观测不足 1 小时返回 None。"""
+        if not self.hourly:
+            return None
+        observed = min(86400.0, now - self.hourly[0][0])
+        if observed < 3600.0:
+            return None
+        cutoff = now - 86400.0
+        frames = sum(n for h, n, _ in self.hourly if h + 3600 > cutoff)
+        return frames * 86400.0 / observed
+
+    def projected_daily_bytes(self, now: float) -> float | None:
+        fpd = self.frames_per_day(now)
+        if fpd is None or self.bytes_per_frame <= 0:
+            return None
+        return fpd * self.bytes_per_frame
+
+    def today_bytes(self, now: float) -> int:
+        midnight = datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+        return sum(b for h, _, b in self.hourly if h >= midnight)
+
+    def _compute_budget(self) -> None:
+        usage = self._usage
+        if usage is None:
+            return
+        capacity = usage.total * IMAGE_STORAGE_MAX_USAGE_PERCENT / 100.0
+        # 归档大小尚未统计完成时，保守地把已用空间全部视为归档
+        archive = usage.used if self.archive_bytes is None else self.archive_bytes
+        non_archive = max(0, usage.used - archive)
+        self.daily_budget_bytes = max(0.0, capacity - non_archive) / max(1, STORAGE_RETENTION_TARGET_DAYS)
+
+    def refresh_budget(self, base_dir: str, monitor_path: str) -> None:
+        """随磁盘检查调用：刷新卷容量并在后台重新统计归档大小。"""
+        try:
+            self._usage = shutil.disk_usage(monitor_path)
+        except Exception as e:
+            logger.warning(f"[PLAN] 读取磁盘容量失败 {monitor_path}: {e}")
+            return
+        self._compute_budget()
+        logger.info(
+            f"[PLAN] 每日预算 {self.daily_budget_bytes / 1024**2:.1f}MB "
+            f"(保留目标 {STORAGE_RETENTION_TARGET_DAYS} 天, 上限 {IMAGE_STORAGE_MAX_USAGE_PERCENT}%)"
+        )
+        if self._scan_thread is None or not self._scan_thread.is_alive():
+            self._scan_thread = threading.Thread(
+                target=self._scan_archive, args=(base_dir,), name="PlannerScan", daemon=True
+            )
+            self._scan_thread.start()
+
+    def _scan_archive(self, base_dir: str) -> None:
+        """统计归档总大小：已结束的日期目录只统计一次，当天目录每次重新统计。"""
+        try:
+            today_dir = os.path.join(base_dir, capture_day_relpath(datetime.now()))
+            sizes: dict[str, int] = {}
+            total = 0
+            for day_dir in list_day_dirs(base_dir):
+                if shutdown_event.is_set():
+                    return
+                rel = os.path.relpath(day_dir, base_dir)
+                if day_dir != today_dir and rel in self.day_sizes:
+                    size = self.day_sizes[rel]
+                else:
+                    size = _dir_size_bytes(day_dir)
+                if day_dir != today_dir:
+                    sizes[rel] = size
+                total += size
+            self.day_sizes = sizes  # 已删除的日期目录随之淘汰
+            self.archive_bytes = total
+            self._compute_budget()
+            self.save()
+            logger.info(f"[PLAN] 归档统计完成: {len(sizes)} 个历史日期目录, 共 {total / 1024**3:.2f}GB")
+        except Exception as e:
+            logger.warning(f"[PLAN] 归档统计失败: {e}")
+
+    def maybe_adjust(self) -> None:
+        """按固定节奏比较预计日写入量与预算，单步调节质量/相似度阈值。"""
+        now_mono = time.monotonic()
+        if now_mono - self._last_adjust_monotonic < PLANNER_ADJUST_INTERVAL_SECONDS:
+            return
+        self._last_adjust_monotonic = now_mono
+        self._clamp()
+        projected = self.projected_daily_bytes(time.time())
+        if projected is None or self.daily_budget_bytes <= 0:
+            return
+        ratio = projected / self.daily_budget_bytes
+        prev = (self.jpeg_quality, self.similarity_threshold_int)
+        lo_q = min(PLANNER_MIN_JPEG_QUALITY, self.max_quality())
+        max_thr = max(SIMILARITY_THRESHOLD_PERCENT_INT, PLANNER_MAX_SIMILARITY_THRESHOLD_INT)
+        if ratio > self.HIGH_WATER:
+            if self.jpeg_quality > lo_q:
+                self.jpeg_quality = max(lo_q, self.jpeg_quality - (3 if ratio > 1.3 else 1))
+            elif self.similarity_threshold_int < max_thr:
+                self.similarity_threshold_int = min(max_thr, self.similarity_threshold_int + self.SIMILARITY_STEP_INT)
+        elif ratio < self.LOW_WATER:
+            if self.similarity_threshold_int > SIMILARITY_THRESHOLD_PERCENT_INT:
+                self.similarity_threshold_int = max(
+                    SIMILARITY_THRESHOLD_PERCENT_INT, self.similarity_threshold_int - self.SIMILARITY_STEP_INT
+                )
+            elif self.jpeg_quality < self.max_quality():
+                self.jpeg_quality += 1
+        if (self.jpeg_quality, self.similarity_threshold_int) != prev:
+            self.adjustments += 1
+            logger.info(
+                f"[PLAN] 预计 {projected / 1024**2:.1f}MB/天 vs 预算 {self.daily_budget_bytes / 1024**2:.1f}MB/天 "
+                f"(比值 {ratio:.2f}) -> 质量 {prev[0]}->{self.jpeg_quality}, "
+                f"相似度阈值 {prev[1]}->{self.similarity_threshold_int}"
+            )
+            self.save()
+
+    def stats(self) -> dict:
+        now = time.time()
+        projected = self.projected_daily_bytes(now)
+        fpd = self.frames_per_day(now)
+        return {
+            "retention_days": STORAGE_RETENTION_TARGET_DAYS,
+            "daily_budget_mb": round(self.daily_budget_bytes / 1024**2, 1),
+            "projected_daily_mb": round((projected or 0.0) / 1024**2, 1),
+            "budget_ratio": round(projected / self.daily_budget_bytes, 3) if projected and self.daily_budget_bytes > 0 else None,
+            "today_mb": round(self.today_bytes(now) / 1024**2, 1),
+            "archive_gb": round(self.archive_bytes / 1024**3, 2) if self.archive_bytes is not None else None,
+            "bytes_per_frame": int(self.bytes_per_frame),
+            "frames_per_day": int(fpd) if fpd is not None else None,
+            "jpeg_quality": self.jpeg_quality,
+            "similarity_threshold_int": self.similarity_threshold_int,
+            "adjustments": self.adjustments,
+        }
+
+# --- Capture Scheduler ---
+class CaptureScheduler:
+    """按墙钟网格对齐的拍摄调度器（无漂移）。
+
+    - 时间表在构建时展开为 [起点秒, 终点秒, 间隔] 的日内分段，查询用 bisect
+    - 抓拍时刻对齐到分段起点起算的网格（如 2s 间隔即每个偶数秒整点），处理耗时与唤醒抖动不累积
+    - 分段边界本身就是一个截止时刻，间隔切换在边界处立即生效
+    - 统计迟到/错过的网格点以及迟到时长分布，过载时在心跳中可见
+    - 墙钟跳变（NTP/RTC 校时）：迟到超过 CLOCK_STEP_INTERVALS 个间隔按一次跳变处理，只计一个 missed
+    """
+    LATENESS_BUCKETS_MS = (10, 50, 100, 500, 1000)
+    CLOCK_STEP_INTERVALS = 4
+
+    def __init__(self, schedule: list[dict], default_interval: float) -> None:
+        self.ticks_total: int = 0
+        self.ticks_late: int = 0
+        self.ticks_missed: int = 0
+        self.clock_steps: int = 0
+        self.lateness_ms: deque[float] = deque(maxlen=512)
+        self.lateness_histogram: list[int] = [0] * (len(self.LATENESS_BUCKETS_MS) + 1)
+        self.interval_scale: float = 1.0  # 降级时延长间隔（网格按放大后的间隔对齐）
+        self.rebuild(schedule, default_interval)
+
+    def rebuild(self, schedule: list[dict], default_interval: float) -> None:
+        """由 CAPTURE_SCHEDULE_CONFIG 预计算日内分段（热重载后调用）。"""
+        segments = []
+        start = 0.0
+        for item in sorted(schedule, key=lambda x: x["end_time_exclusive"]):
+            end_t = item["end_time_exclusive"]
+            end = end_t.hour * 3600 + end_t.minute * 60 + end_t.second
+            if end > start and float(item["interval_seconds"]) > 0:
+                segments.append((start, float(end), float(item["interval_seconds"])))
+                start = float(end)
+        if start < 86400:
+            segments.append((start, 86400.0, max(0.1, float(default_interval))))
+        self._segments = segments
+        self._starts = [seg[0] for seg in segments]
+
+    def _segment_at(self, second_of_day: float) -> tuple[float, float, float]:
+        return self._segments[max(0, bisect.bisect_right(self._starts, second_of_day) - 1)]
+
+    @staticmethod
+    def _midnight_ts(ts: float) -> float:
+        return datetime.fromtimestamp(ts).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+
+    def interval_at(self, ts: float) -> float:
+        """返回时间戳 ts（秒）所在分段的拍摄间隔（含降级倍数）。"""
+        return self._segment_at(ts - self._midnight_ts(ts))[2] * self.interval_scale
+
+    def next_deadline(self, after_ts: float) -> float:
+        """返回严格晚于 after_ts 的下一个网格截止时刻（epoch 秒）。"""
+        midnight = self._midnight_ts(after_ts)
+        second_of_day = after_ts - midnight
+        seg_start, seg_end, interval = self._segment_at(second_of_day)
+        interval *= self.interval_scale
+        candidate = seg_start + (math.floor((second_of_day - seg_start) / interval) + 1) * interval
+        if candidate >= seg_end:
+            candidate = seg_end  # 下一分段的起点
+        if candidate >= 86400.0:
+            return self._midnight_ts(midnight + 86400.0 + 3600.0)  # 次日零点（容忍夏令时）
+        return midnight + candidate
+
+    def record_tick(self, deadline: float, started_ts: float) -> float:
+        """记录一次按时间表触发的抓拍，返回迟到毫秒数。
+
+        迟到超过一个间隔时，被跳过的网格点计为 missed（不补拍，避免过载时雪崩）；
+        迟到超过 CLOCK_STEP_INTERVALS 个间隔视为墙钟向前跳变，只计一个 missed，且不计入迟到分布。
+        """
+        lateness_s = max(0.0, started_ts - deadline)
+        lateness_ms = lateness_s * 1000.0
+        self.ticks_total += 1
+        interval = self.interval_at(deadline)
+        if lateness_s > self.CLOCK_STEP_INTERVALS * interval:
+            self.ticks_late += 1
+            self.ticks_missed += 1
+            self.clock_steps += 1
+            logger.warning(f"[SCHED] 抓拍迟到 {lateness_s:.1f}s (> {self.CLOCK_STEP_INTERVALS} 个间隔)，"
+                           f"视为墙钟跳变或长时间阻塞，按当前时间重新对齐网格。")
+            return lateness_ms
+        self.lateness_ms.append(lateness_ms)
+        self.lateness_histogram[bisect.bisect_right(self.LATENESS_BUCKETS_MS, lateness_ms)] += 1
+        if lateness_ms > SCHEDULE_LATE_TOLERANCE_MS:
+            self.ticks_late += 1
+            self.ticks_missed += int(lateness_s // interval)
+        return lateness_ms
+
+    def stats(self) -> dict:
+        """迟到统计（p50/p95/max 基于最近 512 个 tick）。"""
+        recent = sorted(self.lateness_ms)
+        def _pct(p: float) -> float:
+            return round(recent[min(len(recent) - 1, int(p * len(recent)))], 1) if recent else 0.0
+        labels = [f"<{b}ms" for b in self.LATENESS_BUCKETS_MS] + [f">={self.LATENESS_BUCKETS_MS[-1]}ms"]
+        return {
+            "ticks": self.ticks_total,
+            "late": self.ticks_late,
+            "missed": self.ticks_missed,
+            "clock_steps": self.clock_steps,
+            "lateness_p50_ms": _pct(0.50),
+            "lateness_p95_ms": _pct(0.95),
+            "lateness_max_ms": round(recent[-1], 1) if recent else 0.0,
+            "lateness_histogram": dict(zip(labels, self.lateness_histogram)),
+        }
+
+# --- Thermal & Load Governor ---
+# 级别逐级叠加：每降一级在前一级基础上再省一部分 CPU
+GOVERNOR_LEVELS = ("normal", "reduced_width", "hash_detector", "lower_quality", "no_overlays", "longer_interval")
+
+def _read_sysfs_number(path: str) -> float | None:
+    try:
+        with open(path, "r") as f:
+            return float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+class LoadGovernor:
+    """温度/负载感知的降级控制器（在主循环中按 GOVERNOR_SAMPLE_INTERVAL_SECONDS 采样，只读几个 sysfs 文件）。
+
+    - 信号：各温区最高温度、CPU 频率上限比例（scaling_max_freq / cpuinfo_max_freq，被动散热降频时下降）、
+      每 CPU 的 1 分钟平均负载；读不到的信号不参与判定
+    - 任一信号越过高阈值记为过热，全部低于恢复阈值记为恢复，介于两者之间保持当前级别（滞回）
+    - 连续 GOVERNOR_STEP_DOWN_SAMPLES 次过热降一级，连续 GOVERNOR_STEP_UP_SAMPLES 次恢复升一级
+    - 各级含义见 GOVERNOR_LEVELS；调用方通过 similarity_width()/hash_only_distance()/cap_quality()/
+      overlays_disabled()/interval_scale() 读取当前级别的效果
+    """
+    def __init__(self) -> None:
+        self.level: int = 0
+        self.transitions: int = 0
+        self.last_transition: dict = {}
+        self.samples: int = 0
+        self.temp_c: float | None = None
+        self.freq_ratio: float | None = None
+        self.load_per_cpu: float | None = None
+        self._hot_streak: int = 0
+        self._cool_streak: int = 0
+        self._last_sample_mono: float = 0.0
+        self._level_since_mono: float = time.monotonic()
+        self.level_seconds: list[float] = [0.0] * len(GOVERNOR_LEVELS)
+        self.level_entries: list[int] = [0] * len(GOVERNOR_LEVELS)
+        self.refresh_sources()
+
+    def refresh_sources(self) -> None:
+        """解析 sysfs 路径（启动与热重载时；路径可配置，便于测试指向伪造文件）。"""
+        self._thermal_paths = sorted(glob.glob(GOVERNOR_THERMAL_ZONE_GLOB))
+        self._cpufreq_dirs = sorted(glob.glob(GOVERNOR_CPUFREQ_POLICY_GLOB))
+        self._cpu_count = os.cpu_count() or 1
+        self.level = min(self.level, GOVERNOR_MAX_LEVEL)
+
+    def read_signals(self) -> tuple[float | None, float | None, float | None]:
+        temps = [t / 1000.0 for t in (_read_sysfs_number(p) for p in self._thermal_paths) if t is not None and t > 0]
+        ratios = []
+        for d in self._cpufreq_dirs:
+            cur_max = _read_sysfs_number(os.path.join(d, "scaling_max_freq"))
+            hw_max = _read_sysfs_number(os.path.join(d, "cpuinfo_max_freq"))
+            if cur_max and hw_max:
+                ratios.append(cur_max / hw_max)
+        load = _read_sysfs_number(GOVERNOR_LOADAVG_PATH)
+        return (max(temps) if temps else None,
+                min(ratios) if ratios else None,
+                load / self._cpu_count if load is not None else None)
+
+    def maybe_sample(self, now_mono: float | None = None) -> bool:
+        """到采样间隔时采样并按滞回规则调整级别；级别变化时返回 True。"""
+        now_mono = time.monotonic() if now_mono is None else now_mono
+        if now_mono - self._last_sample_mono < GOVERNOR_SAMPLE_INTERVAL_SECONDS:
+            return False
+        self._last_sample_mono = now_mono
+        self.samples += 1
+        self.temp_c, self.freq_ratio, self.load_per_cpu = temp, ratio, load = self.read_signals()
+        hot = []
+        if temp is not None and temp >= GOVERNOR_TEMP_HIGH_C:
+            hot.append(f"温度 {temp:.1f}C")
+        if ratio is not None and ratio <= GOVERNOR_FREQ_RATIO_LOW:
+            hot.append(f"频率上限 {ratio:.0%}")
+        if load is not None and load >= GOVERNOR_LOAD_HIGH:
+            hot.append(f"负载 {load:.2f}/CPU")
+        cool = ((temp is None or temp <= GOVERNOR_TEMP_LOW_C)
+                and (ratio is None or ratio >= GOVERNOR_FREQ_RATIO_RECOVER)
+                and (load is None or load <= GOVERNOR_LOAD_LOW))
+        if hot:
+            self._hot_streak, self._cool_streak = self._hot_streak + 1, 0
+        elif cool:
+            self._hot_streak, self._cool_streak = 0, self._cool_streak + 1
+        else:
+            self._hot_streak = self._cool_streak = 0
+        if self._hot_streak >= GOVERNOR_STEP_DOWN_SAMPLES and self.level < GOVERNOR_MAX_LEVEL:
+            self._set_level(self.level + 1, ", ".join(hot), now_mono)
+            return True
+        if self._cool_streak >= GOVERNOR_STEP_UP_SAMPLES and self.level > 0:
+            self._set_level(self.level - 1, "恢复", now_mono)
+            return True
+        return False
+
+    def _set_level(self, level: int, reason: str, now_mono: float) -> None:
+        previous = self.level
+        self.level_seconds[previous] += now_mono - self._level_since_mono
+        self._level_since_mono = now_mono
+        self.level = level
+        self.level_entries[level] += 1
+        self.transitions += 1
+        self._hot_streak = self._cool_streak = 0
+        self.last_transition = {"ts": round(time.time(), 3), "from": GOVERNOR_LEVELS[previous],
+                                "to": GOVERNOR_LEVELS[level], "reason": reason}
+        log = logger.warning if level > previous else logger.info
+        log(f"[GOVERNOR] 级别 {previous}({GOVERNOR_LEVELS[previous]}) -> {level}({GOVERNOR_LEVELS[level]}): {reason} "
+            f"(温度 {self.temp_c}C, 频率上限比例 {self.freq_ratio}, 负载/CPU {self.load_per_cpu})")
+
+    def similarity_width(self) -> int | None:
+        return min(SIMILARITY_MAX_WIDTH, GOVERNOR_REDUCED_WIDTH) if self.level >= 1 else None
+
+    def hash_only_distance(self) -> int | None:
+        return GOVERNOR_HASH_SIMILAR_DISTANCE if self.level >= 2 else None
+
+    def cap_quality(self, quality: int) -> int:
+        if self.level < 3:
+            return quality
+        return max(min(quality, GOVERNOR_MIN_QUALITY), quality - GOVERNOR_QUALITY_DROP)
+
+    def overlays_disabled(self) -> bool:
+        return self.level >= 4
+
+    def interval_scale(self) -> float:
+        return GOVERNOR_INTERVAL_FACTOR if self.level >= 5 else 1.0
+
+    def stats(self) -> dict:
+        seconds = list(self.level_seconds)
+        seconds[self.level] += time.monotonic() - self._level_since_mono
+        return {
+            "level": self.level,
+            "level_name": GOVERNOR_LEVELS[self.level],
+            "temp_c": round(self.temp_c, 1) if self.temp_c is not None else None,
+            "freq_ratio": round(self.freq_ratio, 3) if self.freq_ratio is not None else None,
+            "load_per_cpu": round(self.load_per_cpu, 2) if self.load_per_cpu is not None else None,
+            "samples": self.samples,
+            "transitions": self.transitions,
+            "last_transition": dict(self.last_transition),
+            "seconds_in_level": {name: round(v, 1) for name, v in zip(GOVERNOR_LEVELS, seconds)},
+            "entries_per_level": dict(zip(GOVERNOR_LEVELS, self.level_entries)),
+        }
+
+def governed_similarity_width(state: 'ServiceState') -> int | None:
+    """当前降级级别下的相似度比较宽度（未降级时为 None，即 SIMILARITY_MAX_WIDTH）。"""
+    return state.governor.similarity_width() if state.governor is not None else None
 
 # --- Main Service Logic ---
-def run_capture_service():
+def run_capture_service(state: ServiceState | None = None):
     """图像采集主循环：自恢复，不退出。
 
-    - 按时间表控制间隔
+    - 按时间表控制间隔，抓拍对齐墙钟网格（见 CaptureScheduler），迟到/错过计入指标
     - 设备失联/读帧失败/写盘失败均有退避与重试
     - 周期性心跳输出健康指标
+    - 可选的本地控制套接字：实时状态、立即抓拍、暂停/恢复、重载配置、刷盘
+    - state 可由调用方传入（浸泡测试在运行期间读取计数与耗时窗口），默认新建
     """
     global shutdown_event
 
-    state = ServiceState()
+    state = state if state is not None else ServiceState()
     cap = None
     effective_fourcc = "NOT_SET_INITIALLY"
     init_failures = 0
@@ -995,26 +5025,98 @@ def run_capture_service():
                 f", >=22:00 ({DEFAULT_INTERVAL_LATE_NIGHT}s)")
     logger.info(f"  目标摄像头: {DEFAULT_CAMERA_DEVICE_PATH}")
     logger.info(f"  摄像头参数：{DEFAULT_WIDTH}x{DEFAULT_HEIGHT}, FOURCC: {REQUESTED_FOURCC}")
-    logger.info(f"  图片保存至: {IMAGE_SAVE_BASE_DIR} (JPEG质量: {JPEG_SAVE_QUALITY})")
+    output_format = resolve_output_format(OUTPUT_FORMAT)
+    logger.info(f"  图片保存至: {IMAGE_SAVE_BASE_DIR} (格式: {output_format}, 质量: {output_quality(output_format)}, "
+                f"分片: {CAPTURE_SHARD_FORMAT or '无'})")
     logger.info(f"  磁盘监控: 路径 '{IMAGE_STORAGE_MONITOR_PATH}', 阈值 {IMAGE_STORAGE_MAX_USAGE_PERCENT}%")
+    if STORAGE_PLANNER_ENABLED:
+        state.planner = StoragePlanner(get_planner_state_path())
+        state.planner.refresh_budget(IMAGE_SAVE_BASE_DIR, IMAGE_STORAGE_MONITOR_PATH)
+        logger.info(f"  存储预算: 保留 {STORAGE_RETENTION_TARGET_DAYS} 天, "
+                    f"JPEG质量 {PLANNER_MIN_JPEG_QUALITY}-{StoragePlanner.max_quality()}")
+
+
+    if STORAGE_ROUTING_ENABLED:
+        state.router = StorageRouter(STORAGE_TARGETS_CONFIG)
+        state.router.start()
+        logger.info("  存储路由: " + ", ".join(f"{t.name}={t.path}" for t in state.router.targets)
+                    + f" (写入延迟 SLO {STORAGE_WRITE_LATENCY_SLO_MS:.0f}ms)")
+
+    if CHANGEFEED_ENABLED:
+        try:
+            state.changefeed = Changefeed(get_changefeed_path(), IMAGE_SAVE_BASE_DIR)
+            logger.info(f"  变更日志: {state.changefeed.path} (seq={state.changefeed.seq})")
+        except OSError as e:
+            logger.error(f"变更日志初始化失败 ({get_changefeed_path()}): {e}，本次运行不记录。")
+            state.changefeed = None
+
+    if COLD_ARCHIVE_ENABLED:
+        state.cold_archiver = ColdArchiver(IMAGE_SAVE_BASE_DIR, state.changefeed)
+        state.cold_archiver.start()
+        logger.info(f"  冷数据归档: 早于 {COLD_ARCHIVE_AFTER_DAYS} 天的日期目录 -> {COLD_SEGMENT_FILE} "
+                    f"(编码器 {_cold_encoder_name()}, GOP {COLD_ARCHIVE_GOP})")
+
+    if ACTIVITY_MAP_ENABLED:
+        state.activity = ActivityMap(IMAGE_SAVE_BASE_DIR)
+        logger.info(f"  活动热力图: {ACTIVITY_MAP_DIR or IMAGE_SAVE_BASE_DIR}/YYYY-MM/DD/ "
+                    f"(每 {ACTIVITY_MAP_FLUSH_INTERVAL_SECONDS:.0f}s 写出)")
+
+    if SPOOL_ENABLED:
+        try:
+            state.spool = WriteBehindSpool(SPOOL_DIR, router=state.router)
+            state.spool.changefeed = state.changefeed
+            state.spool.start()
+            logger.info(f"  写回缓冲: {SPOOL_DIR or '内存'} (每 {SPOOL_FLUSH_FILES} 个文件 / "
+                        f"{SPOOL_FLUSH_BYTES // 1024**2}MB / {SPOOL_FLUSH_INTERVAL_SECONDS:.0f}s 批量刷写)")
+        except OSError as e:
+            logger.error(f"写回缓冲初始化失败 ({SPOOL_DIR}): {e}，改为直接写盘。")
+            state.spool = None
 
+    if GOVERNOR_ENABLED:
+        state.governor = LoadGovernor()
+        logger.info(f"  温度/负载降级: 过热 >={GOVERNOR_TEMP_HIGH_C:.0f}C / 频率上限 <={GOVERNOR_FREQ_RATIO_LOW:.0%} / "
+                    f"负载 >={GOVERNOR_LOAD_HIGH}/CPU，最深级别 {GOVERNOR_MAX_LEVEL}({GOVERNOR_LEVELS[GOVERNOR_MAX_LEVEL]}) "
+                    f"(温区 {len(state.governor._thermal_paths)} 个, cpufreq 策略 {len(state.governor._cpufreq_dirs)} 个)")
 
-    last_capture_time = time.monotonic() 
+    control_server = None
+    if CONTROL_SOCKET_ENABLED:
+        control_server = ControlServer(CONTROL_SOCKET_PATH, state)
+        control_server.start()
+
+    scheduler = CaptureScheduler(CAPTURE_SCHEDULE_CONFIG, DEFAULT_INTERVAL_LATE_NIGHT)
+    state.scheduler = scheduler
+    # 下一个网格截止时刻；None 表示需要重新对齐（启动、相机重建、退避、暂停之后，不计入迟到）
+    next_deadline: float | None = None
 
     while not shutdown_event.is_set():
-        current_interval = get_current_capture_interval()
+        if state.governor is not None and state.governor.maybe_sample():
+            if scheduler.interval_scale != state.governor.interval_scale():
+                scheduler.interval_scale = state.governor.interval_scale()
+                next_deadline = None  # 按新间隔重新对齐网格
+        current_interval = scheduler.interval_at(time.time())
+        state.current_interval = current_interval
         try:
             current_monotonic_time = time.monotonic()
             if current_monotonic_time - last_disk_check_time > DISK_CHECK_INTERVAL_SECONDS:
-                check_and_manage_disk_space()
+                check_and_manage_disk_space(state.changefeed)
+                if state.planner is not None:
+                    state.planner.refresh_budget(IMAGE_SAVE_BASE_DIR, IMAGE_STORAGE_MONITOR_PATH)
                 last_disk_check_time = current_monotonic_time
 
+            if pause_event.is_set():
+                # 暂停：不抓拍，等待 resume/snapshot/停机唤醒
+                next_deadline = None
+                wake_event.wait(timeout=1.0)
+                wake_event.clear()
+                if not capture_now_event.is_set():
+                    continue
+
             if cap is None or not cap.isOpened():
                 logger.info("[CAMERA] 未连接或需要重新初始化...")
                 if cap: cap.release() 
                 
                 cap, effective_fourcc = initialize_camera(
-                    DEFAULT_CAMERA_DEVICE_PATH, DEFAULT_WIDTH, DEFAULT_HEIGHT, REQUESTED_FOURCC
+                    DEFAULT_CAMERA_DEVICE_PATH, DEFAULT_WIDTH, DEFAULT_HEIGHT, REQUESTED_FOURCC, state
                 )
                 if not cap:
                     init_failures += 1
@@ -1028,7 +5130,7 @@ def run_capture_service():
                     continue 
                 
                 init_failures = 0 
-                last_capture_time = time.monotonic() 
+                next_deadline = None
                 state.consecutive_read_failures = 0
                 state.effective_fourcc = effective_fourcc
                 # 记录当次应用的相机请求参数，用于后续热重载是否需要重建
@@ -1037,83 +5139,158 @@ def run_capture_service():
                 state.applied_height = DEFAULT_HEIGHT
                 state.applied_requested_fourcc = REQUESTED_FOURCC
 
-            elapsed_since_last_capture = time.monotonic() - last_capture_time
-            wait_time = current_interval - elapsed_since_last_capture
-
-            if wait_time > 0:
+            if next_deadline is None:
+                next_deadline = scheduler.next_deadline(time.time())
+
+            now_ts = time.time()
+            wait_time = next_deadline - now_ts
+            if wait_time > current_interval + SCHEDULE_LATE_TOLERANCE_MS / 1000.0:
+                # 截止时刻远在一个间隔之后：墙钟被向后调整（NTP/RTC 校时），按当前时间重新对齐，不等待跳变的时长
+                scheduler.clock_steps += 1
+                logger.warning(f"[SCHED] 墙钟回退约 {wait_time - current_interval:.1f}s，按当前时间重新对齐抓拍网格。")
+                next_deadline = scheduler.next_deadline(now_ts)
+                wait_time = next_deadline - now_ts
+            if wait_time > 0 and not capture_now_event.is_set():
                 # logger.info(f"当前时间: {datetime.now().strftime('%H:%M:%S')}, 间隔: {current_interval}s. 还需 {wait_time:.2f} 秒...")
-                shutdown_event.wait(timeout=wait_time) 
+                # 等待上限为一个间隔：等待期间墙钟跳变时，醒来后重新评估
+                wake_event.wait(timeout=min(wait_time, current_interval))
+                wake_event.clear()
                 if shutdown_event.is_set(): break 
+                if not capture_now_event.is_set() and time.time() < next_deadline:
+                    continue  # 被控制命令提前唤醒（pause/reload），重新评估
             
             if shutdown_event.is_set(): break 
 
-            last_capture_time = time.monotonic() 
-            logger.debug(f"[CAPTURE] 尝试捕获图像帧 (间隔: {current_interval}s)...")
-
-            for _ in range(4):
-                # 清空缓冲帧
-                cap.grab();
-            t0 = time.perf_counter()
-            try:
-                ret, frame = cap.read()
-            except Exception as e:
-                logger.error(f"读取图像帧异常: {e}")
-                ret, frame = False, None
-
-            if not ret or frame is None:
-                # 节流日志，减少重复 I/O
-                if state.consecutive_read_failures % LOG_EVERY_N_READ_FAILURES == 0:
-                    logger.error("[CAPTURE] 无法从摄像头获取图像帧，可能断开或异常。")
-                state.consecutive_read_failures += 1
-                if state.consecutive_read_failures % LOG_EVERY_N_READ_FAILURES == 0:
-                    logger.info(f"[CAPTURE] 连续读帧失败次数: {state.consecutive_read_failures}")
-                if cap: cap.release()
-                cap = None 
+            force_save = capture_now_event.is_set()
+            capture_now_event.clear()
+            tick_started = time.time()
+            if not force_save or tick_started >= next_deadline:
+                # 正常 tick：记录迟到，并从网格上取下一个截止时刻（错过的网格点不补拍）
+                scheduler.record_tick(next_deadline, tick_started)
+                next_deadline = scheduler.next_deadline(tick_started)
+            logger.debug("[CAPTURE] 尝试捕获图像帧 (间隔: %ss)...", current_interval)
+
+            # 两级采集：先判定低分辨率探测帧，无变化时不读取全分辨率帧
+            if CAPTURE_PROBE_MODE != "off" and (state.two_tier is None or state.two_tier.cap is not cap
+                                                or state.two_tier.mode != CAPTURE_PROBE_MODE):
+                if state.two_tier is not None and state.two_tier.cap is cap:
+                    state.two_tier.close()
+                state.two_tier = TwoTierCapture(cap, CAPTURE_PROBE_MODE, state)
+            elif CAPTURE_PROBE_MODE == "off" and state.two_tier is not None:
+                if state.two_tier.cap is cap:
+                    state.two_tier.close()
+                state.two_tier = None
+            probe_verdict, judged = None, None
+            if state.two_tier is not None:
+                t0 = time.perf_counter()
+                probe_verdict, judged = state.two_tier.probe(force_save)
+                if probe_verdict is not None:
+                    state.frames_captured += 1
+                    saved_filepath = probe_verdict
+
+            if probe_verdict is None:
+                for _ in range(4):
+                    # 清空缓冲帧
+                    cap.grab();
+                if judged is None:
+                    t0 = time.perf_counter()
+                try:
+                    # 池化时复用上一帧的采集缓冲区（尺寸不变时 OpenCV 直接写入，不再分配）
+                    frame_buf = state.buffers.peek("capture") if state.buffers is not None else None
+                    ret, frame = cap.read(frame_buf) if frame_buf is not None else cap.read()
+                except Exception as e:
+                    logger.error(f"读取图像帧异常: {e}")
+                    ret, frame = False, None
+
+                if not ret or frame is None:
+                    # 节流日志，减少重复 I/O
+                    if state.consecutive_read_failures % LOG_EVERY_N_READ_FAILURES == 0:
+                        logger.error("[CAPTURE] 无法从摄像头获取图像帧，可能断开或异常。")
+                    state.consecutive_read_failures += 1
+                    if state.consecutive_read_failures % LOG_EVERY_N_READ_FAILURES == 0:
+                        logger.info(f"[CAPTURE] 连续读帧失败次数: {state.consecutive_read_failures}")
+                    if cap: cap.release()
+                    cap = None 
                 
-                if state.consecutive_read_failures >= MAX_CONSECUTIVE_READ_FAILURES:
-                    logger.critical(f"已连续 {state.consecutive_read_failures} 次无法读取帧。将等待较长时间 ({READ_FAILURE_LONG_BACKOFF_SECONDS}s) 后尝试重连。")
-                    shutdown_event.wait(READ_FAILURE_LONG_BACKOFF_SECONDS)
-                    state.consecutive_read_failures = 0
-                else:
-                    shutdown_event.wait(FRAME_READ_ERROR_RETRY_DELAY_SECONDS) 
-                continue
+                    next_deadline = None
+                    if state.consecutive_read_failures >= MAX_CONSECUTIVE_READ_FAILURES:
+                        logger.critical(f"已连续 {state.consecutive_read_failures} 次无法读取帧。将等待较长时间 ({READ_FAILURE_LONG_BACKOFF_SECONDS}s) 后尝试重连。")
+                        shutdown_event.wait(READ_FAILURE_LONG_BACKOFF_SECONDS)
+                        state.consecutive_read_failures = 0
+                    else:
+                        shutdown_event.wait(FRAME_READ_ERROR_RETRY_DELAY_SECONDS) 
+                    continue
             
-            state.consecutive_read_failures = 0
+                state.consecutive_read_failures = 0
+                state.frames_captured += 1
+                if state.buffers is not None:
+                    state.buffers.adopt("capture", frame)
 
-            try:
-                saved_filepath = process_and_save_frame(
-                    state, frame, effective_fourcc, IMAGE_SAVE_BASE_DIR, 
-                    JPEG_SAVE_QUALITY, TIMESTAMP_FORMAT
-                )
-            except Exception as e:
-                logger.error(f"处理与保存帧异常: {e}", exc_info=True)
-                saved_filepath = None
+                try:
+                    quality = state.planner.jpeg_quality if state.planner else output_quality()
+                    if state.governor is not None:
+                        quality = state.governor.cap_quality(quality)
+                    saved_filepath = process_and_save_frame(
+                        state, frame, effective_fourcc, IMAGE_SAVE_BASE_DIR, quality,
+                        TIMESTAMP_FORMAT, force_save=force_save, judged=judged
+                    )
+                except Exception as e:
+                    logger.error(f"处理与保存帧异常: {e}", exc_info=True)
+                    saved_filepath = None
+                if state.two_tier is not None and judged is None:
+                    state.two_tier.after_full_frame(saved_filepath, (time.perf_counter() - t0) * 1000.0)
             if saved_filepath == "SIMILARITY":
                 logger.debug("[SAVE] 图像接近，跳过保存")
-            elif isinstance(saved_filepath, str) and saved_filepath.lower().endswith(".jpg"):
-                logger.debug(f"[SAVE] 成功保存: {saved_filepath}")
+                state.frames_similar += 1
+            elif saved_filepath in ("BLACK_FRAME", "QUALITY_REJECT", "STATIC_FRAME"):
+                logger.debug("[SAVE] 内容检测命中 (%s)，跳过保存", saved_filepath)
+            elif isinstance(saved_filepath, str):  # 其余字符串即保存路径（与输出格式/扩展名无关）
+                logger.debug("[SAVE] 成功保存: %s", saved_filepath)
+                state.frames_saved += 1
                 # consecutive_imwrite_failures is reset inside process_and_save_frame
                 state.last_saved_filepath = saved_filepath
+                if state.planner is not None:
+                    state.planner.maybe_adjust()
             else:
                 logger.warning("[SAVE] 本次图像未能成功保存。")
                 # consecutive_imwrite_failures is incremented inside process_and_save_frame
                 if state.consecutive_imwrite_failures >= MAX_CONSECUTIVE_IMWRITE_FAILURES:
                     logger.critical(f"[SAVE] 连续 {state.consecutive_imwrite_failures} 次保存失败，尝试磁盘清理并退避后继续。")
                     try:
-                        check_and_manage_disk_space()
+                        check_and_manage_disk_space(state.changefeed)
                         state.total_disk_cleanup_batches += IMAGE_STORAGE_CLEANUP_BATCH_DAYS
                     except Exception as e_clean:
                         logger.error(f"执行磁盘清理时异常: {e_clean}")
                     shutdown_event.wait(IMWRITE_FAILURE_BACKOFF_SECONDS)
                     state.consecutive_imwrite_failures = 0
+                    next_deadline = None
                     continue
 
+            if state.camera_reinit_requested:
+                # 内容检测判定画面异常（镜头遮挡/画面冻结/持续残帧），释放设备，下一轮重新初始化
+                state.camera_reinit_requested = False
+                state.content_reinits += 1
+                try:
+                    cap.release()
+                except Exception:
+                    pass
+                cap = None
+
             # 记录耗时
             t1 = time.perf_counter()
             elapsed_ms = (t1 - t0) * 1000.0
             # 控制滑动窗口规模，避免无限增长
             state.processing_times_ms.append(elapsed_ms)
 
+            if state.changefeed is not None:
+                now_dt = datetime.now()
+                if state.changefeed.day != now_dt.strftime("%Y-%m/%d/"):
+                    if state.spool is not None:
+                        state.spool.flush_now()  # 前一天的文件先全部落盘，再写日切标记
+                    state.changefeed.roll_day(now_dt)
+            if state.activity is not None:
+                state.activity.maybe_flush()
+
             # 心跳日志：定期打印运行健康信息
             now_mono = time.monotonic()
             if now_mono - state.last_heartbeat_monotonic >= HEARTBEAT_INTERVAL_SECONDS:
@@ -1123,16 +5300,7 @@ def run_capture_service():
             # 健康快照：周期性输出 JSON 文件，供外部探针读取
             try:
                 if now_mono - state.last_health_dump_monotonic >= HEARTBEAT_INTERVAL_SECONDS:
-                    health = {
-                        "boot_id": state.boot_id,
-                        "ts": time.time(),
-                        "interval": current_interval,
-                        "read_failures": state.consecutive_read_failures,
-                        "imwrite_failures": state.consecutive_imwrite_failures,
-                        "disk_cleanup_batches": state.total_disk_cleanup_batches,
-                        "last_saved": state.last_saved_filepath,
-                        "fourcc": state.effective_fourcc,
-                    }
+                    health = build_health_snapshot(state)
                     health_path = os.path.join(LOG_DIR, "health.json")
                     with open(health_path, "w", encoding="utf-8") as hf:
                         json.dump(health, hf, ensure_ascii=False)
@@ -1149,6 +5317,27 @@ def run_capture_service():
                     prev_w, prev_h = DEFAULT_WIDTH, DEFAULT_HEIGHT
                     prev_fourcc = REQUESTED_FOURCC
                     load_and_apply_yaml_config(CONFIG_PATH, runtime_reload=True)
+                    scheduler.rebuild(CAPTURE_SCHEDULE_CONFIG, DEFAULT_INTERVAL_LATE_NIGHT)
+                    state.overlays = None
+                    state.region_mask = None
+                    if FRAME_BUFFER_POOL_ENABLED != (state.buffers is not None):
+                        state.buffers = FramePool() if FRAME_BUFFER_POOL_ENABLED else None
+                    next_deadline = None
+                    if STORAGE_PLANNER_ENABLED and state.planner is None:
+                        state.planner = StoragePlanner(get_planner_state_path())
+                        state.planner.refresh_budget(IMAGE_SAVE_BASE_DIR, IMAGE_STORAGE_MONITOR_PATH)
+                    elif not STORAGE_PLANNER_ENABLED and state.planner is not None:
+                        state.planner.save()
+                        state.planner = None
+                    if GOVERNOR_ENABLED:
+                        if state.governor is None:
+                            state.governor = LoadGovernor()
+                        else:
+                            state.governor.refresh_sources()
+                        scheduler.interval_scale = state.governor.interval_scale()
+                    elif state.governor is not None:
+                        state.governor = None
+                        scheduler.interval_scale = 1.0
                     logger.info("配置热重载完成。")
 
                     # 检查是否需要重建相机：设备路径、分辨率或 FOURCC 发生变化
@@ -1169,7 +5358,7 @@ def run_capture_service():
                         cap = None
                         # 立即重新初始化（不等待下一轮）
                         cap, effective_fourcc = initialize_camera(
-                            DEFAULT_CAMERA_DEVICE_PATH, DEFAULT_WIDTH, DEFAULT_HEIGHT, REQUESTED_FOURCC
+                            DEFAULT_CAMERA_DEVICE_PATH, DEFAULT_WIDTH, DEFAULT_HEIGHT, REQUESTED_FOURCC, state
                         )
                         if cap:
                             state.effective_fourcc = effective_fourcc
@@ -1177,7 +5366,6 @@ def run_capture_service():
                             state.applied_width = DEFAULT_WIDTH
                             state.applied_height = DEFAULT_HEIGHT
                             state.applied_requested_fourcc = REQUESTED_FOURCC
-                            last_capture_time = time.monotonic()
                             logger.info("[CAMERA] 重建完成，新的有效 FOURCC: %s", effective_fourcc)
                         else:
                             logger.error("[CAMERA] 重建失败，将进入正常重试路径")
@@ -1194,6 +5382,7 @@ def run_capture_service():
             except Exception:
                 pass
             cap = None
+            next_deadline = None
             logger.info(f"[SERVICE] 因 OpenCV 错误，等待 {CAMERA_INIT_RETRY_DELAY_SECONDS}s 后重试。")
             shutdown_event.wait(CAMERA_INIT_RETRY_DELAY_SECONDS)
         except Exception as e: 
@@ -1204,37 +5393,1345 @@ def run_capture_service():
             except Exception:
                 pass
             cap = None
+            next_deadline = None
             logger.info(f"[SERVICE] 因严重错误，等待 {CAMERA_INIT_LONG_BACKOFF_SECONDS}s 后重试。")
             shutdown_event.wait(CAMERA_INIT_LONG_BACKOFF_SECONDS)
 
     # Loop exited (likely due to shutdown_event)
+    if control_server:
+        control_server.stop()
+    if state.planner is not None:
+        state.planner.save()
+    if state.spool is not None:
+        state.spool.close()
+    if state.router is not None:
+        state.router.close()
+    if state.cold_archiver is not None:
+        state.cold_archiver.close()
+    if state.changefeed is not None:
+        state.changefeed.close()
+    if state.activity is not None:
+        state.activity.flush()
+    if state.luma is not None:
+        state.luma.close()
     if cap and cap.isOpened():
         logger.info("[CAMERA] 正在释放资源...")
         cap.release()
     logger.info("[SERVICE] 主循环已停止。")
 
 
+# --- Offline Archive Tools ---
+def list_input_images(input_dir: str) -> list[str]:
+    """离线工具的图片输入：抓拍日期目录（含分片）按拍摄顺序；否则为目录下按文件名排序的 JPEG/WebP/AVIF/PNG。"""
+    paths = list_day_captures(input_dir)
+    if paths:
+        return paths
+    try:
+        names = os.listdir(input_dir)
+    except OSError:
+        return []
+    return sorted(os.path.join(input_dir, n) for n in names if n.lower().endswith(CAPTURE_FILE_EXTENSIONS + (".png",)))
+
+def reduced_imread_flag(full_width: int, target_width: int) -> int:
+    """选择 JPEG DCT 域缩小解码倍率：解码后宽度仍不小于 target_width 的最大倍率。"""
+    for factor, flag in ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+                         (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+                         (2, cv2.IMREAD_REDUCED_GRAYSCALE_2)):
+        if full_width // factor >= target_width:
+            return flag
+    return cv2.IMREAD_GRAYSCALE
+
+def decode_reduced_multi(paths: list[str], widths: list[int]) -> tuple[dict[int, list[np.ndarray | None]], tuple[int, int] | None]:
+    """以缩小倍率解码一组抓拍，每张只解码一次并生成各比较宽度的缩小灰度帧。
+
+    返回 ({宽度: 缩小灰度帧列表}, 原始尺寸 (w, h))。第一张以全尺寸灰度解码以获得原始尺寸，
+    其余按 reduced_imread_flag（以最大宽度为准）在 DCT 域缩小解码，解码成本随倍率平方下降。
+    解码失败的位置为 None。
+    """
+    frames: dict[int, list[np.ndarray | None]] = {w: [] for w in widths}
+    full_size = None
+    flag = cv2.IMREAD_GRAYSCALE
+    for path in paths:
+        img = cv2.imread(path, flag)
+        if img is None:
+            for w in widths:
+                frames[w].append(None)
+            continue
+        if full_size is None:
+            full_size = (img.shape[1], img.shape[0])
+            flag = reduced_imread_flag(full_size[0], max(widths))
+        for w in widths:
+            frames[w].append(reduce_frame_for_similarity(img, w))
+    return frames, full_size
+
+def decode_reduced_sequence(paths: list[str], target_width: int) -> tuple[list[np.ndarray | None], tuple[int, int] | None]:
+    """decode_reduced_multi 的单宽度形式，返回 (缩小灰度帧列表, 原始尺寸 (w, h))。"""
+    frames, full_size = decode_reduced_multi(paths, [target_width])
+    return frames[target_width], full_size
+
+def build_offline_regions(full_size: tuple[int, int], exclude_overlays: bool = True) -> list[dict]:
+    """离线比较所用区域：配置的检测区域 + （可选）归档图片中已烧录的叠加层包围盒。"""
+    regions = list(DETECTION_REGIONS_CONFIG)
+    if exclude_overlays:
+        regions += build_overlay_compositor().exclusion_regions(full_size[1], full_size[0], datetime.now())
+    return regions
+
+def select_keyframes(frames: list[np.ndarray | None], timestamps: list[float | None],
+                     threshold_int: int, regions: RegionMask | None) -> list[bool]:
+    """按服务的实时判定逻辑（关键帧缓存 + 轮廓差异）重放一个序列，返回每帧是否保留。
+
+    解码失败的帧保留（不做判断，不删除无法确认的文件）。
+    """
+    keyframes = KeyframeCache()
+    keep = []
+    for frame, ts in zip(frames, timestamps):
+        if frame is None:
+            keep.append(True)
+            continue
+        frame_hash = compute_frame_hash(frame[regions.bbox] if regions is not None else frame)
+        similar, _ = keyframes.match(frame, frame_hash, threshold_int, regions, now=ts)
+        if not similar:
+            keyframes.add(frame, frame_hash, now=ts)
+        keep.append(not similar)
+    return keep
+
+def _init_offline_worker(overrides: dict) -> None:
+    """进程池初始化：应用参数覆盖（spawn/forkserver 下全局配置不会继承），单线程 OpenCV 避免超额订阅。"""
+    global logger, _log_listener
+    globals().update(overrides)
+    if logger is None:
+        logger = logging.getLogger(SCRIPT_NAME)
+    if any(isinstance(h, logging.handlers.QueueHandler) for h in logger.handlers):
+        _log_listener = None  # fork 继承了 QueueHandler，但监听线程不会随进程复制，改为直接写出
+        attach_log_handlers(logger, False)
+    cv2.setNumThreads(1)
+
+def rethin_day(task: dict) -> dict:
+    """重新精简一个日期目录（在工作进程中执行）。
+
+    task: day_dir, rel_day, mode(dry-run|trash|keep-list), trash_dir, exclude_overlays
+    """
+    t_cpu0 = time.process_time()
+    t0 = time.perf_counter()
+    paths = list_day_captures(task["day_dir"])
+    result = {"day": task["rel_day"], "frames": len(paths), "kept": [], "rejected": 0,
+              "rejected_bytes": 0, "moved": 0, "errors": 0}
+    if not paths:
+        return result
+    frames, full_size = decode_reduced_sequence(paths, SIMILARITY_MAX_WIDTH)
+    regions = None
+    if full_size is not None:
+        region_specs = build_offline_regions(full_size, task["exclude_overlays"])
+        reduced = next((f for f in frames if f is not None), None)
+        if region_specs and reduced is not None:
+            regions = RegionMask(region_specs, full_size, (reduced.shape[1], reduced.shape[0]))
+    keep = select_keyframes(frames, [parse_capture_timestamp(p) for p in paths],
+                            SIMILARITY_THRESHOLD_PERCENT_INT, regions)
+    for path, keep_it in zip(paths, keep):
+        if keep_it:
+            result["kept"].append(path)
+            continue
+        result["rejected"] += 1
+        try:
+            result["rejected_bytes"] += os.path.getsize(path)
+        except OSError:
+            pass
+        if task["mode"] == "trash":
+            dest = os.path.join(task["trash_dir"], task["rel_day"], os.path.relpath(path, task["day_dir"]))
+            try:
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                shutil.move(path, dest)
+                result["moved"] += 1
+            except OSError as e:
+                result["errors"] += 1
+                logger.error(f"[RETHIN] 移动 {path} 失败: {e}")
+    result["wall_s"] = round(time.perf_counter() - t0, 3)
+    result["cpu_s"] = round(time.process_time() - t_cpu0, 3)
+    return result
+
+def write_offline_report(args, report: dict) -> None:
+    """输出离线工具的 JSON 报告：给定 --output 时写入文件，否则写到 stdout（日志在 stderr，可直接管道给 jq）。"""
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+def run_rethin(args) -> int:
+    """离线重新精简归档：以当前（或命令行覆盖的）阈值重放每个日期目录，多进程按天并行。
+
+    - 默认 dry-run，只报告可回收字节数
+    - --trash-dir：将被剔除的文件按 YYYY-MM/DD（含分片）结构移入回收目录（可人工复核后再删除）
+    - --keep-list：将保留文件路径写入清单（不动归档）
+    """
+    base_dir = os.path.abspath(args.base_dir or IMAGE_SAVE_BASE_DIR)
+    overrides = {
+        "SIMILARITY_THRESHOLD_PERCENT_INT": args.threshold if args.threshold is not None else SIMILARITY_THRESHOLD_PERCENT_INT,
+        "DEFAULT_CONTOUR_PIXEL_THRESHOLD": args.pixel_threshold if args.pixel_threshold is not None else DEFAULT_CONTOUR_PIXEL_THRESHOLD,
+        "SIMILARITY_MAX_WIDTH": args.max_width if args.max_width is not None else SIMILARITY_MAX_WIDTH,
+        "KEYFRAME_CACHE_SIZE": KEYFRAME_CACHE_SIZE,
+        "KEYFRAME_CACHE_EXPIRY_SECONDS": KEYFRAME_CACHE_EXPIRY_SECONDS,
+        "KEYFRAME_HASH_MAX_DISTANCE": KEYFRAME_HASH_MAX_DISTANCE,
+        "DETECTION_REGIONS_CONFIG": DETECTION_REGIONS_CONFIG,
+        "OVERLAY_CONFIG": OVERLAY_CONFIG,
+        "ENABLE_TIMESTAMP": ENABLE_TIMESTAMP,
+        "TIMESTAMP_FORMAT": TIMESTAMP_FORMAT,
+    }
+    mode = "trash" if args.trash_dir else ("keep-list" if args.keep_list else "dry-run")
+    if args.dry_run:
+        mode = "dry-run"
+    today = datetime.now().strftime("%Y-%m/%d")
+    tasks = []
+    for day_dir in list_day_dirs(base_dir):
+        rel_day = os.path.relpath(day_dir, base_dir)
+        day_key = rel_day.replace(os.sep, "/")
+        if day_key == today and not args.include_today:
+            continue  # 当天目录仍在写入
+        if (args.from_day and day_key < args.from_day) or (args.to_day and day_key > args.to_day):
+            continue
+        tasks.append({"day_dir": day_dir, "rel_day": rel_day, "mode": mode,
+                      "trash_dir": os.path.abspath(args.trash_dir) if args.trash_dir else None,
+                      "exclude_overlays": not args.keep_overlays})
+    workers = max(1, args.workers or os.cpu_count() or 1)
+    logger.info(f"[RETHIN] {base_dir}: {len(tasks)} 个日期目录, 模式 {mode}, 进程数 {workers}, "
+                f"阈值 {overrides['SIMILARITY_THRESHOLD_PERCENT_INT']}, 像素阈值 {overrides['DEFAULT_CONTOUR_PIXEL_THRESHOLD']}, "
+                f"比较宽度 {overrides['SIMILARITY_MAX_WIDTH']}")
+    t0 = time.perf_counter()
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_offline_worker,
+                                                initargs=(overrides,)) as pool:
+        futures = {pool.submit(rethin_day, task): task for task in tasks}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                res = future.result()
+            except Exception as e:
+                logger.error(f"[RETHIN] 处理 {futures[future]['rel_day']} 失败: {e}")
+                continue
+            results.append(res)
+            logger.info(f"[RETHIN] {res['day']}: {res['frames']} 帧, 保留 {len(res['kept'])}, "
+                        f"剔除 {res['rejected']} ({res['rejected_bytes'] / 1024**2:.1f}MB)")
+    elapsed = time.perf_counter() - t0
+    results.sort(key=lambda r: r["day"])
+    if mode == "keep-list":
+        with open(args.keep_list, "w", encoding="utf-8") as f:
+            for res in results:
+                f.writelines(path + "\n" for path in res["kept"])
+    frames = sum(r["frames"] for r in results)
+    report = {
+        "base_dir": base_dir,
+        "mode": mode,
+        "days": len(results),
+        "frames": frames,
+        "kept": sum(len(r["kept"]) for r in results),
+        "rejected": sum(r["rejected"] for r in results),
+        "reclaimable_bytes": sum(r["rejected_bytes"] for r in results),
+        "moved": sum(r["moved"] for r in results),
+        "errors": sum(r["errors"] for r in results),
+        "workers": workers,
+        "elapsed_s": round(elapsed, 2),
+        "frames_per_s": round(frames / elapsed, 1) if elapsed > 0 else 0.0,
+        "cpu_ms_per_frame": round(sum(r.get("cpu_s", 0.0) for r in results) * 1000.0 / frames, 2) if frames else 0.0,
+        "per_day": [{k: v for k, v in r.items() if k != "kept"} for r in results],
+    }
+    write_offline_report(args, report)
+    return 1 if report["errors"] else 0
+
+def _day_key_start(day_key: str) -> float:
+    """YYYY-MM/DD -> 当天 00:00 的 epoch 秒。"""
+    return datetime.strptime(day_key, "%Y-%m/%d").timestamp()
+
+class HighlightSelector:
+    """流式精选帧：把时间范围等分为若干桶，每桶保留变化分数最高的帧，入选帧之间保证最小时间间隔。
+
+    - 帧按时间顺序逐个 add(路径, 拍摄时间, 变化分数)，只保留候选，内存上界为 桶数 × 2K（K = ceil(目标帧数 / 桶数)），
+      与输入帧数无关
+    - 同一桶内两个候选间隔小于 min_spread 时只保留分数较高者（连续活动不会挤占整桶名额）
+    - finalize：每桶前 K 名优先，其次是各桶的备选（安静时段未用满的名额由其他时段的高分帧补足），
+      按分数从高到低贪心接受并再次检查跨桶间隔，返回按时间排序的 [(拍摄时间, 路径, 分数)]
+    """
+    def __init__(self, start_ts: float, end_ts: float, target_count: int, buckets: int,
+                 min_spread_seconds: float = 0.0) -> None:
+        self.target = max(1, int(target_count))
+        self.buckets = max(1, min(int(buckets), self.target))
+        self.per_bucket = math.ceil(self.target / self.buckets)
+        self.start_ts = start_ts
+        self.span = max(1e-6, end_ts - start_ts)
+        self.min_spread = max(0.0, float(min_spread_seconds))
+        self._heaps: dict[int, list[tuple[float, float, str]]] = {}  # 桶序号 -> 最小堆 (分数, 时间, 路径)
+        self.frames_seen = 0
+
+    def add(self, path: str, ts: float, score: float) -> None:
+        self.frames_seen += 1
+        idx = min(self.buckets - 1, max(0, int((ts - self.start_ts) / self.span * self.buckets)))
+        heap = self._heaps.setdefault(idx, [])
+        entry = (float(score), ts, path)
+        if self.min_spread > 0:
+            for pos, (other_score, other_ts, _) in enumerate(heap):
+                if abs(other_ts - ts) < self.min_spread:
+                    if entry[0] > other_score:
+                        heap[pos] = entry
+                        heapq.heapify(heap)
+                    return
+        if len(heap) < 2 * self.per_bucket:
+            heapq.heappush(heap, entry)
+        elif entry[0] > heap[0][0]:
+            heapq.heapreplace(heap, entry)
+
+    def finalize(self) -> list[tuple[float, str, float]]:
+        primary, reserve = [], []
+        for heap in self._heaps.values():
+            ranked = sorted(heap, reverse=True)
+            primary += ranked[:self.per_bucket]
+            reserve += ranked[self.per_bucket:]
+        chosen_ts: list[float] = []
+        chosen: list[tuple[float, str, float]] = []
+        for score, ts, path in sorted(primary, reverse=True) + sorted(reserve, reverse=True):
+            if len(chosen) >= self.target:
+                break
+            pos = bisect.bisect_left(chosen_ts, ts)
+            if self.min_spread > 0 and (
+                    (pos > 0 and ts - chosen_ts[pos - 1] < self.min_spread)
+                    or (pos < len(chosen_ts) and chosen_ts[pos] - ts < self.min_spread)):
+                continue
+            chosen_ts.insert(pos, ts)
+            chosen.append((ts, path, score))
+        chosen.sort()
+        return chosen
+
+def iter_change_scores(day_dirs: list[str], width: int, exclude_overlays: bool = True):
+    """逐帧流式产生 (路径, 拍摄时间, 变化分数)：与前一帧的轮廓差异率（百分比），无可比较的前一帧时为 0。
+
+    每张只以 DCT 域缩小倍率解码一次，同时只保留前一帧的缩小灰度图；烧录的叠加层（时间戳）按配置遮蔽。
+    """
+    prev = None
+    for day_dir in day_dirs:
+        regions = None
+        region_specs: list[dict] = []
+        flag = cv2.IMREAD_GRAYSCALE
+        full_size = None
+        for path in list_day_captures(day_dir):
+            ts = parse_capture_timestamp(path)
+            if ts is None:
+                continue
+            img = cv2.imread(path, flag)
+            if img is None:
+                logger.warning(f"[HIGHLIGHTS] 无法解码 {path}，跳过。")
+                continue
+            if full_size is None:
+                full_size = (img.shape[1], img.shape[0])
+                flag = reduced_imread_flag(full_size[0], width)
+                region_specs = build_offline_regions(full_size, exclude_overlays)
+            reduced = reduce_frame_for_similarity(img, width)
+            if reduced is None:
+                continue
+            if regions is None and region_specs:
+                regions = RegionMask(region_specs, full_size, (reduced.shape[1], reduced.shape[0]))
+            if prev is None or prev.shape != reduced.shape:
+                score = 0.0
+            else:
+                score = compare_reduced_frames(prev, reduced, SIMILARITY_THRESHOLD_PERCENT_INT, regions)[1]
+            prev = reduced
+            yield path, ts, score
+
+def run_highlights(args) -> int:
+    """从一天或多天的归档中选出时间均衡的精选帧列表，供精简日报/周报视频编码。
+
+    - 目标帧数：--count，或 --duration × --fps
+    - 默认每小时一个时间桶，每桶按变化分数取前 K 帧；--min-spread 控制入选帧的最小间隔
+    - --format concat 输出 ffmpeg concat 脚本（每帧 duration = 1/fps），可直接 ffmpeg -f concat -safe 0 -i
+    单进程单次流式处理，内存与帧数无关。
+    """
+    base_dir = os.path.abspath(args.base_dir or IMAGE_SAVE_BASE_DIR)
+    today = datetime.now().strftime("%Y-%m/%d")
+    days = []
+    for day_dir in list_day_dirs(base_dir):
+        day_key = os.path.relpath(day_dir, base_dir).replace(os.sep, "/")
+        if day_key == today and not args.include_today:
+            continue
+        if (args.from_day and day_key < args.from_day) or (args.to_day and day_key > args.to_day):
+            continue
+        days.append((day_key, day_dir))
+    if not days:
+        logger.error(f"[HIGHLIGHTS] {base_dir} 中没有符合条件的日期目录。")
+        return 1
+    days.sort()
+    # 时间范围取实际抓拍的首末时刻（而非日历日）：只拍了几个小时的日期不会稀释时间桶与默认最小间隔
+    first = next((ts for ts in map(parse_capture_timestamp, list_day_captures(days[0][1])) if ts is not None), None)
+    last = next((ts for ts in map(parse_capture_timestamp, reversed(list_day_captures(days[-1][1]))) if ts is not None), None)
+    if first is None or last is None:
+        logger.error(f"[HIGHLIGHTS] {days[0][0]} ~ {days[-1][0]} 中没有可识别的抓拍文件。")
+        return 1
+    start_ts, end_ts = first, last + 1.0
+    target = int(round(args.duration * args.fps)) if args.duration else (args.count or 240)
+    buckets = args.buckets or max(1, int(math.ceil((end_ts - start_ts) / 3600.0)))
+    min_spread = args.min_spread if args.min_spread is not None else (end_ts - start_ts) / max(1, target) / 4.0
+    width = args.max_width or SIMILARITY_MAX_WIDTH
+    selector = HighlightSelector(start_ts, end_ts, target, buckets, min_spread)
+    logger.info(f"[HIGHLIGHTS] {days[0][0]} ~ {days[-1][0]}: 目标 {selector.target} 帧, {selector.buckets} 个时间桶 "
+                f"(每桶 {selector.per_bucket}), 最小间隔 {min_spread:.0f}s")
+    t0 = time.perf_counter()
+    for path, ts, score in iter_change_scores([d for _, d in days], width, not args.keep_overlays):
+        selector.add(path, ts, score)
+    chosen = selector.finalize()
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        if args.format == "concat":
+            out.write("ffconcat version 1.0\n")
+            for _, path, _ in chosen:
+                out.write("file '" + path.replace("'", "'\\''") + "'\n")
+                out.write(f"duration {1.0 / args.fps:.6f}\n")
+        else:
+            out.writelines(path + "\n" for _, path, _ in chosen)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    logger.info(f"[HIGHLIGHTS] {selector.frames_seen} 帧中选出 {len(chosen)} 帧 "
+                f"({len(chosen) / args.fps:.1f}s @ {args.fps:g}fps), 耗时 {time.perf_counter() - t0:.1f}s")
+    if len(chosen) < selector.target:
+        logger.warning(f"[HIGHLIGHTS] 只选出 {len(chosen)}/{selector.target} 帧（可用帧不足或 --min-spread "
+                       f"{min_spread:.0f}s 过大），列表已输出但以非零状态退出。")
+        return 1
+    return 0
+
+def run_archive(args) -> int:
+    """立即把符合条件的旧日期目录归档为视频段（与服务内后台归档相同的流程），逐天串行，输出 JSON 报告。"""
+    base_dir = os.path.abspath(args.base_dir or IMAGE_SAVE_BASE_DIR)
+    after_days = args.after_days if args.after_days is not None else COLD_ARCHIVE_AFTER_DAYS
+    days = []
+    for day_dir in cold_archive_candidates(base_dir, after_days):
+        day_key = os.path.relpath(day_dir, base_dir).replace(os.sep, "/")
+        if (args.from_day and day_key < args.from_day) or (args.to_day and day_key > args.to_day):
+            continue
+        days.append(day_dir)
+    logger.info(f"[COLD] {base_dir}: {len(days)} 个日期目录待归档 (早于 {after_days} 天, 编码器 {_cold_encoder_name()}, "
+                f"GOP {COLD_ARCHIVE_GOP})")
+    changefeed = open_offline_changefeed(base_dir, args.changefeed) if days else None
+    results = []
+    try:
+        for day_dir in days:
+            if shutdown_event.is_set():
+                break
+            res = archive_day_to_segment(day_dir, base_dir, changefeed=changefeed,
+                                         keep_originals=args.keep_originals, stop_event=shutdown_event)
+            results.append(res)
+            logger.info(f"[COLD] {res['day']}: {res['status']} {res['frames']} 帧, "
+                        f"{res['original_bytes'] / 1024**2:.1f}MB -> {res['segment_bytes'] / 1024**2:.1f}MB {res['reason']}")
+    finally:
+        if changefeed is not None:
+            changefeed.close()
+    original = sum(r["original_bytes"] for r in results if r["status"] == "archived")
+    segment = sum(r["segment_bytes"] for r in results if r["status"] == "archived")
+    report = {
+        "base_dir": base_dir,
+        "days": len(results),
+        "archived": sum(1 for r in results if r["status"] == "archived"),
+        "failed": sum(1 for r in results if r["status"] == "failed"),
+        "original_bytes": original,
+        "segment_bytes": segment,
+        "density": round(original / segment, 1) if segment else 0.0,
+        "per_day": results,
+    }
+    write_offline_report(args, report)
+    return 1 if report["failed"] else 0
+
+def run_extract(args) -> int:
+    """按时间戳取回最接近的一帧（原始 JPEG 或视频段随机读取）并写入 --output。"""
+    if not args.at or not args.output:
+        logger.error("extract 需要 --at 与 --output。")
+        return 2
+    base_dir = os.path.abspath(args.base_dir or IMAGE_SAVE_BASE_DIR)
+    found = None
+    try:
+        ts = float(args.at)
+    except ValueError:
+        try:
+            ts = datetime.strptime(args.at, "%Y-%m-%d %H:%M:%S").timestamp()
+        except ValueError:
+            ts = parse_capture_timestamp(args.at)
+            if ts is None:
+                logger.error(f"无法解析时间 '{args.at}'，应为 'YYYY-MM-DD HH:MM:SS'、epoch 秒或抓拍文件名。")
+                return 2
+            path = find_capture_path(base_dir, args.at)  # 原始文件仍在时按文件名直接定位（与分片布局无关）
+            frame = cv2.imread(path, cv2.IMREAD_COLOR) if path else None
+            if frame is not None:
+                found = (frame, ts, os.path.basename(path))
+    if found is None:
+        found = extract_archived_frame(base_dir, ts)
+    if found is None:
+        logger.error(f"{args.at} 所在日期没有可取回的帧。")
+        return 1
+    frame, capture_ts, name = found
+    if not cv2.imwrite(args.output, frame):
+        logger.error(f"写入 {args.output} 失败。")
+        return 1
+    print(json.dumps({"output": args.output, "source": name, "ts": capture_ts,
+                      "offset_s": round(capture_ts - ts, 3)}, ensure_ascii=False))
+    return 0
+
+# 参数扫描可调项：命令行名称 -> 全局配置名
+SWEEP_PARAMETERS = {
+    "threshold": "SIMILARITY_THRESHOLD_PERCENT_INT",
+    "pixel_threshold": "DEFAULT_CONTOUR_PIXEL_THRESHOLD",
+    "max_width": "SIMILARITY_MAX_WIDTH",
+    "dilation": "DEFAULT_CONTOUR_DILATION_ITERATIONS",
+    "min_area": "DEFAULT_CONTOUR_MIN_AREA_FILTER",
+}
+_SWEEP_DATA: dict = {}  # 工作进程共享的已解码序列（fork 下写时复制，不重复解码）
+
+def load_sweep_sequence(input_path: str, widths: list[int], exclude_overlays: bool) -> dict:
+    """加载录制序列并为每个比较宽度生成缩小灰度帧（每帧只解码一次）。
+
+    - 目录：按文件名排序的 JPEG/WebP/AVIF/PNG（抓拍文件名可解析拍摄时间）
+    - .npy：原始帧数组 (N, H, W[, C])，C=2 视为 YUYV；字节数以 JPEG_SAVE_QUALITY 编码一次估算
+    """
+    data: dict = {"frames": {}, "bytes": [], "timestamps": [], "regions": {}}
+    if os.path.isdir(input_path):
+        paths = list_input_images(input_path)
+        data["frames"], full_size = decode_reduced_multi(paths, widths)
+        for path in paths:
+            try:
+                data["bytes"].append(os.path.getsize(path))
+            except OSError:
+                data["bytes"].append(0)
+        for idx, path in enumerate(paths):
+            ts = parse_capture_timestamp(path)
+            data["timestamps"].append(ts if ts is not None else float(idx))
+        region_specs = build_offline_regions(full_size, exclude_overlays) if full_size else []
+    else:
+        raw = np.load(input_path, mmap_mode="r")
+        data["frames"] = {w: [] for w in widths}
+        full_size = (raw.shape[2], raw.shape[1]) if raw.ndim >= 3 else None
+        for idx in range(raw.shape[0]):
+            frame = np.asarray(raw[idx])
+            if frame.ndim == 3 and frame.shape[2] == 2:
+                frame = cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_YUYV)
+            ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_SAVE_QUALITY])
+            data["bytes"].append(len(buf) if ok else 0)
+            data["timestamps"].append(float(idx))
+            for w in widths:
+                data["frames"][w].append(reduce_frame_for_similarity(frame, w))
+        region_specs = list(DETECTION_REGIONS_CONFIG)  # 原始帧没有烧录叠加层
+    for w in widths:
+        reduced = next((f for f in data["frames"][w] if f is not None), None)
+        data["regions"][w] = (RegionMask(region_specs, full_size, (reduced.shape[1], reduced.shape[0]))
+                              if region_specs and reduced is not None and full_size else None)
+    return data
+
+def _init_sweep_worker(overrides: dict, data: dict) -> None:
+    global _SWEEP_DATA
+    _init_offline_worker(overrides)
+    _SWEEP_DATA = data
+
+def evaluate_sweep_combo(combo: dict) -> dict:
+    """在工作进程中评估一组参数：重放保留判定并统计 CPU 耗时。"""
+    for key, value in combo.items():
+        globals()[SWEEP_PARAMETERS[key]] = value
+    width = combo["max_width"]
+    frames = _SWEEP_DATA["frames"][width]
+    t_cpu0 = time.process_time()
+    decisions = select_keyframes(frames, _SWEEP_DATA["timestamps"], combo["threshold"], _SWEEP_DATA["regions"][width])
+    cpu_s = time.process_time() - t_cpu0
+    return {
+        "params": combo,
+        "decisions": decisions,
+        "cpu_ms_per_frame": round(cpu_s * 1000.0 / max(1, len(frames)), 3),
+    }
+
+def _parse_sweep_grid(grid_args: list[str] | None) -> dict[str, list]:
+    """解析 --grid name=v1,v2,...；未给出的参数取当前配置值。"""
+    grid = {key: [globals()[name]] for key, name in SWEEP_PARAMETERS.items()}
+    for item in grid_args or []:
+        key, _, values = item.partition("=")
+        key = key.strip().replace("-", "_")
+        if key not in SWEEP_PARAMETERS or not values:
+            raise ValueError(f"无效的 --grid 参数: '{item}'（可选: {', '.join(SWEEP_PARAMETERS)}）")
+        cast = float if key == "min_area" else int
+        grid[key] = [cast(v) for v in values.split(",") if v.strip()]
+    return grid
+
+def run_sweep(args) -> int:
+    """阈值扫描：对录制序列评估参数网格，输出每组参数的保留帧数、估算字节、CPU/帧及与基线的一致率。
+
+    - 序列只解码、缩小一次（每个比较宽度一份），所有参数组合共享
+    - 基线默认为当前配置的判定；--baseline 可指定先前用 --write-baseline 保存的判定集（CI 回归）
+    - --min-agreement：当前配置与基线一致率低于该值时返回 1
+    """
+    if not args.input:
+        logger.error("[SWEEP] 需要 --input（抓拍目录或 .npy 原始帧）")
+        return 2
+    try:
+        grid = _parse_sweep_grid(args.grid)
+    except ValueError as e:
+        logger.error(f"[SWEEP] {e}")
+        return 2
+    current = {key: globals()[name] for key, name in SWEEP_PARAMETERS.items()}
+    keys = list(SWEEP_PARAMETERS)
+    combos = [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+    if current not in combos:
+        combos.insert(0, current)
+    t0 = time.perf_counter()
+    data = load_sweep_sequence(args.input, sorted(set(grid["max_width"]) | {current["max_width"]}),
+                               not args.keep_overlays)
+    decode_s = time.perf_counter() - t0
+    n_frames = len(data["bytes"])
+    logger.info(f"[SWEEP] 序列 {args.input}: {n_frames} 帧, 解码+缩小 {decode_s:.2f}s, {len(combos)} 组参数")
+
+    workers = max(1, args.workers or os.cpu_count() or 1)
+    overrides = {"KEYFRAME_CACHE_SIZE": KEYFRAME_CACHE_SIZE,
+                 "KEYFRAME_CACHE_EXPIRY_SECONDS": KEYFRAME_CACHE_EXPIRY_SECONDS,
+                 "KEYFRAME_HASH_MAX_DISTANCE": KEYFRAME_HASH_MAX_DISTANCE}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_sweep_worker,
+                                                initargs=(overrides, data)) as pool:
+        results = list(pool.map(evaluate_sweep_combo, combos))
+
+    current_decisions = next(r["decisions"] for r in results if r["params"] == current)
+    baseline = current_decisions
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = [bool(d) for d in json.load(f)["decisions"]]
+        if len(baseline) != n_frames:
+            logger.error(f"[SWEEP] 基线帧数 {len(baseline)} 与序列帧数 {n_frames} 不一致")
+            return 2
+    if args.write_baseline:
+        with open(args.write_baseline, "w", encoding="utf-8") as f:
+            json.dump({"input": args.input, "params": current, "decisions": [int(d) for d in current_decisions]}, f)
+
+    rows = []
+    for res in results:
+        decisions = res["decisions"]
+        row = dict(res["params"])
+        row.update({
+            "is_current": res["params"] == current,
+            "frames": n_frames,
+            "kept": sum(decisions),
+            "kept_percent": round(sum(decisions) * 100.0 / max(1, n_frames), 2),
+            "est_bytes": sum(b for b, keep in zip(data["bytes"], decisions) if keep),
+            "cpu_ms_per_frame": res["cpu_ms_per_frame"],
+            "agreement": round(sum(a == b for a, b in zip(decisions, baseline)) / max(1, n_frames), 4),
+            "missed_keeps": sum(1 for a, b in zip(decisions, baseline) if b and not a),
+            "extra_keeps": sum(1 for a, b in zip(decisions, baseline) if a and not b),
+        })
+        rows.append(row)
+    rows.sort(key=lambda r: (r["est_bytes"], -r["agreement"]))
+
+    if args.output and args.output.lower().endswith(".csv"):
+        import csv
+        with open(args.output, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        write_offline_report(args, {"input": args.input, "frames": n_frames, "decode_s": round(decode_s, 2),
+                                    "workers": workers, "results": rows})
+    current_row = next(r for r in rows if r["is_current"])
+    logger.info(f"[SWEEP] 完成: 当前配置保留 {current_row['kept']}/{n_frames}, 与基线一致率 {current_row['agreement']:.4f}")
+    if args.min_agreement is not None and current_row["agreement"] < args.min_agreement:
+        logger.error(f"[SWEEP] 一致率 {current_row['agreement']:.4f} 低于要求 {args.min_agreement}")
+        return 1
+    return 0
+
+def _bench_frames(args, count: int = 8) -> tuple[list[np.ndarray], str]:
+    """基准输入：--input 目录中的图片（BGR），否则生成带移动色块的合成帧（可选 YUYV 双通道）。"""
+    if args.input and os.path.isdir(args.input):
+        paths = list_input_images(args.input)[:count]
+        frames = [f for f in (cv2.imread(p, cv2.IMREAD_COLOR) for p in paths) if f is not None]
+        if frames:
+            return frames, "MJPG"
+    width, height = DEFAULT_WIDTH, DEFAULT_HEIGHT
+    fourcc = (args.fourcc or "MJPG").upper()
+    rng = np.random.default_rng(0)
+    background = cv2.GaussianBlur(rng.integers(0, 255, (height, width, 3), np.uint8), (31, 31), 0)
+    frames = []
+    for i in range(count):
+        frame = background.copy()
+        if i % 2:
+            x = (i * width // count) % max(1, width - width // 4)
+            frame[height // 4:height // 2, x:x + width // 4] = 220
+        if fourcc in ("YUYV", "YUY2"):
+            yuv = cv2.cvtColor(frame, cv2.COLOR_BGR2YUV)
+            packed = np.empty((height, width, 2), np.uint8)
+            packed[:, :, 0] = yuv[:, :, 0]
+            packed[:, 0::2, 1] = yuv[:, 0::2, 1]
+            packed[:, 1::2, 1] = yuv[:, 1::2, 2]
+            frame = packed
+        frames.append(frame)
+    return frames, fourcc
+
+def _bench_variant(frames: list[np.ndarray], fourcc: str, n_frames: int, overrides: dict) -> dict:
+    """在临时目录中运行 process_and_save_frame，统计耗时分位数与逐帧分配字节数。
+
+    分配字节数取 tracemalloc 在单帧内的峰值增量（NumPy/OpenCV 输出数组均经 NumPy 分配器，可被追踪），
+    即每帧需要的临时内存；池化稳态下应只剩 JPEG 编码等无法复用的部分。
+    """
+    import tempfile
+    import tracemalloc
+    saved = {name: globals()[name] for name in overrides}
+    globals().update(overrides)
+    tmp_dir = tempfile.mkdtemp(prefix="capture-bench-")
+    try:
+        state = ServiceState()
+        times_ms, alloc_bytes = [], []
+        saved_count = 0
+        tracemalloc.start()
+        for i in range(n_frames):
+            src = frames[i % len(frames)]
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            t0 = time.perf_counter()
+            # 模拟 cap.read()：池化时写入复用的采集缓冲区，否则每帧得到新数组
+            if state.buffers is not None:
+                frame = state.buffers.get("capture", src.shape)
+                np.copyto(frame, src)
+            else:
+                frame = src.copy()
+            result = process_and_save_frame(state, frame, fourcc, tmp_dir, JPEG_SAVE_QUALITY, TIMESTAMP_FORMAT)
+            saved_count += int(isinstance(result, str) and os.path.isfile(result))
+            times_ms.append((time.perf_counter() - t0) * 1000.0)
+            alloc_bytes.append(tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+    finally:
+        globals().update(saved)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    warm = max(1, min(len(frames), n_frames // 4))  # 排除首轮（缓冲区/字形缓存建立）
+    steady_ms = sorted(times_ms[warm:]) or sorted(times_ms)
+    steady_alloc = alloc_bytes[warm:] or alloc_bytes
+    return {
+        "frames": n_frames,
+        "saved": saved_count,
+        "ms_p50": round(steady_ms[len(steady_ms) // 2], 3),
+        "ms_p95": round(steady_ms[min(len(steady_ms) - 1, int(0.95 * len(steady_ms)))], 3),
+        "alloc_bytes_per_frame": int(sum(steady_alloc) / len(steady_alloc)),
+        "alloc_bytes_per_frame_max": int(max(steady_alloc)),
+        "buffer_pool": state.buffers.stats() if state.buffers else {},
+    }
+
+def _bench_logging_variant(frames: list[np.ndarray], fourcc: str, n_frames: int,
+                           level: str, use_queue: bool) -> dict:
+    """在缓冲池配置下以指定日志级别与输出方式运行基准，日志写入临时文件（不输出到终端）。"""
+    import tempfile
+    log_dir = tempfile.mkdtemp(prefix="capture-bench-log-")
+    saved_level, saved_handlers = logger.level, list(_log_handlers)
+    handler = logging.FileHandler(os.path.join(log_dir, "bench.log"), encoding="utf-8")
+    handler.setFormatter(saved_handlers[0].formatter if saved_handlers else logging.Formatter())
+    _log_handlers[:] = [handler]
+    logger.setLevel(getattr(logging, level))
+    attach_log_handlers(logger, use_queue)
+    try:
+        result = _bench_variant(frames, fourcc, n_frames, {"FRAME_BUFFER_POOL_ENABLED": True})
+        flush_log_queue()
+        result["log_bytes_per_frame"] = int(os.path.getsize(handler.baseFilename) / n_frames)
+    finally:
+        _log_handlers[:] = saved_handlers
+        logger.setLevel(saved_level)
+        attach_log_handlers(logger, LOG_ASYNC_ENABLED)
+        handler.close()
+        shutil.rmtree(log_dir, ignore_errors=True)
+    return result
+
+# 日志开销基准：名称 -> (日志级别, 是否经队列异步写出)；与 buffer_pool 变体对比即为每帧日志开销
+BENCH_LOGGING_VARIANTS = {
+    "log_info_async": ("INFO", True),
+    "log_debug_sync": ("DEBUG", False),
+    "log_debug_async": ("DEBUG", True),
+}
+
+# 基准变体：名称 -> 全局配置覆盖
+BENCH_VARIANTS = {
+    "no_pool": {"FRAME_BUFFER_POOL_ENABLED": False},
+    "buffer_pool": {"FRAME_BUFFER_POOL_ENABLED": True},
+}
+
+def _bench_output_formats(args) -> dict:
+    """各输出格式在同一组帧上的逐帧字节数与编码耗时（当前 CPU、当前配置的质量/速度参数）。
+
+    --input 为录制的一天时按时间均匀抽取至多 --frames 张，覆盖昼夜不同内容；否则使用合成帧。
+    """
+    frames: list[np.ndarray] = []
+    if args.input and os.path.isdir(args.input):
+        paths = list_input_images(args.input)
+        step = max(1, len(paths) // max(1, args.frames))
+        frames = [f for f in (cv2.imread(p, cv2.IMREAD_COLOR) for p in paths[::step][:args.frames]) if f is not None]
+    if not frames:
+        frames = [f if f.ndim == 3 and f.shape[2] == 3 else cv2.cvtColor(f, cv2.COLOR_YUV2BGR_YUYV)
+                  for f in _bench_frames(args)[0]]
+    results = {}
+    for fmt, extension in OUTPUT_FORMAT_EXTENSIONS.items():
+        if not output_format_supported(fmt):
+            results[fmt] = {"supported": False}
+            continue
+        quality = output_quality(fmt)
+        params = output_encode_params(fmt, quality)
+        cv2.imencode(extension, frames[0], params)  # 预热（编码器初始化）
+        times_ms, sizes = [], []
+        for frame in frames:
+            t0 = time.perf_counter()
+            ok, encoded = cv2.imencode(extension, frame, params)
+            times_ms.append((time.perf_counter() - t0) * 1000.0)
+            sizes.append(int(encoded.size) if ok else 0)
+        times_ms.sort()
+        results[fmt] = {
+            "supported": True,
+            "options": {**OUTPUT_FORMAT_OPTIONS.get(fmt, {}), "quality": quality},
+            "bytes_per_frame": int(sum(sizes) / len(sizes)),
+            "encode_ms_p50": round(times_ms[len(times_ms) // 2], 2),
+            "encode_ms_p95": round(times_ms[min(len(times_ms) - 1, int(0.95 * len(times_ms)))], 2),
+        }
+    base = results.get("jpeg", {})
+    for fmt, row in results.items():
+        if row.get("supported") and base.get("bytes_per_frame"):
+            row["size_vs_jpeg"] = round(row["bytes_per_frame"] / base["bytes_per_frame"], 3)
+            row["encode_ms_vs_jpeg"] = round(row["encode_ms_p50"] / max(1e-6, base["encode_ms_p50"]), 2)
+            logger.info(f"[BENCH] {fmt}: {row['bytes_per_frame'] / 1024:.1f}KiB/帧 ({row['size_vs_jpeg']:.2f}x JPEG), "
+                        f"编码 p50 {row['encode_ms_p50']:.1f}ms ({row['encode_ms_vs_jpeg']:.1f}x JPEG)")
+    h, w = frames[0].shape[:2]
+    return {"size": f"{w}x{h}", "frames": len(frames), "formats": results}
+
+def _bench_quality_gate(args) -> dict:
+    """帧质量门限自检：在合成场景上逐项构造残帧/撕裂/失焦/过曝帧，核对拒绝原因并测量单帧耗时。
+
+    每个用例使用同一个已预热（20 张正常帧）门限的独立副本，按当前配置的阈值判定；阈值为 0 的用例记为 disabled。
+    """
+    import copy
+    width = args.max_width or SIMILARITY_MAX_WIDTH
+    height = width * 9 // 16
+    rng = np.random.default_rng(0)
+    scene = cv2.GaussianBlur(rng.integers(0, 256, (height, width), dtype=np.uint8), (0, 0), 2)
+    gradient = np.tile(np.linspace(40, 200, width).astype(np.uint8), (height, 1))
+    scene = cv2.addWeighted(scene, 0.6, gradient, 0.4, 0)
+    scene[height // 2:] = cv2.add(scene[height // 2:], 20)  # 静态的水平边缘（地平线），不应判为撕裂
+
+    def live() -> np.ndarray:
+        return cv2.add(scene, rng.integers(0, 4, scene.shape, dtype=np.uint8))  # 传感器噪声
+
+    def band() -> np.ndarray:
+        frame = live()
+        frame[height - max(2, int(height * 0.15)):] = 150  # 残帧：底部填充为单一灰度
+        return frame
+
+    def tear() -> np.ndarray:
+        frame = live()
+        frame[height * 3 // 5:] = cv2.add(np.roll(frame[height * 3 // 5:], width // 5, axis=1), 60)
+        return frame
+
+    cases = [
+        ("good", None, "", live),
+        ("dimmed", None, "", lambda: cv2.convertScaleAbs(live(), alpha=0.3)),
+        ("band", "band", "QUALITY_BAND_MIN_FRACTION", band),
+        ("tear", "tear", "QUALITY_TEAR_MIN_DIFF", tear),
+        ("blur", "blur", "QUALITY_BLUR_RELATIVE", lambda: cv2.GaussianBlur(live(), (0, 0), 4)),
+        ("saturated", "saturated", "QUALITY_SATURATED_MAX_FRACTION", lambda: np.full_like(scene, 255)),
+    ]
+    warm = FrameQualityGate()
+    for _ in range(20):
+        warm.check(live())
+    results = {}
+    for name, expected, threshold_name, make in cases:
+        if threshold_name and not globals()[threshold_name] > 0:
+            results[name] = {"expected": expected, "status": "disabled"}
+            continue
+        got = copy.deepcopy(warm).check(make())
+        results[name] = {"expected": expected, "got": got, "status": "ok" if got == expected else "mismatch"}
+
+    # 场景中新出现的水平边缘（放下百叶窗）：拒绝若干帧后须重建基线并恢复接受
+    gate = copy.deepcopy(warm)
+    scene[height * 3 // 5:] = cv2.add(scene[height * 3 // 5:], 60)
+    verdicts = [gate.check(live()) for _ in range(30)]
+    accepted_from = next((i for i, v in enumerate(verdicts) if v is None), None)
+    recovered = accepted_from is not None and all(v is None for v in verdicts[accepted_from:])
+    results["new_edge"] = {"rejected_before_rebaseline": accepted_from if accepted_from is not None else len(verdicts),
+                           "status": "ok" if recovered or not QUALITY_TEAR_MIN_DIFF > 0 else "mismatch"}
+
+    timing_gate = copy.deepcopy(warm)
+    frames = [live() for _ in range(16)]
+    durations = []
+    for i in range(max(16, args.frames)):
+        t0 = time.perf_counter()
+        timing_gate.check(frames[i % len(frames)])
+        durations.append((time.perf_counter() - t0) * 1000.0)
+    durations.sort()
+    return {
+        "size": f"{width}x{height}",
+        "cases": results,
+        "check_ms_p50": round(durations[len(durations) // 2], 3),
+        "check_ms_p95": round(durations[min(len(durations) - 1, int(0.95 * len(durations)))], 3),
+        "passed": all(r["status"] != "mismatch" for r in results.values()),
+    }
+
+def run_bench(args) -> int:
+    """处理流水线基准：在同一组帧上对比各变体的逐帧耗时与逐帧分配字节数，输出 JSON。
+
+    --formats 时改为对比各输出格式的逐帧字节数与编码耗时；
+    --quality-gate 时改为帧质量门限自检（合成缺陷帧的拒绝原因与单帧耗时），有不符时返回 1。
+    """
+    if args.formats:
+        print(json.dumps(_bench_output_formats(args), ensure_ascii=False, indent=2))
+        return 0
+    if args.quality_gate:
+        report = _bench_quality_gate(args)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return 0 if report["passed"] else 1
+    frames, fourcc = _bench_frames(args)
+    n_frames = max(len(frames), args.frames)
+    results = {}
+    runs = [(name, lambda o=overrides: _bench_variant(frames, fourcc, n_frames, o))
+            for name, overrides in BENCH_VARIANTS.items()]
+    runs += [(name, lambda lv=level, q=use_queue: _bench_logging_variant(frames, fourcc, n_frames, lv, q))
+             for name, (level, use_queue) in BENCH_LOGGING_VARIANTS.items()]
+    for name, run in runs:
+        results[name] = run()
+        if "buffer_pool" in results and name in BENCH_LOGGING_VARIANTS:
+            results[name]["log_ms_per_frame"] = round(results[name]["ms_p50"] - results["buffer_pool"]["ms_p50"], 3)
+        logger.info(f"[BENCH] {name}: p50 {results[name]['ms_p50']:.2f}ms, p95 {results[name]['ms_p95']:.2f}ms, "
+                    f"分配 {results[name]['alloc_bytes_per_frame'] / 1024:.1f}KiB/帧")
+    h, w = frames[0].shape[:2]
+    print(json.dumps({"size": f"{w}x{h}", "fourcc": fourcc, "variants": results}, ensure_ascii=False, indent=2))
+    return 0
+
+def reshard_day(task: dict) -> dict:
+    """把一个日期目录内的抓拍移动到目标分片布局（在线程池中执行）。
+
+    目标位置只由文件名（拍摄时间）决定，移动是同一文件系统内的原子 rename：中断后重新运行只会移动
+    尚未就位的文件。目标已存在同名文件时不覆盖，计为冲突并保留源文件。task 带有变更日志时，
+    整天的移动在结束时一次写入。
+    """
+    day_dir = task["day_dir"]
+    changefeed = task.get("changefeed")
+    result = {"day": task["rel_day"], "files": 0, "moved": 0, "in_place": 0, "conflicts": 0, "errors": 0}
+    created: set[str] = set()
+    moves = []
+    for path in list_day_captures(day_dir):
+        dt = parse_capture_datetime(path)
+        if dt is None:
+            continue
+        result["files"] += 1
+        dest_dir = os.path.join(day_dir, capture_shard_relpath(dt, task["shard_format"]))
+        dest = os.path.normpath(os.path.join(dest_dir, os.path.basename(path)))
+        if dest == os.path.normpath(path):
+            result["in_place"] += 1
+            continue
+        if task["dry_run"]:
+            result["moved"] += 1
+            continue
+        try:
+            if dest_dir not in created:
+                os.makedirs(dest_dir, exist_ok=True)
+                created.add(dest_dir)
+            if os.path.exists(dest):
+                result["conflicts"] += 1
+                logger.warning(f"[RESHARD] 目标已存在，保留源文件: {path} -> {dest}")
+                continue
+            os.rename(path, dest)
+            result["moved"] += 1
+            if changefeed is not None:
+                moves.append((os.path.relpath(path, task["base_dir"]).replace(os.sep, "/"),
+                              os.path.relpath(dest, task["base_dir"]).replace(os.sep, "/"), os.path.getsize(dest)))
+        except OSError as e:
+            result["errors"] += 1
+            logger.error(f"[RESHARD] 移动 {path} 失败: {e}")
+    if moves:
+        changefeed.moved(moves)
+    if not task["dry_run"]:
+        if result["moved"]:
+            sync_filesystem(day_dir)
+        result["pruned_dirs"] = remove_empty_shard_dirs(day_dir)
+    return result
+
+def run_reshard(args) -> int:
+    """把已有归档原地迁移到目标分片布局：按天并行（线程池，rename 只涉及元数据），可随时中断后重新运行。
+
+    先修改 paths.capture_shard_format 并重启服务，再迁移历史目录；当天目录默认跳过（服务仍在写入）。
+    迁移前后读取一侧都能列出两种布局，迁移期间清理、冷归档与离线工具照常工作。
+    """
+    base_dir = os.path.abspath(args.base_dir or IMAGE_SAVE_BASE_DIR)
+    try:
+        shard_format = validate_shard_format(CAPTURE_SHARD_FORMAT if args.shard_format is None else args.shard_format)
+    except ValueError as e:
+        logger.error(f"[RESHARD] --shard-format 无效: {e}")
+        return 2
+    if shard_format != CAPTURE_SHARD_FORMAT:
+        logger.warning(f"[RESHARD] 目标布局 '{shard_format}' 与当前配置 '{CAPTURE_SHARD_FORMAT}' 不同："
+                       f"服务新写入的文件仍按配置布局存放（读取不受影响）。")
+    today = datetime.now().strftime("%Y-%m/%d")
+    tasks = []
+    for day_dir in list_day_dirs(base_dir):
+        rel_day = os.path.relpath(day_dir, base_dir)
+        day_key = rel_day.replace(os.sep, "/")
+        if day_key == today and not args.include_today:
+            continue
+        if (args.from_day and day_key < args.from_day) or (args.to_day and day_key > args.to_day):
+            continue
+        tasks.append({"day_dir": day_dir, "rel_day": rel_day, "base_dir": base_dir, "shard_format": shard_format,
+                      "dry_run": args.dry_run})
+    # 移动对下游而言是“旧路径删除 + 新路径新增”；无法写入变更日志时由 open_offline_changefeed 提示全量同步
+    changefeed = open_offline_changefeed(base_dir, args.changefeed) if tasks and not args.dry_run else None
+    for task in tasks:
+        task["changefeed"] = changefeed
+    workers = max(1, args.workers or os.cpu_count() or 1)
+    logger.info(f"[RESHARD] {base_dir}: {len(tasks)} 个日期目录 -> 分片 '{shard_format or '(不分片)'}', "
+                f"线程数 {workers}{', dry-run' if args.dry_run else ''}")
+    t0 = time.perf_counter()
+    results = []
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(reshard_day, task): task for task in tasks}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    res = future.result()
+                except Exception as e:
+                    logger.error(f"[RESHARD] 处理 {futures[future]['rel_day']} 失败: {e}")
+                    continue
+                results.append(res)
+                if res["moved"] or res["conflicts"] or res["errors"]:
+                    logger.info(f"[RESHARD] {res['day']}: {res['files']} 个文件, 移动 {res['moved']}, "
+                                f"已就位 {res['in_place']}, 冲突 {res['conflicts']}, 错误 {res['errors']}")
+    finally:
+        if changefeed is not None:
+            changefeed.close()
+    elapsed = time.perf_counter() - t0
+    results.sort(key=lambda r: r["day"])
+    files = sum(r["files"] for r in results)
+    report = {
+        "base_dir": base_dir,
+        "shard_format": shard_format,
+        "dry_run": args.dry_run,
+        "days": len(results),
+        "files": files,
+        "moved": sum(r["moved"] for r in results),
+        "in_place": sum(r["in_place"] for r in results),
+        "conflicts": sum(r["conflicts"] for r in results),
+        "errors": sum(r["errors"] for r in results),
+        "workers": workers,
+        "elapsed_s": round(elapsed, 2),
+        "files_per_s": round(files / elapsed, 1) if elapsed > 0 else 0.0,
+        "per_day": [r for r in results if r["moved"] or r["conflicts"] or r["errors"]],
+    }
+    write_offline_report(args, report)
+    return 1 if report["errors"] or report["conflicts"] else 0
+
+# --- Soak Test Harness ---
+# 判定为漂移所需的最小增长量（整段测量期内的拟合增长），低于该值即使统计上显著也视为噪声；
+# None 表示取基线中位数的 25%（至少 1ms）
+SOAK_DRIFT_TOLERANCES = {"rss_mb": 8.0, "fds": 1.0, "threads": 1.0, "latency_p50_ms": None}
+SOAK_T_CRITICAL = 4.0       # 斜率 t 统计量阈值（单侧，只检测增长）
+SOAK_MIN_SAMPLES = 10
+SOAK_MARKER_FILE = ".capture-soak"
+
+class SyntheticCamera:
+    """合成帧源（替代 cv2.VideoCapture）：固定噪声底图 + 缓慢移动的小色块，每 50 帧切换一次整体亮度（产生保存）。
+
+    fail_reads > 0 时读帧失败并递减（主循环随之释放并重建“相机”，即一次重连）。
+    """
+    SCENE_FRAMES = 50
+
+    def __init__(self, width: int, height: int, seed: int = 0) -> None:
+        self.width, self.height = width, height
+        self.frame_idx = 0
+        self.fail_reads = 0
+        self.opened = True
+        self._noise = np.random.default_rng(seed).integers(0, 8, (height, width, 3), dtype=np.uint8)
+
+    def isOpened(self) -> bool:
+        return self.opened
+
+    def grab(self) -> bool:
+        return self.opened
+
+    def read(self, image: np.ndarray | None = None):
+        if self.fail_reads > 0:
+            self.fail_reads -= 1
+            return False, None
+        self.frame_idx += 1
+        shape = (self.height, self.width, 3)
+        frame = image if isinstance(image, np.ndarray) and image.shape == shape else np.empty(shape, np.uint8)
+        frame[:] = 60 + 12 * ((self.frame_idx // self.SCENE_FRAMES) % 12)
+        cv2.add(frame, self._noise, dst=frame)
+        block = max(2, self.width // 64)
+        x = (self.frame_idx * 2) % (self.width - block)
+        frame[self.height // 2:self.height // 2 + block, x:x + block] = 255
+        return True, frame
+
+    def set(self, prop_id: int, value) -> bool:
+        return True
+
+    def get(self, prop_id: int) -> float:
+        return {cv2.CAP_PROP_FRAME_WIDTH: self.width, cv2.CAP_PROP_FRAME_HEIGHT: self.height}.get(prop_id, 0.0)
+
+    def release(self) -> None:
+        self.opened = False
+
+def _read_proc_status() -> dict[str, int]:
+    """读取 /proc/self/status 中的 VmRSS（kB）与 Threads（含 OpenCV 等原生线程）。"""
+    values = {}
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("VmRSS", "Threads"):
+                    values[key] = int(rest.split()[0])
+    except (OSError, ValueError, IndexError):
+        pass
+    return values
+
+def soak_sample(state: ServiceState, t0: float) -> dict:
+    """一次资源/耗时采样：RSS、打开的文件描述符、线程数、处理耗时窗口的 p50/p95。"""
+    status = _read_proc_status()
+    try:
+        fds = len(os.listdir("/proc/self/fd"))
+    except OSError:
+        fds = None
+    try:
+        recent = sorted(state.processing_times_ms)
+    except RuntimeError:  # 主线程并发追加
+        recent = []
+    return {
+        "t": round(time.monotonic() - t0, 2),
+        "frames": state.frames_captured,
+        "rss_mb": round(status["VmRSS"] / 1024.0, 2) if "VmRSS" in status else None,
+        "fds": fds,
+        "threads": status.get("Threads", threading.active_count()),
+        "latency_p50_ms": round(recent[len(recent) // 2], 3) if recent else None,
+        "latency_p95_ms": round(recent[min(len(recent) - 1, int(0.95 * len(recent)))], 3) if recent else None,
+    }
+
+def soak_drift(samples: list[dict], metric: str, warmup: float, tolerance: float | None) -> dict:
+    """对预热后的采样做 指标~帧数 的最小二乘拟合，斜率显著为正（t >= SOAK_T_CRITICAL）且
+    整段拟合增长超过容差时判定为漂移。以帧数而非时间为自变量，故障退避造成的停顿不影响斜率。
+    """
+    points = [(s["frames"], s[metric]) for s in samples if s.get(metric) is not None]
+    points = points[int(len(points) * warmup):]
+    if len(points) < SOAK_MIN_SAMPLES or points[-1][0] == points[0][0]:
+        return {"samples": len(points), "verdict": "inconclusive"}
+    x = np.array([p[0] for p in points], dtype=np.float64)
+    y = np.array([p[1] for p in points], dtype=np.float64)
+    slope, intercept = np.polyfit(x, y, 1)
+    resid = y - (slope * x + intercept)
+    sxx = float(np.sum((x - x.mean()) ** 2))
+    se = math.sqrt(float(np.sum(resid ** 2)) / (len(x) - 2) / sxx) if sxx > 0 else 0.0
+    t_stat = slope / se if se > 0 else (1e9 if slope > 0 else 0.0)
+    growth = float(slope * (x[-1] - x[0]))
+    baseline = float(np.median(y[:max(3, len(y) // 5)]))
+    tol = tolerance if tolerance is not None else max(1.0, 0.25 * baseline)
+    drift = t_stat >= SOAK_T_CRITICAL and growth > tol
+    return {
+        "samples": len(points),
+        "baseline": round(baseline, 3),
+        "last": round(float(y[-1]), 3),
+        "slope_per_100k_frames": round(float(slope) * 1e5, 4),
+        "t_stat": round(min(t_stat, 1e9), 2),
+        "fitted_growth": round(growth, 3),
+        "tolerance": round(tol, 3),
+        "verdict": "drift" if drift else "flat",
+    }
+
+def simulate_day_rollover(state: ServiceState) -> None:
+    """让按天组织的组件走一遍日切路径（浸泡测试加速运行时墙钟不会跨天）：
+    变更日志写日切标记并按需轮转、活动热力图写出并重置、亮度统计关闭并重新打开当天文件。
+    """
+    if state.changefeed is not None:
+        state.changefeed.day = "2000-01/01/"  # 下一次 added 写入该“前一天”的日切标记
+    if state.activity is not None and state.activity.day:
+        state.activity.day = "2000-01/01"  # 下一次 begin_tick 写出“前一天”并重置（也为磁盘清理留下旧日期目录）
+    if state.luma is not None:
+        state.luma._file_dir = None  # 下一次 record 关闭并重新打开文件
+
+def run_soak(args) -> int:
+    """浸泡测试：以合成帧源加速驱动 run_capture_service，周期性注入故障并采样 RSS/FD/线程数/处理耗时，
+    任一指标随帧数显著增长（泄漏或耗时漂移）时返回 1。
+
+    故障按 --faults 轮流注入（每 --fault-every 帧一次）：
+    - read_failure：连续读帧失败 -> 释放并重建相机
+    - imwrite_failure：连续写盘失败（ENOSPC）直到触发清理与退避
+    - disk_cleanup：强制一次磁盘检查并按超阈值清理最旧日期目录（--soak-dir 位于小容量 tmpfs 时也会自然写满）
+    - reload：交替改写配置并触发热重载
+    - day_rollover：各按天组件走一遍日切
+    抓拍与变更日志位于 --soak-dir；日志与 health.json 仍在 --logdir（日志系统在进入本函数前已初始化）。
+    存储路由、冷归档、控制套接字与两级采集在测试中关闭。
+    """
+    import tempfile
+    try:
+        width, height = (int(v) for v in args.soak_size.lower().split("x"))
+    except ValueError:
+        logger.error(f"[SOAK] --soak-size 无效: '{args.soak_size}'，应为 WxH。")
+        return 2
+    faults = [f.strip() for f in (args.faults or "").split(",") if f.strip()]
+    unknown = [f for f in faults if f not in SOAK_FAULTS]
+    if unknown:
+        logger.error(f"[SOAK] 未知故障类型: {', '.join(unknown)}（可选: {', '.join(SOAK_FAULTS)}）")
+        return 2
+    temp_dir = args.soak_dir is None
+    soak_dir = tempfile.mkdtemp(prefix="capture-soak-") if temp_dir else os.path.abspath(args.soak_dir)
+    if not temp_dir and os.path.isdir(soak_dir) and os.listdir(soak_dir) \
+            and not os.path.exists(os.path.join(soak_dir, SOAK_MARKER_FILE)):
+        logger.error(f"[SOAK] {soak_dir} 非空且不是浸泡测试目录；测试会删除其中的日期目录，拒绝运行。")
+        return 2
+    os.makedirs(soak_dir, exist_ok=True)
+    open(os.path.join(soak_dir, SOAK_MARKER_FILE), "a").close()
+    config_path = os.path.join(soak_dir, "soak_config.yaml")
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump({}, f)  # JSON 即合法 YAML；空配置热重载时保留当前值
+    globals().update({
+        "IMAGE_SAVE_BASE_DIR": os.path.join(soak_dir, "captures"),
+        "IMAGE_STORAGE_MONITOR_PATH": soak_dir,
+        "IMAGE_SAVE_FALLBACK_DIR": None,
+        "CONFIG_ENABLED": True,
+        "CONFIG_PATH": config_path,
+        "CAPTURE_SCHEDULE_CONFIG": [{"end_time_exclusive": dt_time(23, 59, 59), "interval_seconds": args.soak_interval}],
+        "DEFAULT_INTERVAL_LATE_NIGHT": args.soak_interval,
+        "DEFAULT_WIDTH": width,
+        "DEFAULT_HEIGHT": height,
+        "CAMERA_INIT_RETRY_DELAY_SECONDS": 0.01,
+        "CAMERA_INIT_LONG_BACKOFF_SECONDS": 0.1,
+        "FRAME_READ_ERROR_RETRY_DELAY_SECONDS": 0.01,
+        "READ_FAILURE_LONG_BACKOFF_SECONDS": 0.1,
+        "IMWRITE_FAILURE_BACKOFF_SECONDS": 0.05,
+        "CONTROL_SOCKET_ENABLED": False,
+        "CAPTURE_PROBE_MODE": "off",
+        "STORAGE_ROUTING_ENABLED": False,
+        "COLD_ARCHIVE_ENABLED": False,
+        "SPOOL_DIR": None,
+        "CHANGEFEED_ENABLED": True,
+        "CHANGEFEED_FILE": os.path.join(soak_dir, "changefeed.jsonl"),
+        "PLANNER_STATE_FILE": None,
+        "ACTIVITY_MAP_ENABLED": True,
+        "ACTIVITY_MAP_DIR": None,
+        "LUMA_STATS_ENABLED": True,
+    })
+    camera: list[SyntheticCamera] = []
+
+    def _synthetic_initialize_camera(camera_path, w, h, req_fourcc_str, state=None):
+        camera[:] = [SyntheticCamera(width, height, seed=len(camera))]
+        if state is not None:
+            state.camera_init_count += 1
+            state.last_camera_init_mode = "synthetic"
+        return camera[0], "MJPG"
+
+    real_write = write_capture_file
+    write_failures = [0]
+
+    def _faulty_write_capture_file(path: str, data) -> None:
+        if write_failures[0] > 0:
+            write_failures[0] -= 1
+            raise OSError(28, "soak: injected ENOSPC")
+        real_write(path, data)
+
+    globals()["initialize_camera"] = _synthetic_initialize_camera
+    globals()["write_capture_file"] = _faulty_write_capture_file
+
+    state = ServiceState()
+    samples: list[dict] = []
+    injected = {name: 0 for name in SOAK_FAULTS}
+    t0 = time.monotonic()
+    disk_limit = IMAGE_STORAGE_MAX_USAGE_PERCENT
+    disk_interval = DISK_CHECK_INTERVAL_SECONDS
+
+    def _inject(name: str) -> tuple[int, object] | None:
+        """注入一次故障；返回 (恢复所需的帧数, 恢复函数) 或 None。"""
+        global IMAGE_STORAGE_MAX_USAGE_PERCENT, DISK_CHECK_INTERVAL_SECONDS
+        injected[name] += 1
+        if name == "read_failure" and camera:
+            camera[0].fail_reads = 3
+        elif name == "imwrite_failure":
+            write_failures[0] = MAX_CONSECUTIVE_IMWRITE_FAILURES
+        elif name == "disk_cleanup":
+            IMAGE_STORAGE_MAX_USAGE_PERCENT, DISK_CHECK_INTERVAL_SECONDS = -1.0, 0
+
+            def _restore():
+                global IMAGE_STORAGE_MAX_USAGE_PERCENT, DISK_CHECK_INTERVAL_SECONDS
+                IMAGE_STORAGE_MAX_USAGE_PERCENT, DISK_CHECK_INTERVAL_SECONDS = disk_limit, disk_interval
+            return 2, _restore
+        elif name == "reload":
+            with open(config_path, "w", encoding="utf-8") as f:
+                json.dump({"image_processing": {"enable_timestamp": injected[name] % 2 == 0}}, f)
+            reload_event.set()
+            wake_event.set()
+        elif name == "day_rollover":
+            simulate_day_rollover(state)
+        return None
+
+    def _controller() -> None:
+        next_sample = t0
+        next_fault = args.fault_every if args.fault_every > 0 and faults else None
+        fault_idx = 0
+        restore: tuple[int, object] | None = None
+        while not shutdown_event.is_set():
+            frames = state.frames_captured
+            now = time.monotonic()
+            if now >= next_sample:
+                samples.append(soak_sample(state, t0))
+                next_sample += args.sample_seconds
+            if restore is not None and frames >= restore[0]:
+                restore[1]()
+                restore = None
+            if next_fault is not None and frames >= next_fault:
+                name = faults[fault_idx % len(faults)]
+                fault_idx += 1
+                next_fault += args.fault_every
+                logger.info(f"[SOAK] 帧 {frames}: 注入故障 {name}")
+                pending = _inject(name)
+                if pending is not None:
+                    restore = (frames + pending[0], pending[1])
+            if frames >= args.soak_frames or (args.soak_seconds and now - t0 >= args.soak_seconds):
+                samples.append(soak_sample(state, t0))
+                shutdown_event.set()
+                wake_event.set()
+                return
+            shutdown_event.wait(0.05)
+
+    logger.info(f"[SOAK] {soak_dir}: 目标 {args.soak_frames} 帧 @ {args.soak_interval}s, {width}x{height}, "
+                f"故障 {', '.join(faults) or '无'} (每 {args.fault_every} 帧)")
+    controller = threading.Thread(target=_controller, name="SoakController", daemon=True)
+    controller.start()
+    run_capture_service(state)
+    controller.join(timeout=5.0)
+    elapsed = time.monotonic() - t0
+
+    metrics = {metric: soak_drift(samples, metric, args.warmup, tolerance)
+               for metric, tolerance in SOAK_DRIFT_TOLERANCES.items()}
+    verdicts = {m["verdict"] for m in metrics.values()}
+    verdict = "fail" if "drift" in verdicts else ("inconclusive" if "inconclusive" in verdicts else "pass")
+    report = {
+        "soak_dir": soak_dir,
+        "verdict": verdict,
+        "frames": state.frames_captured,
+        "frames_saved": state.frames_saved,
+        "elapsed_s": round(elapsed, 1),
+        "frames_per_s": round(state.frames_captured / elapsed, 1) if elapsed > 0 else 0.0,
+        "faults_injected": {k: v for k, v in injected.items() if v},
+        "camera_inits": state.camera_init_count,
+        "schedule": {k: v for k, v in (state.scheduler.stats() if state.scheduler else {}).items() if k != "lateness_histogram"},
+        "metrics": metrics,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({**report, "samples": samples}, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if temp_dir and verdict != "fail":
+        shutil.rmtree(soak_dir, ignore_errors=True)
+    return 1 if verdict == "fail" else 0
+
+OFFLINE_ACTION_HANDLERS = {
+    'rethin': run_rethin,
+    'sweep': run_sweep,
+    'bench': run_bench,
+    'highlights': run_highlights,
+    'archive': run_archive,
+    'extract': run_extract,
+    'reshard': run_reshard,
+    'soak': run_soak,
+}
+
 # --- Main Application Entry Point & CLI Argument Parsing ---
 def main():
     """命令行入口：解析参数、初始化日志、可选加载配置并运行服务。"""
     global logger, PID_FILE_PATH, CONFIG_PATH, CONFIG_ENABLED # Allow modification if args change them
-    global LOG_DIR, IMAGE_SAVE_BASE_DIR, IMAGE_STORAGE_MONITOR_PATH
+    global CONTROL_SOCKET_PATH
+    global LOG_DIR, IMAGE_SAVE_BASE_DIR, IMAGE_STORAGE_MONITOR_PATH, LOG_RATE_LIMIT_BURST
 
-    parser = argparse.ArgumentParser(description=f"{SCRIPT_NAME} - Image Capture Service (v{SCRIPT_VERSION})")
-    parser.add_argument('action', nargs='?', choices=['start', 'stop', 'status', 'foreground'], 
-                        default='foreground', 
-                        help="Action: start (daemonize - for traditional init), stop, status, or foreground (default, for systemd/debug).")
-    parser.add_argument('--pidfile', default=PID_FILE_PATH, 
-                        help=f"Path to PID file (default: {PID_FILE_PATH})")
-    parser.add_argument('--logdir', default=LOG_DIR, help=f"Path to log directory (default: {LOG_DIR})")
-    parser.add_argument('--loglevel', default=LOG_LEVEL_CONFIG, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
-                        help=f"Logging level (default: {LOG_LEVEL_CONFIG})")
-    parser.add_argument('--config', default=CONFIG_PATH, help="Path to YAML config file (optional)")
-    parser.add_argument('--use-config', action='store_true', help="Enable loading YAML config (default: disabled)")
-    # For true daemonization with python-daemon, more args like --user, --group, --working-directory would be needed.
-    # For now, 'start' is conceptual if not using systemd or a proper daemon library.
-
-    args = parser.parse_args()
+    args = build_arg_parser().parse_args()
+    if args.action in LIGHTWEIGHT_ACTIONS:
+        # 通常已在模块顶部（导入 OpenCV 之前）处理；作为库调用 main() 时在此兜底
+        sys.exit(run_lightweight_action(args))
     
     # Resolve writable directories with fallbacks (do not crash on permission issues)
     home_dir = os.path.expanduser('~') or '/tmp'
@@ -1253,8 +6750,9 @@ def main():
         resolved_image_dir = os.path.join(home_dir, 'camera', 'captures')
         os.makedirs(resolved_image_dir, exist_ok=True)
 
-    logger = setup_logging_system(resolved_log_dir, LOG_FILE_NAME, args.loglevel.upper(), 
-                                  LOG_ROTATE_WHEN, LOG_ROTATE_INTERVAL, LOG_ROTATE_BACKUP_COUNT)
+    logger = setup_logging_system(resolved_log_dir, LOG_FILE_NAME, args.loglevel.upper(),
+                                  LOG_ROTATE_WHEN, LOG_ROTATE_INTERVAL, LOG_ROTATE_BACKUP_COUNT,
+                                  console_stream=sys.stderr if args.action in OFFLINE_ACTIONS else None)
 
     # Apply YAML config overrides only when explicitly enabled
     # 更新全局配置路径与开关（用于热重载）
@@ -1262,6 +6760,8 @@ def main():
     CONFIG_ENABLED = bool(args.use_config)
     if CONFIG_ENABLED:
         load_and_apply_yaml_config(args.config)
+        if LOG_ASYNC_ENABLED != (_log_listener is not None):
+            attach_log_handlers(logger, LOG_ASYNC_ENABLED)
 
     # After YAML overrides, re-ensure dirs
     try:
@@ -1282,6 +6782,8 @@ def main():
         PID_FILE_PATH = os.path.abspath(args.pidfile)
     except Exception:
         PID_FILE_PATH = os.path.join('/tmp', os.path.basename(args.pidfile))
+    # 控制套接字路径（绑定失败时 ControlServer 自行回退到 /tmp）
+    CONTROL_SOCKET_PATH = os.path.abspath(args.socket)
 
     # 统一输出一次运行配置概览（方便问题定位）
     try:
@@ -1293,6 +6795,9 @@ def main():
         pass
 
     # Handle actions
+    if args.action in OFFLINE_ACTIONS:
+        LOG_RATE_LIMIT_BURST = 0  # 离线工具逐项汇报进度，不限流
+        sys.exit(OFFLINE_ACTION_HANDLERS[args.action](args))
     if args.action == 'start' or args.action == 'foreground':
         if args.action == 'start': # For 'start', implies daemonization is desired if not under systemd
             logger.info("Action 'start': Daemonization not yet fully implemented in this script for non-systemd. Running in foreground.")
@@ -1334,101 +6839,10 @@ def main():
         finally:
             remove_pid_file() 
             logger.info(f"{SCRIPT_NAME} has shut down.")
+            stop_log_listener()
             logging.shutdown() 
         sys.exit(0) 
 
-    elif args.action == 'stop':
-        logger.info("Action: stop")
-        if not os.path.exists(PID_FILE_PATH):
-            logger.warning(f"PID file {PID_FILE_PATH} not found. Service may not be running.")
-            sys.exit(1) # Changed to 1 as "not running" is often a failure for "stop"
-        terminated_successfully = False
-        try:
-            with open(PID_FILE_PATH, 'r') as f:
-                pid = int(f.read().strip())
-        except (IOError, ValueError) as e:
-            logger.error(f"Invalid PID file {PID_FILE_PATH}: {e}. Remove it manually if service is stuck.")
-            sys.exit(1)
-
-        try:
-            logger.info(f"Sending SIGTERM to process {pid}...")
-            os.kill(pid, signal.SIGTERM)
-
-            terminated_successfully = False
-            logger.info(f"Waiting up to 10 seconds for process {pid} to terminate...")
-            for i in range(10): # Wait up to 10 seconds
-                time.sleep(1) # 等待1秒
-                try:
-                    os.kill(pid, 0) # 检查进程是否仍然存在
-                    logger.debug(f"Process {pid} is still alive (attempt {i+1}/10).")
-                except ProcessLookupError:
-                    logger.info(f"Process {pid} terminated successfully within {i+1} second(s).")
-                    terminated_successfully = True
-                    break # 进程已终止，退出等待循环
-                except Exception as e_check: # 其他检查时发生的错误
-                    logger.error(f"Error checking status for PID {pid}: {e_check}")
-                    # 发生错误，可能无法确认状态，也退出循环
-                    break 
-
-            if not terminated_successfully:
-                # 如果10秒后循环正常结束，但进程未被确认终止（通常意味着os.kill(pid,0)没报错）
-                logger.error(f"Process {pid} did not terminate after 10 seconds. Consider manual check or SIGKILL.")
-                # 您原始代码中在这之后还有一个try/except ProcessLookupError来做最后确认，
-                # 如果这里的逻辑是，即使循环完了，还想再确认一次，是可以保留的。
-                # 但如果上面的循环因为ProcessLookupError退出了，terminated_successfully会是true。
-
-        except ProcessLookupError: # 这个捕获的是 os.kill(pid, signal.SIGTERM) 时，进程就已经不存在的情况
-            logger.info(f"Process {pid} was already terminated or PID was invalid when SIGTERM was attempted.")
-        except PermissionError:
-            logger.error(f"No permission to send signal to process {pid}. Are you root?")
-            sys.exit(1)
-        except Exception as e:
-            logger.error(f"Error stopping service: {e}", exc_info=True)
-            sys.exit(1)
-        finally:
-            if terminated_successfully and os.path.exists(PID_FILE_PATH):
-                # 服务进程已被此 'stop' 命令确认终止，
-                # 但其 PID 文件仍然存在（服务可能未能自行删除）。
-                # 可以安全地将其作为陈旧 PID 文件移除。
-                logger.warning(f"Process {pid} terminated, but its PID file {PID_FILE_PATH} still exists. Removing stale PID file.")
-                remove_pid_file()
-            elif not terminated_successfully and os.path.exists(PID_FILE_PATH):
-                # 服务进程未被此 'stop' 命令确认终止，且 PID 文件仍然存在。
-                # 此时不应自动删除 PID 文件，因为它可能仍然代表一个正在运行（但可能卡住）的进程。
-                logger.warning(f"Process {pid} may still be running after stop attempt. PID file {PID_FILE_PATH} will not be removed by this 'stop' action.")
-                # 如果 os.path.exists(PID_FILE_PATH) 为 False，说明PID文件已经被服务进程自己清掉了，或者一开始就没有，这里不需要额外操作。
-    elif args.action == 'status':
-        logger.info("Action: status")
-        if not os.path.exists(PID_FILE_PATH):
-            print(f"{SCRIPT_NAME} is not running (no PID file).")
-            logger.info(f"{SCRIPT_NAME} is not running (no PID file).")
-            sys.exit(3) 
-        try:
-            with open(PID_FILE_PATH, 'r') as f:
-                pid = int(f.read().strip())
-        except (IOError, ValueError):
-            print(f"{SCRIPT_NAME} status unknown (invalid PID file: {PID_FILE_PATH}).")
-            logger.warning(f"Invalid PID file: {PID_FILE_PATH}")
-            sys.exit(4) 
-        
-        try:
-            os.kill(pid, 0) 
-            print(f"{SCRIPT_NAME} is running with PID {pid}.")
-            logger.info(f"{SCRIPT_NAME} is running with PID {pid}.")
-            sys.exit(0) 
-        except ProcessLookupError:
-            print(f"{SCRIPT_NAME} is not running (PID {pid} from stale PID file {PID_FILE_PATH} not found).")
-            logger.warning(f"Stale PID file: process {pid} not found. Removing PID file.")
-            remove_pid_file()
-            sys.exit(3) 
-        except PermissionError:
-            print(f"{SCRIPT_NAME} with PID {pid} seems to be running, but no permission to check fully.")
-            logger.warning(f"Running with PID {pid}, but no permission to check fully.")
-            sys.exit(4) 
-        except Exception as e:
-            print(f"Error checking status for PID {pid}: {e}")
-            logger.error(f"Error checking status for PID {pid}: {e}", exc_info=True)
-            sys.exit(4) 
 
 if __name__ == "__main__":
     # Basic signal handling for the main entry point itself, before run_capture_service sets its own
@@ -1459,4 +6873,5 @@ if __name__ == "__main__":
         # However, if run_capture_service exited cleanly, it would call logging.shutdown()
         # This is a final failsafe.
         if logging.getLogger(SCRIPT_NAME).hasHandlers(): # Check if logger was indeed set up
+            stop_log_listener()
             logging.shutdown()